@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Runs the benchmark scenarios and prints the results as JSON:
+#
+#     python3 -m bench --users 500 --latency 1 -o results.json
+#
+
+import json
+import logging
+import platform
+import sys
+from optparse import OptionParser
+
+from bench.harness import DEFAULT_MODULES, runScenario, SCENARIOS
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='python3 -m bench [options]')
+    parser.add_option('-s', '--scenario', action='append', choices=sorted(SCENARIOS.keys()),
+                      help='scenario to run, can be given multiple times [default: all]')
+    parser.add_option('-u', '--users', type='int',
+                      help='number of users taking part [default: %default]', default=200)
+    parser.add_option('-l', '--latency', type='float',
+                      help='milliseconds every server call is delayed by [default: %default]', default=0.0)
+    parser.add_option('-m', '--modules',
+                      help='comma separated list of modules to load [default: %default]',
+                      default=','.join(DEFAULT_MODULES))
+    parser.add_option('-o', '--output',
+                      help='write JSON results to this file instead of stdout')
+    parser.add_option('-v', '--verbose', action='store_true',
+                      help='show module log output', default=False)
+    (option, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if option.verbose else logging.CRITICAL,
+                        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    modules = [name.strip() for name in option.modules.split(',') if name.strip()]
+    results = []
+    for name in option.scenario or sorted(SCENARIOS.keys()):
+        result = runScenario(name, option.users, option.latency / 1000.0, modules)
+        print('%-12s %8.0f events/s  p50 %7.3fms  p99 %7.3fms' % (name, result['events_per_sec'] or 0,
+                                                                   result['dispatch']['p50_ms'] or 0,
+                                                                   result['dispatch']['p99_ms'] or 0),
+              file=sys.stderr)
+        results.append(result)
+
+    output = json.dumps({'python': platform.python_version(), 'results': results}, indent=2, sort_keys=True)
+    if option.output:
+        with open(option.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
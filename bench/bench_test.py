@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+from logging import getLogger
+
+from bench.fakeserver import FakeServer, userState
+from bench.harness import Bench, joinStorm, LOBBY_CHANNEL, percentile, runScenario, SCENARIOS
+from mumo_replay import ReplayMurmur
+
+try:
+    import Ice
+except ImportError:
+    Ice = None
+
+
+class FakeServerTest(unittest.TestCase):
+    def setUp(self):
+        self.murmur = ReplayMurmur()
+        self.server = FakeServer(1, self.murmur)
+
+    def testChannels(self):
+        s = self.server
+        parent = s.addChannel("parent", 0)
+        child = s.addChannel("child", parent)
+        self.assertEqual(s.getChannelState(child).parent, parent)
+        self.assertRaises(self.murmur.InvalidChannelException, s.addChannel, "orphan", 1000)
+
+        s.connect(userState(1, "user", channel=child))
+        s.removeChannel(parent)
+        self.assertEqual(sorted(s.getChannels().keys()), [0])
+        self.assertEqual(s.getState(1).channel, 0)
+        self.assertEqual(s.calls["addChannel"], 3)
+
+    def testUsers(self):
+        s = self.server
+        s.connect(userState(1, "user"))
+        state = s.getUsers()[1]
+        state.channel = 5
+        self.assertEqual(s.getState(1).channel, 0)  # Copies are handed out
+        self.assertRaises(self.murmur.InvalidChannelException, s.setState, state)
+
+        s.addUserToGroup(0, 1, "group")
+        self.assertEqual(s.groups[(0, "group")], {1})
+        s.removeUserFromGroup(0, 1, "group")
+        self.assertEqual(s.groups[(0, "group")], set())
+
+
+class BenchTest(unittest.TestCase):
+    def setUp(self):
+        getLogger().disabled = True
+
+    def tearDown(self):
+        getLogger().disabled = False
+
+    def testPercentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 51)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def testJoinStormMovesUsers(self):
+        bench = Bench(["onjoin", "source"])
+        try:
+            bench.start()
+            bench.reset()
+            joinStorm(bench, 64)
+            results = bench.results()
+            server = bench.servers[0]
+
+            self.assertEqual(results["events"], 64)
+            self.assertEqual(results["dispatch"]["samples"], 128)
+            # 1 game, 8 server and 16 team channels
+            self.assertEqual(results["server_calls"]["addChannel"], 25)
+            for session, state in server.users.items():
+                if session % 4 == 0:
+                    self.assertNotIn(state.channel, (0, LOBBY_CHANNEL))
+                else:
+                    self.assertEqual(state.channel, LOBBY_CHANNEL)
+        finally:
+            bench.stop()
+
+    def testScenarios(self):
+        for name in sorted(SCENARIOS.keys()):
+            results = runScenario(name, users=32)
+            self.assertEqual(results["scenario"], name)
+            self.assertGreater(results["events"], 0)
+            self.assertGreater(results["events_per_sec"], 0)
+            self.assertEqual(results["dispatch"]["samples"], results["events"] * 5)
+            self.assertLessEqual(results["dispatch"]["p50_ms"], results["dispatch"]["p99_ms"])
+
+        results = runScenario("afk_sweep", users=32)
+        self.assertEqual(results["server_calls"], {"setState": 32})
+
+
+@unittest.skipUnless(Ice, "requires Ice")
+class IcePoolTest(unittest.TestCase):
+    def setUp(self):
+        getLogger().disabled = True
+
+    def tearDown(self):
+        getLogger().disabled = False
+
+    def testSerializedKeepsOrder(self):
+        from bench.icepool import runPoolBenchmark
+
+        results = runPoolBenchmark(threads=4, serialize=True, servers=3, events=200)
+        self.assertEqual(results["events"], 600)
+        self.assertEqual(results["reordered"], 0)
+        self.assertGreater(results["events_per_sec"], 0)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# fakeserver.py
+# In-process stand-ins for the Murmur Meta and Server proxies used
+# to benchmark mumo and its modules without a running Mumble server.
+#
+
+import copy
+import time
+from threading import Lock
+
+
+class FakeState(object):
+    """
+    Plain attribute container mirroring the Murmur User and Channel structures.
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return "FakeState(%s)" % ", ".join("%s=%r" % item for item in sorted(vars(self).items()))
+
+
+def userState(session, name, channel=0, userid=-1, context="", identity="", idlesecs=0):
+    """
+    Returns a FakeState with the members of a Murmur User.
+    """
+    return FakeState(session=session, userid=userid, mute=False, deaf=False, suppress=False,
+                     prioritySpeaker=False, selfMute=False, selfDeaf=False, recording=False,
+                     channel=channel, name=name, onlinesecs=idlesecs, bytespersec=0, version=0x10400,
+                     release="bench", os="", osversion="", identity=identity, context=context,
+                     comment="", address=b"", tcponly=False, idlesecs=idlesecs, udpPing=0.0, tcpPing=0.0)
+
+
+def channelState(cid, name, parent):
+    """
+    Returns a FakeState with the members of a Murmur Channel.
+    """
+    return FakeState(id=cid, name=name, parent=parent, links=[], description="", temporary=False, position=0)
+
+
+class FakeServer(object):
+    """
+    Thread safe in-process stand-in for a virtual server proxy.
+
+    Keeps users, channels, ACLs and group memberships in memory. Every
+    call is counted in calls and delayed by latency seconds to emulate
+    an Ice round trip.
+    """
+
+    def __init__(self, sid, murmur, latency=0.0):
+        """
+        @param sid: Virtual server id
+        @param murmur: Murmur module (or stand-in) to take exceptions from
+        @param latency: Seconds every call is delayed by
+        """
+        self.sid = sid
+        self.murmur = murmur
+        self.latency = latency
+
+        self.users = {}  # {session:state}
+        self.channels = {0: channelState(0, "Root", -1)}  # {cid:state}
+        self.acls = {}  # {cid:(acls, groups, inherit)}
+        self.groups = {}  # {(cid, group):set(sessions)}
+        self.messages = []  # [(target, text)]
+        self.calls = {}  # {operation:count}
+
+        self.__nextcid = 1
+        self.__lock = Lock()
+
+    def __call(self, operation):
+        with self.__lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def id(self):
+        return self.sid
+
+    # --- Users
+
+    def connect(self, state):
+        """
+        Adds a user to the server without going through Ice. Returns the stored state.
+        """
+        with self.__lock:
+            self.users[state.session] = copy.copy(state)
+            return self.users[state.session]
+
+    def getUsers(self):
+        self.__call("getUsers")
+        with self.__lock:
+            return dict((session, copy.copy(state)) for session, state in self.users.items())
+
+    def getState(self, session):
+        self.__call("getState")
+        with self.__lock:
+            try:
+                return copy.copy(self.users[session])
+            except KeyError:
+                raise self.murmur.InvalidSessionException()
+
+    def setState(self, state):
+        self.__call("setState")
+        with self.__lock:
+            if state.session not in self.users:
+                raise self.murmur.InvalidSessionException()
+            if state.channel not in self.channels:
+                raise self.murmur.InvalidChannelException()
+            self.users[state.session] = copy.copy(state)
+
+    def sendMessage(self, session, text):
+        self.__call("sendMessage")
+        with self.__lock:
+            self.messages.append((session, text))
+
+    def sendMessageChannel(self, cid, tree, text):
+        self.__call("sendMessageChannel")
+        with self.__lock:
+            self.messages.append((cid, text))
+
+    def getRegisteredUsers(self, name):
+        self.__call("getRegisteredUsers")
+        with self.__lock:
+            return {}
+
+    def getRegistration(self, userid):
+        self.__call("getRegistration")
+        with self.__lock:
+            raise self.murmur.InvalidUserException()
+
+    # --- Channels
+
+    def getChannels(self):
+        self.__call("getChannels")
+        with self.__lock:
+            return dict((cid, copy.copy(state)) for cid, state in self.channels.items())
+
+    def getChannelState(self, cid):
+        self.__call("getChannelState")
+        with self.__lock:
+            try:
+                return copy.copy(self.channels[cid])
+            except KeyError:
+                raise self.murmur.InvalidChannelException()
+
+    def setChannelState(self, state):
+        self.__call("setChannelState")
+        with self.__lock:
+            if state.id not in self.channels:
+                raise self.murmur.InvalidChannelException()
+            self.channels[state.id] = copy.copy(state)
+
+    def addChannel(self, name, parent):
+        self.__call("addChannel")
+        with self.__lock:
+            if parent not in self.channels:
+                raise self.murmur.InvalidChannelException()
+            cid = self.__nextcid
+            self.__nextcid += 1
+            self.channels[cid] = channelState(cid, name, parent)
+            return cid
+
+    def removeChannel(self, cid):
+        self.__call("removeChannel")
+        with self.__lock:
+            if cid not in self.channels or cid == 0:
+                raise self.murmur.InvalidChannelException()
+
+            removed = {cid}
+            for channel in sorted(self.channels.values(), key=lambda state: state.id):
+                if channel.parent in removed:
+                    removed.add(channel.id)
+
+            for channel in removed:
+                del self.channels[channel]
+                self.acls.pop(channel, None)
+
+            for state in self.users.values():
+                if state.channel in removed:
+                    state.channel = 0
+
+    # --- ACLs and groups
+
+    def getACL(self, cid):
+        self.__call("getACL")
+        with self.__lock:
+            return self.acls.get(cid, ([], [], True))
+
+    def setACL(self, cid, acls, groups, inherit):
+        self.__call("setACL")
+        with self.__lock:
+            if cid not in self.channels:
+                raise self.murmur.InvalidChannelException()
+            self.acls[cid] = (acls, groups, inherit)
+
+    def addUserToGroup(self, cid, session, group):
+        self.__call("addUserToGroup")
+        with self.__lock:
+            self.groups.setdefault((cid, group), set()).add(session)
+
+    def removeUserFromGroup(self, cid, session, group):
+        self.__call("removeUserFromGroup")
+        with self.__lock:
+            self.groups.get((cid, group), set()).discard(session)
+
+    # --- Context menus
+
+    def addContextCallback(self, session, action, text, callback, context):
+        self.__call("addContextCallback")
+
+    def removeContextCallback(self, callback):
+        self.__call("removeContextCallback")
+
+
+class FakeMeta(object):
+    """
+    Stand-in for the Meta proxy serving a set of FakeServer instances.
+    """
+
+    def __init__(self, servers):
+        self.servers = dict((server.id(), server) for server in servers)
+
+    def getServer(self, sid):
+        return self.servers.get(sid)
+
+    def getBootedServers(self):
+        return list(self.servers.values())
+
+    def getAllServers(self):
+        return list(self.servers.values())
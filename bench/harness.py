@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# harness.py
+# Drives a MumoManager and real modules against FakeServer instances
+# and measures throughput, dispatch latency and memory usage.
+#
+
+import copy
+import importlib
+import os
+import shutil
+import tempfile
+from time import perf_counter
+
+from bench.fakeserver import FakeMeta, FakeServer, userState
+from instrumentation import memoryUsage
+from mumo_manager import MumoManager
+from mumo_replay import drain, ReplayMurmur
+
+DEFAULT_MODULES = ["idlemove", "source", "bf2", "onjoin", "seen"]
+
+# Channels created on every fake server before the modules are loaded
+AFK_CHANNEL = 1
+LOBBY_CHANNEL = 2
+
+# Configuration handed to each module, %(tmp)s is replaced by the benchmark directory
+MODULE_CONFIGS = {
+    'idlemove': """
+[idlemove]
+; Sweeps are driven by events, keep the timer out of the way
+interval = 3600
+[all]
+threshold = 600
+mute = True
+deafen = False
+channel = %(afk)d
+""",
+    'source': """
+[source]
+database = %(tmp)s/source.sqlite
+basechannelid = 0
+deletedelay = 0
+""",
+    'bf2': """
+[bf2]
+gamecount = 1
+[g0]
+name = bench
+mumble_server = 1
+base = 0
+left = %(lobby)d
+blufor = %(lobby)d
+opfor = %(lobby)d
+""",
+    'onjoin': """
+[onjoin]
+[all]
+channel = %(lobby)d
+""",
+    'seen': """
+[seen]
+keyword = !seen
+""",
+}
+
+SERVER_CALLBACKS = ("userConnected", "userDisconnected", "userStateChanged", "userTextMessage",
+                    "channelCreated", "channelRemoved", "channelStateChanged")
+
+
+def percentile(samples, p):
+    """
+    Returns the p-th percentile of an already sorted list of samples.
+    """
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))]
+
+
+class Bench(object):
+    """
+    A MumoManager with a set of real modules connected to fake servers.
+
+    Events are announced with a timestamp attached to the state they
+    carry. Every module handler is wrapped to record the time from the
+    announcement until the handler finished.
+    """
+
+    def __init__(self, modules=DEFAULT_MODULES, latency=0.0, servers=1):
+        """
+        @param modules: Names of the modules in modules/ to load
+        @param latency: Seconds every fake server call is delayed by
+        @param servers: Number of virtual servers
+        """
+        self.tmp = tempfile.mkdtemp(prefix="mumo-bench-")
+        self.murmur = ReplayMurmur()
+        self.servers = [FakeServer(sid, self.murmur, latency) for sid in range(1, servers + 1)]
+        for server in self.servers:
+            server.channels[AFK_CHANNEL] = server.getChannelState(server.addChannel("AFK", 0))
+            server.channels[LOBBY_CHANNEL] = server.getChannelState(server.addChannel("Lobby", 0))
+            server.calls = {}
+        self.meta = FakeMeta(self.servers)
+
+        self.manager = MumoManager(self.murmur, None)
+        self.modulenames = list(modules)
+        self.modules = {}  # {name:instance}
+        self.latencies = {}  # {name:[seconds]}
+        self.events = 0
+        self.started = None
+
+    def start(self):
+        """
+        Starts the manager and all modules and announces the servers.
+        """
+        self.manager.start()
+        for name in self.modulenames:
+            path = os.path.join(self.tmp, name + ".ini")
+            with open(path, "w") as f:
+                f.write(MODULE_CONFIGS.get(name, "") % {'tmp': self.tmp, 'afk': AFK_CHANNEL, 'lobby': LOBBY_CHANNEL})
+
+            mod = importlib.import_module("modules." + name)
+            modcls = getattr(mod, "mumo_module_class", None) or getattr(mod, name)
+            instance = self.manager.loadModuleCls(name, modcls, path)
+            self.instrument(name, instance)
+            self.modules[name] = instance
+
+        self.manager.startModules()
+        self.manager.announceConnected(self.meta)
+        for server in self.servers:
+            self.manager.announceMeta(server.id(), "started", server, None)
+        drain(self.manager)
+
+    def stop(self):
+        """
+        Stops the manager and all modules and removes temporary files.
+        """
+        self.manager.stop()
+        self.manager.join()
+        for instance in self.modules.values():
+            # idlemove keeps a timer running
+            timer = getattr(instance, "watchdog", None)
+            if timer:
+                timer.cancel()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def instrument(self, name, instance):
+        samples = self.latencies.setdefault(name, [])
+
+        def timed(handler):
+            def new_fu(server, *args, **kwargs):
+                try:
+                    return handler(server, *args, **kwargs)
+                finally:
+                    sent = getattr(args[0], "bench_sent", None) if args else None
+                    if sent is not None:
+                        samples.append(perf_counter() - sent)
+
+            return new_fu
+
+        for callback in SERVER_CALLBACKS:
+            handler = getattr(instance, callback, None)
+            if handler is not None:
+                setattr(instance, callback, timed(handler))
+
+    def reset(self):
+        """
+        Waits for all queued events and starts a new measurement.
+        """
+        drain(self.manager)
+        for samples in self.latencies.values():
+            del samples[:]
+        for server in self.servers:
+            server.calls = {}
+        self.events = 0
+        self.started = perf_counter()
+
+    def announce(self, server, function, state):
+        """
+        Announces a server callback for the given state to the modules.
+        """
+        state.bench_sent = perf_counter()
+        self.events += 1
+        self.manager.announceServer(server.id(), function, server, state, None)
+
+    def connect(self, server, state):
+        """
+        Adds a user to the server and announces the connect.
+        """
+        server.connect(state)
+        self.announce(server, "userConnected", copy.copy(state))
+
+    def update(self, server, session, **changes):
+        """
+        Applies changes to a connected user and announces the state change.
+        """
+        state = copy.copy(server.users[session])
+        state.__dict__.update(changes)
+        server.connect(state)
+        self.announce(server, "userStateChanged", state)
+
+    def results(self):
+        """
+        Waits for all queued events and returns the measurements taken
+        since the last reset as a dictionary.
+        """
+        drain(self.manager)
+        elapsed = perf_counter() - self.started
+
+        def summary(samples):
+            samples = sorted(samples)
+            return {'samples': len(samples),
+                    'p50_ms': percentile(samples, 50) * 1000 if samples else None,
+                    'p99_ms': percentile(samples, 99) * 1000 if samples else None}
+
+        calls = {}
+        for server in self.servers:
+            for operation, count in server.calls.items():
+                calls[operation] = calls.get(operation, 0) + count
+
+        current, peak = memoryUsage()
+        return {'events': self.events,
+                'seconds': elapsed,
+                'events_per_sec': self.events / elapsed if elapsed > 0 else None,
+                'dispatch': summary([s for samples in self.latencies.values() for s in samples]),
+                'modules': dict((name, summary(samples)) for name, samples in self.latencies.items()),
+                'server_calls': calls,
+                'rss_kb': current,
+                'peak_rss_kb': peak}
+
+
+#
+# --- Scenarios
+#
+
+def playerState(session, round=0):
+    """
+    Returns the state of a user in the given map round. A quarter of the
+    users play a source engine game, another quarter Battlefield 2. Players
+    are spread over 8 game servers and both teams which change each round.
+    """
+    name = "player%d" % session
+    kind = session % 4
+    gameserver = 8 * round + (session // 4) % 8
+    team = ((session // 32) + round) % 2
+
+    if kind == 0:
+        return userState(session, name,
+                         context="Source engine: tf\0[A-1:%d]\0" % (1000 + gameserver),
+                         identity="universe:0;account_type:0;id:%08d;instance:0;team:%d" % (session, 2 + team))
+    elif kind == 1:
+        return userState(session, name,
+                         context='Battlefield 2\0{"ipport": "10.0.0.1:%d"}' % (16567 + gameserver),
+                         identity='{"commander": false, "squad_leader": %s, "squad": %d, "team": "%s"}'
+                                  % ("true" if session % 8 == 1 else "false", 1 + session % 9,
+                                     ("blufor", "opfor")[team]))
+    return userState(session, name)
+
+
+def joinStorm(bench, users):
+    """
+    All users connect at the same time.
+    """
+    server = bench.servers[0]
+    for session in range(1, users + 1):
+        bench.connect(server, playerState(session))
+
+
+def mapChange(bench, users):
+    """
+    Every game server changes its map: source players reconnect to a
+    new game server instance and Battlefield 2 players switch teams.
+    """
+    server = bench.servers[0]
+    for session in range(1, users + 1):
+        state = playerState(session, round=1)
+        if state.context:
+            bench.update(server, session, context=state.context, identity=state.identity)
+
+
+def afkSweep(bench, users):
+    """
+    All users go idle and are caught by the idle check.
+    """
+    server = bench.servers[0]
+    for session in range(1, users + 1):
+        bench.update(server, session, idlesecs=3600)
+
+
+# {name:(preparation, scenario)}
+SCENARIOS = {'join_storm': (None, joinStorm),
+             'map_change': (joinStorm, mapChange),
+             'afk_sweep': (joinStorm, afkSweep)}
+
+
+def runScenario(name, users=200, latency=0.0, modules=DEFAULT_MODULES):
+    """
+    Runs a single scenario against a fresh Bench.
+
+    @param name: Key of the scenario in SCENARIOS
+    @param users: Number of users taking part
+    @param latency: Seconds every fake server call is delayed by
+    @param modules: Names of the modules to load
+    @return Dictionary of results
+    """
+    prepare, scenario = SCENARIOS[name]
+    bench = Bench(modules, latency)
+    try:
+        bench.start()
+        if prepare:
+            prepare(bench, users)
+        bench.reset()
+        scenario(bench, users)
+        results = bench.results()
+    finally:
+        bench.stop()
+
+    results.update({'scenario': name,
+                    'users': users,
+                    'latency_ms': latency * 1000,
+                    'loaded_modules': list(modules)})
+    return results
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# icepool.py
+# Measures the callback throughput of mumo for different sizes of the
+# callback thread pool. A stand-in server sends userStateChanged
+# callbacks for several virtual servers over a real Ice connection,
+# like Murmur does, and a module records the order they arrive in:
+#
+#     python3 -m bench.icepool --threads 1,2,4,8 --servers 4 --events 5000
+#
+
+import json
+import logging
+import platform
+import struct
+import sys
+from collections import deque
+from optparse import OptionParser
+from threading import Event
+from time import perf_counter, sleep
+
+import Ice
+
+from config import Config
+from dispatch import serverDispatcher
+from iceconfig import CALLBACK_ADAPTER, ICE_TUNING_DEFAULTS, iceProperties
+from mumo_manager import MumoManager
+from mumo_module import MumoModule
+from mumo_replay import drain
+
+# Encapsulation header for the 1.0 encoding: size, major, minor
+ENCAPSULATION = '<iBB'
+ENCAPSULATION_SIZE = struct.calcsize(ENCAPSULATION)
+EMPTY = struct.pack(ENCAPSULATION, ENCAPSULATION_SIZE, 1, 0)
+
+
+def encapsulate(data):
+    return struct.pack(ENCAPSULATION, ENCAPSULATION_SIZE + len(data), 1, 0) + data
+
+
+def reject():
+    raise RuntimeError("Secret rejected")
+
+
+class Recorder(MumoModule):
+    """
+    Module recording the sequence numbers it receives per server
+    """
+
+    def __init__(self, name, manager, configuration=None):
+        MumoModule.__init__(self, name, manager, configuration)
+        self.expected = 0
+        self.received = 0
+        self.sequences = {}  # {sid:[sequence number]}
+        self.done = Event()
+
+    def connected(self):
+        self.manager().subscribeServerCallbacks(self)
+
+    def userStateChanged(self, server, sequence, current=None):
+        self.sequences.setdefault(server, []).append(sequence)
+        self.received += 1
+        if self.received >= self.expected:
+            self.done.set()
+
+    def reordered(self):
+        """
+        Returns the number of events which arrived before an event of
+        the same server sent earlier.
+        """
+        return sum(1 for sequence in self.sequences.values()
+                   for previous, following in zip(sequence, sequence[1:]) if following < previous)
+
+
+class StandInCallback(Ice.Blobject):
+    """
+    Server callback servant of a single virtual server. The request is
+    handed to the same dispatcher mumo installs on its servants, an
+    optional delay simulates work done in the dispatching thread.
+    """
+
+    def __init__(self, manager, sid, work=0.0, direct=False):
+        Ice.Blobject.__init__(self)
+        self.manager = manager
+        self.managerQueue = manager.message_queue()
+        self.sid = sid
+        self.server = sid
+        self.work = work
+        self.dispatch = serverDispatcher("userStateChanged", "", reject, direct)
+
+    def ice_invoke(self, inParams, current):
+        sequence, = struct.unpack_from('<i', inParams, ENCAPSULATION_SIZE)
+        if self.work:
+            sleep(self.work)
+        self.dispatch(self, sequence, current)
+        return True, EMPTY
+
+
+def initialize(properties=()):
+    initdata = Ice.InitializationData()
+    initdata.properties = Ice.createProperties([], initdata.properties)
+    for prop, val in properties:
+        initdata.properties.setProperty(prop, val)
+    initdata.properties.setProperty('Ice.Default.EncodingVersion', '1.0')
+    return Ice.initialize(initdata)
+
+
+def runPoolBenchmark(threads=1, serialize=True, servers=4, events=5000, work=0.0, direct=False, window=256):
+    """
+    Sends events callbacks to each of servers virtual servers and waits
+    until the module received all of them.
+
+    @param threads: Size of the callback thread pool
+    @param serialize: Whether the pool serializes the requests of a connection
+    @param servers: Number of virtual servers
+    @param events: Callbacks sent per virtual server
+    @param work: Seconds each dispatch is delayed by
+    @param direct: Dispatch from the Ice threads straight into the module queue
+    @param window: Callbacks the stand-in server keeps in flight
+    @return Dictionary of results
+    """
+    ice = Config(default={'ice': ICE_TUNING_DEFAULTS}).ice
+    ice.callback_threads = threads
+    ice.callback_serialize = serialize
+
+    manager = MumoManager(None, None)
+    manager.directDispatch = direct
+    manager.start()
+    recorder = manager.loadModuleCls("recorder", Recorder)
+    recorder.expected = servers * events
+    manager.startModules()
+    manager.announceConnected()
+    drain(manager)
+    drain(manager)
+
+    communicator = initialize(iceProperties(ice))
+    server = initialize()
+    try:
+        adapter = communicator.createObjectAdapterWithEndpoints(CALLBACK_ADAPTER, 'tcp -h 127.0.0.1')
+        for sid in range(1, servers + 1):
+            adapter.add(StandInCallback(manager, sid, work, direct), Ice.stringToIdentity('server-%d' % sid))
+        adapter.activate()
+
+        endpoint = adapter.getEndpoints()[0].toString()
+        proxies = [server.stringToProxy('server-%d:%s' % (sid, endpoint)) for sid in range(1, servers + 1)]
+        for proxy in proxies:
+            proxy.ice_ping()
+
+        # Like Murmur the stand-in sends asynchronously over a single connection
+        inflight = deque()
+        started = perf_counter()
+        for sequence in range(events):
+            payload = encapsulate(struct.pack('<i', sequence))
+            for proxy in proxies:
+                inflight.append(proxy.ice_invokeAsync('userStateChanged', Ice.OperationMode.Normal, payload))
+                if len(inflight) >= window:
+                    inflight.popleft().result()
+        while inflight:
+            inflight.popleft().result()
+        recorder.done.wait()
+        elapsed = perf_counter() - started
+    finally:
+        server.destroy()
+        communicator.destroy()
+        manager.stopModules()
+        manager.stop()
+        manager.join()
+
+    return {'threads': threads,
+            'serialize': serialize,
+            'direct': direct,
+            'servers': servers,
+            'events': servers * events,
+            'work_ms': work * 1000,
+            'seconds': elapsed,
+            'events_per_sec': servers * events / elapsed if elapsed > 0 else None,
+            'reordered': recorder.reordered()}
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='python3 -m bench.icepool [options]')
+    parser.add_option('-t', '--threads', default='1,2,4,8',
+                      help='comma separated callback thread pool sizes [default: %default]')
+    parser.add_option('-s', '--servers', type='int', default=4,
+                      help='number of virtual servers [default: %default]')
+    parser.add_option('-e', '--events', type='int', default=5000,
+                      help='callbacks sent per virtual server [default: %default]')
+    parser.add_option('-w', '--work', type='float', default=0.0,
+                      help='milliseconds each dispatch takes [default: %default]')
+    parser.add_option('-d', '--direct', action='store_true', default=False,
+                      help='dispatch directly into the module queues')
+    parser.add_option('-o', '--output',
+                      help='write the results as JSON to this file instead of stdout')
+    (option, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = []
+    for threads in [int(t) for t in option.threads.split(',')]:
+        for serialize in (True, False):
+            result = runPoolBenchmark(threads, serialize, option.servers, option.events,
+                                      option.work / 1000.0, option.direct)
+            print('%2d threads %-13s %8.0f events/s  %6d reordered'
+                  % (threads, 'serialized' if serialize else 'concurrent', result['events_per_sec'] or 0,
+                     result['reordered']),
+                  file=sys.stderr)
+            results.append(result)
+
+    output = json.dumps({'python': platform.python_version(), 'ice': Ice.stringVersion(), 'results': results},
+                        indent=2, sort_keys=True)
+    if option.output:
+        with open(option.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# micro.py
+# Microbenchmarks for hot paths inside mumo and its modules, each
+# compared against the implementation it replaced:
+#
+#     python3 -m bench.micro --number 20000 --repeat 5
+#
+
+import json
+import logging
+import platform
+import sys
+import timeit
+from optparse import OptionParser
+
+from dispatch import installServerDispatchers
+from modules.source.db import SourceDB
+from modules.source.users import User, UserRegistry
+from mumo_manager import MumoManager
+
+SECRET = "sëcret"
+
+
+class InvalidSecretException(Exception):
+    pass
+
+
+def reject():
+    raise InvalidSecretException()
+
+
+class CurrentMock(object):
+    def __init__(self, secret=None):
+        self.ctx = {} if secret is None else {'secret': secret}
+
+
+class ServantMock(object):
+    def __init__(self, manager, server, sid):
+        self.manager = manager
+        self.managerQueue = manager.message_queue()
+        self.sid = sid
+        self.server = server
+
+
+#
+# Dispatch as done by mumo before the fused dispatchers, for comparison
+#
+def legacyCheckSecret(func):
+    def newfunc(*args, **kws):
+        if 'current' in kws:
+            current = kws["current"]
+        else:
+            current = args[-1]
+
+        if not current or 'secret' not in current.ctx or current.ctx['secret'] != SECRET:
+            reject()
+
+        return func(*args, **kws)
+
+    return newfunc
+
+
+def legacyForwardServer(fu):
+    def new_fu(self, *args, **kwargs):
+        self.manager.announceServer(self.sid, fu.__name__, self.server, *args, **kwargs)
+
+    return new_fu
+
+
+class LegacyServant(ServantMock):
+    @legacyCheckSecret
+    @legacyForwardServer
+    def userStateChanged(self, u, current=None): pass
+
+
+class FusedServant(ServantMock):
+    pass
+
+
+installServerDispatchers(FusedServant, SECRET, reject)
+
+
+def compare(before, after, number, repeat):
+    """
+    Times both callables alternately to spread disturbances evenly.
+
+    @param before Callable of the replaced implementation, takes no arguments
+    @param after Callable of the current implementation, takes no arguments
+    @param number Calls per measurement
+    @param repeat Number of measurements, the fastest one is reported
+    @return Dictionary with the microseconds per call of both
+    """
+    timings = ([], [])
+    for _ in range(repeat):
+        for fu, results in zip((before, after), timings):
+            results.append(timeit.timeit(fu, number=number))
+    before_us, after_us = (min(results) / number * 1e6 for results in timings)
+    return {'before_us': before_us, 'after_us': after_us}
+
+
+def benchDispatch(number, repeat):
+    """
+    Per callback overhead of checking the secret and handing the
+    announcement to the manager, before and after fusing.
+    """
+    man = MumoManager(None, None)
+    current = CurrentMock(SECRET)
+    legacy = LegacyServant(man, "server", 1).userStateChanged
+    fused = FusedServant(man, "server", 1).userStateChanged
+    queue = man.message_queue().queue
+
+    def before():
+        legacy("state", current)
+        queue.clear()
+
+    def after():
+        fused("state", current)
+        queue.clear()
+
+    return compare(before, after, number, repeat)
+
+
+def benchSourceDB(number, repeat):
+    """
+    Channel lookups of the source module served from the in-memory
+    tables of SourceDB, compared to the SQL query used before.
+    """
+    db = SourceDB()
+    try:
+        cid = 0
+        for sid in range(1, 5):
+            db.registerChannel(sid, cid, "tf")
+            cid += 1
+            for server in ("[A-1:%d]" % i for i in range(20)):
+                db.registerChannel(sid, cid, "tf", server)
+                cid += 1
+                for team in range(4):
+                    db.registerChannel(sid, cid, "tf", server, team)
+                    cid += 1
+
+        key = (3, "tf", "[A-1:10]", 2)
+        statement = "SELECT cid FROM controlled_channels WHERE sid is ? and game is ? and server is ? and team is ?"
+
+        def before():
+            db.db.execute(statement, key).fetchone()
+
+        def after():
+            db.cidFor(*key)
+
+        return compare(before, after, number, repeat)
+    finally:
+        db.close()
+
+
+class StateMock(object):
+    def __init__(self, cid=0, session=0):
+        self.channel = cid
+        self.session = session
+
+
+def benchOccupancy(number, repeat):
+    """
+    Vacancy checks of the source module answered by the occupancy index
+    of UserRegistry, compared to scanning all users of the server.
+    """
+    r = UserRegistry()
+    sid = 1
+    channels = 200
+    for session in range(5000):
+        r.add(sid, session, User(StateMock(cid=session % channels, session=session), {'team': 2}, "tf", "s"))
+
+    # An unoccupied channel, the worst case for the scan
+    cid = channels + 1
+
+    def before():
+        for user in r.users[sid].values():
+            if user.state and user.state.channel == cid:
+                return True
+        return False
+
+    def after():
+        r.usingChannel(sid, cid)
+
+    return compare(before, after, number, repeat)
+
+
+MICROBENCHMARKS = {
+    'dispatch': benchDispatch,
+    'occupancy': benchOccupancy,
+    'sourcedb': benchSourceDB,
+}
+
+
+def runMicrobenchmark(name, number, repeat):
+    """
+    Runs a single microbenchmark.
+
+    @param name Key in MICROBENCHMARKS
+    @param number Calls per measurement
+    @param repeat Number of measurements
+    @return Dictionary with the results
+    """
+    result = MICROBENCHMARKS[name](number, repeat)
+    result.update({'benchmark': name, 'number': number, 'repeat': repeat})
+    return result
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='python3 -m bench.micro [options]')
+    parser.add_option('-b', '--benchmark', action='append', choices=sorted(MICROBENCHMARKS.keys()),
+                      help='benchmark to run, can be given multiple times [default: all]')
+    parser.add_option('-n', '--number', type='int', default=20000,
+                      help='calls per measurement [default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='measurements per implementation, the fastest counts [default: %default]')
+    parser.add_option('-o', '--output',
+                      help='write the results as JSON to this file instead of stdout')
+    (option, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = []
+    for name in option.benchmark or sorted(MICROBENCHMARKS.keys()):
+        result = runMicrobenchmark(name, option.number, option.repeat)
+        print('%-12s %9.2fus before  %9.2fus after' % (name, result['before_us'], result['after_us']),
+              file=sys.stderr)
+        results.append(result)
+
+    output = json.dumps({'python': platform.python_version(), 'results': results}, indent=2, sort_keys=True)
+    if option.output:
+        with open(option.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
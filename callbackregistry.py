@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# callbackregistry.py
+# Keeps track of the server callback servants mumo attached to the
+# virtual servers of a Mumble server.
+#
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Lock
+
+
+@contextmanager
+def untimed(name):
+    yield
+
+
+class CallbackRegistry(object):
+    """
+    Registry of one callback servant per virtual server.
+
+    Servants are added to the adapter once and reused on every later
+    attach of the same server, so re-attaching after reconnects or server
+    restarts does not grow the adapter. Servants of servers which are gone
+    are removed from the adapter explicitly.
+    """
+
+    def __init__(self, adapter, factory, cast, threads=8, timed=untimed):
+        """
+        @param adapter: Ice object adapter to host the servants
+        @param factory: factory(server, sid) creates the servant for a server
+        @param cast: Casts the proxy returned by the adapter to a callback proxy
+        @param threads: Maximum number of servers attached concurrently
+        @param timed: timed(name) context manager measuring Ice calls
+        """
+        self.adapter = adapter
+        self.factory = factory
+        self.cast = cast
+        self.threads = threads
+        self.timed = timed
+        self.log = getLogger("CallbackRegistry")
+
+        self.lock = Lock()
+        self.callbacks = {}  # {sid:(identity, proxy)}
+
+    def __len__(self):
+        return len(self.callbacks)
+
+    def __contains__(self, sid):
+        return sid in self.callbacks
+
+    def proxyFor(self, server, sid):
+        """
+        Returns the callback proxy for a server, adding a servant for
+        it to the adapter if there is none yet.
+        """
+        with self.lock:
+            try:
+                return self.callbacks[sid][1]
+            except KeyError:
+                pass
+
+            prx = self.adapter.addWithUUID(self.factory(server, sid))
+            proxy = self.cast(prx)
+            self.callbacks[sid] = (prx.ice_getIdentity(), proxy)
+            return proxy
+
+    def attach(self, server, sid):
+        """
+        Attaches the callback of a single server. Attaching an already
+        attached server again is harmless, the server ignores known
+        callbacks.
+        """
+        proxy = self.proxyFor(server, sid)
+        with self.timed('Server.addCallback'):
+            server.addCallback(proxy)
+
+    def attachAll(self, servers):
+        """
+        Attaches the callbacks of several servers, concurrently if more
+        than one thread is allowed.
+
+        @param servers: List of (sid, server) tuples
+        @raise The first exception raised while attaching, after all
+               other servers were attempted
+        """
+        if len(servers) <= 1 or self.threads <= 1:
+            error = None
+            for sid, server in servers:
+                try:
+                    self.attach(server, sid)
+                except Exception as e:
+                    if error is None:
+                        error = e
+            if error is not None:
+                raise error
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.threads, len(servers)),
+                                thread_name_prefix="CallbackAttach") as executor:
+            futures = [executor.submit(self.attach, server, sid) for sid, server in servers]
+
+        for future in futures:
+            future.result()
+
+    def detach(self, sid):
+        """
+        Removes the servant of a server from the adapter. The server
+        itself is not told as it usually is gone already.
+        """
+        with self.lock:
+            try:
+                identity, proxy = self.callbacks.pop(sid)
+            except KeyError:
+                return False
+
+        try:
+            self.adapter.remove(identity)
+        except Exception as e:
+            self.log.debug("Servant of server %d already gone: %s", sid, e)
+        return True
+
+    def retain(self, sids):
+        """
+        Detaches all servers not in the given collection of sids
+        """
+        with self.lock:
+            gone = [sid for sid in self.callbacks if sid not in sids]
+        for sid in gone:
+            self.detach(sid)
+        return gone
+
+    def clear(self):
+        self.retain(())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import gc
+import threading
+import time
+import tracemalloc
+import unittest
+import uuid
+from logging import getLogger
+
+from callbackregistry import CallbackRegistry
+
+
+class IdentityMock(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class ProxyMock(object):
+    def __init__(self, identity):
+        self.identity = identity
+
+    def ice_getIdentity(self):
+        return self.identity
+
+
+class AdapterMock(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.servants = {}
+
+    def addWithUUID(self, servant):
+        identity = IdentityMock(str(uuid.uuid4()))
+        with self.lock:
+            self.servants[identity] = servant
+        return ProxyMock(identity)
+
+    def remove(self, identity):
+        with self.lock:
+            del self.servants[identity]
+
+
+class ServerMock(object):
+    def __init__(self, sid, latency=0.0):
+        self.sid = sid
+        self.latency = latency
+        self.callbacks = []
+        self.threads = set()
+
+    def addCallback(self, cb):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.latency)
+        # Like Murmur a server ignores callbacks it already knows
+        if cb not in self.callbacks:
+            self.callbacks.append(cb)
+
+    def restart(self):
+        self.callbacks = []
+
+
+class CallbackRegistryTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("CallbackRegistry").disabled = True
+        self.adapter = AdapterMock()
+        self.created = []
+        self.registry = CallbackRegistry(self.adapter, self.servant, lambda prx: prx, threads=4)
+
+    def servant(self, server, sid):
+        self.created.append(sid)
+        return ("servant", sid)
+
+    def servers(self, count, latency=0.0):
+        return [(sid, ServerMock(sid, latency)) for sid in range(1, count + 1)]
+
+    def testServantReuse(self):
+        servers = self.servers(3)
+        self.registry.attachAll(servers)
+        for sid, server in servers:
+            server.restart()
+        self.registry.attachAll(servers)
+        self.registry.attachAll(servers)
+
+        self.assertEqual(sorted(self.created), [1, 2, 3])
+        self.assertEqual(len(self.adapter.servants), 3)
+        for sid, server in servers:
+            self.assertEqual(len(server.callbacks), 1)
+            self.assertIs(server.callbacks[0], self.registry.proxyFor(server, sid))
+
+    def testDetachRemovesServant(self):
+        servers = self.servers(3)
+        self.registry.attachAll(servers)
+
+        self.assertEqual(self.registry.retain({1, 3}), [2])
+        self.assertNotIn(2, self.registry)
+        self.assertEqual(sorted(sid for _, sid in self.adapter.servants.values()), [1, 3])
+        self.assertFalse(self.registry.detach(2))
+
+        self.registry.clear()
+        self.assertEqual(self.adapter.servants, {})
+        self.assertEqual(len(self.registry), 0)
+
+    def testConcurrentAttach(self):
+        servers = self.servers(8, latency=0.1)
+        start = time.monotonic()
+        self.registry.attachAll(servers)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+        threads = set()
+        for sid, server in servers:
+            threads |= server.threads
+        self.assertEqual(len(threads), 4)
+
+    def testAttachFailure(self):
+        for threads in (4, 1):
+            registry = CallbackRegistry(AdapterMock(), self.servant, lambda prx: prx, threads=threads)
+            servers = self.servers(4)
+
+            def refuse(cb):
+                raise ConnectionRefusedError()
+
+            def fail(cb):
+                raise RuntimeError()
+
+            servers[1][1].addCallback = refuse
+            servers[2][1].addCallback = fail
+            # The first failure is raised
+            with self.assertRaises(ConnectionRefusedError):
+                registry.attachAll(servers)
+            # The other servers were still attached
+            self.assertEqual([len(server.callbacks) for sid, server in servers if sid in (1, 4)], [1, 1])
+
+    def testSoak(self):
+        """
+        Thousands of reconnects with servers coming and going must
+        neither grow the adapter nor the registry.
+        """
+        servers = self.servers(20)
+
+        def cycle(i):
+            for sid, server in servers:
+                if sid % 7 == i % 7:
+                    server.restart()
+            # Every fifth reconnect two servers are gone
+            running = [(sid, server) for sid, server in servers if i % 5 or sid > 2]
+            self.registry.attachAll(running)
+            self.registry.retain(set(sid for sid, server in running))
+
+        for i in range(100):
+            cycle(i)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            for i in range(2000):
+                cycle(i)
+            self.created = []
+            gc.collect()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        # Leaking a servant per attach would be several megabytes by now
+        growth = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+        self.assertLess(growth, 64 * 1024)
+        self.assertEqual(len(self.adapter.servants), 20)
+        self.assertEqual(len(self.registry), 20)
+        for sid, server in servers:
+            self.assertEqual(len(server.callbacks), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# control.py
+# Local administration socket of a running mumo process. Speaks
+# line-delimited JSON, see mumoctl.py for a client.
+#
+
+import json
+import logging
+import os
+import socketserver
+from logging import getLogger
+from threading import Thread
+
+from exporter import renderMetrics
+
+
+class ControlException(Exception):
+    pass
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answers each request line with exactly one response line:
+
+    >>> {"command": "reload", "args": ["idlemove"]}
+    <<< {"ok": true, "result": "idlemove reloaded"}
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                response = {'ok': True, 'result': self.server.control.execute(request.get('command'),
+                                                                              request.get('args', []))}
+            except (ValueError, AttributeError) as e:
+                response = {'ok': False, 'error': "Malformed request: %s" % e}
+            except ControlException as e:
+                response = {'ok': False, 'error': str(e)}
+            except Exception as e:
+                self.server.control.log.exception(e)
+                response = {'ok': False, 'error': "%s: %s" % (type(e).__name__, e)}
+
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class ControlServer(object):
+    """
+    Serves administrative commands for a MumoManager on a Unix domain
+    socket. Every connection is handled in its own daemon thread.
+    Commands never wait on the manager thread for longer than it takes
+    to swap a registration, loading and stopping modules happens
+    in the background.
+    """
+
+    def __init__(self, manager, path, resync=None, timeout=30.0):
+        """
+        @param manager: MumoManager to control
+        @param path: Path of the Unix domain socket to create
+        @param resync: Function re-establishing all server state, defaults
+                       to announcing the current connection to all modules again
+        @param timeout: Seconds to wait for modules to load, reload or stop
+        """
+        self.manager = manager
+        self.path = path
+        self.resync = resync or (lambda: manager.announceConnected(manager.getMeta()))
+        self.timeout = timeout
+        self.log = getLogger("ControlServer")
+        self.server = None
+        self.thread = None
+
+        self.commands = {'list': self.listModules,
+                         'start': self.startModule,
+                         'stop': self.stopModule,
+                         'reload': self.reloadModule,
+                         'metrics': self.metrics,
+                         'resync': self.resyncServers,
+                         'loglevel': self.logLevel}
+
+    def start(self):
+        """
+        Starts listening. A stale socket left behind by a previous
+        run is replaced. Raises OSError if the socket can not be created.
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        # Only the owner may connect, create the socket like that right away
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.path, ControlRequestHandler)
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.server.control = self
+
+        self.thread = Thread(target=self.server.serve_forever, name="ControlServer")
+        self.thread.daemon = True
+        self.thread.start()
+        self.log.info("Listening for control connections on %s", self.path)
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def execute(self, command, args):
+        """
+        Runs a single command and returns its JSON serializable result.
+        Raises ControlException for requests that can not be fulfilled.
+        """
+        try:
+            fu = self.commands[command]
+        except (KeyError, TypeError):
+            raise ControlException("Unknown command '%s', known are: %s" % (command, ", ".join(sorted(self.commands))))
+
+        if not isinstance(args, list):
+            raise ControlException("Invalid arguments for '%s': expected a list" % command)
+
+        try:
+            return fu(*args)
+        except TypeError as e:
+            raise ControlException("Invalid arguments for '%s': %s" % (command, e))
+
+    #
+    # --- Commands
+    #
+
+    def listModules(self):
+        modules = []
+        for name, modinst in sorted(self.manager.modules.items()):
+            if name in self.manager.activating:
+                status = "activating"
+            else:
+                status = "running" if modinst.is_alive() else "stopped"
+            modules.append({'name': name,
+                            'status': status,
+                            'queue': modinst.message_queue().qsize()})
+
+        for name in sorted(self.manager.lazy):
+            modules.append({'name': name, 'status': "lazy", 'queue': 0})
+
+        return modules
+
+    def startModule(self, name):
+        modinst = self.manager.modules.get(name)
+        if modinst is not None and modinst.is_alive():
+            raise ControlException("Module '%s' is already running" % name)
+
+        # Stopped threads can not be restarted, replace them with a new instance
+        self.manager.unloadModule(name)
+        try:
+            self.manager.launchModule(name).result(self.timeout)
+        except Exception as e:
+            raise ControlException("Failed to start module '%s': %s" % (name, e))
+        return "%s started" % name
+
+    def stopModule(self, name):
+        modinst = self.manager.unloadModule(name)
+        if modinst is None:
+            raise ControlException("Module '%s' is not loaded" % name)
+
+        if modinst.is_alive():
+            modinst.join(self.timeout)
+            if modinst.is_alive():
+                return "%s unloaded, still finishing its queue" % name
+        return "%s stopped" % name
+
+    def reloadModule(self, name):
+        try:
+            self.manager.reloadModule(name).result(self.timeout)
+        except Exception as e:
+            raise ControlException("Failed to reload module '%s': %s" % (name, e))
+        return "%s reloaded" % name
+
+    def metrics(self):
+        return renderMetrics(self.manager.getStatistics())
+
+    def resyncServers(self):
+        self.resync()
+        return "resync triggered"
+
+    def logLevel(self, *args):
+        """
+        loglevel [[LOGGER] LEVEL]
+
+        Sets the level of a logger, the root logger if none is given,
+        and returns the resulting level.
+        """
+        if len(args) > 2:
+            raise ControlException("Usage: loglevel [[LOGGER] LEVEL]")
+
+        logger = getLogger(args[0] if len(args) == 2 else None)
+        if args:
+            level = args[-1]
+            if isinstance(level, str) and level.isdigit():
+                level = int(level)
+            if not isinstance(level, int):
+                level = logging.getLevelName(str(level).upper())
+                if not isinstance(level, int):
+                    raise ControlException("Unknown log level '%s'" % args[-1])
+            logger.setLevel(level)
+
+        return {'logger': logger.name, 'level': logging.getLevelName(logger.getEffectiveLevel())}
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import logging
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import unittest
+from logging import getLogger
+
+from config import Config
+from control import ControlServer
+from mumo_manager import MumoManager
+from mumo_replay import drain
+from mumoctl import format_result, request
+
+MODULE_SOURCE = '''
+from mumo_module import MumoModule
+
+class %(name)s(MumoModule):
+    def connected(self):
+        self.manager().subscribeServerCallbacks(self)
+        self.connects = getattr(self, "connects", 0) + 1
+
+    def userStateChanged(self, server, state, context=None):
+        pass
+'''
+
+
+class ControlTest(unittest.TestCase):
+    def setUp(self):
+        for name in ("MumoManager", "ControlServer"):
+            getLogger(name).disabled = True
+
+        self.dir = tempfile.mkdtemp()
+        mod_dir = os.path.join(self.dir, "modules") + os.sep
+        cfg_dir = os.path.join(self.dir, "modules-enabled") + os.sep
+        os.mkdir(mod_dir)
+        os.mkdir(cfg_dir)
+
+        self.name = "controlled_%d" % id(self)
+        with open(mod_dir + self.name + ".py", "w") as f:
+            f.write(MODULE_SOURCE % {'name': self.name})
+        with open(cfg_dir + self.name + ".ini", "w") as f:
+            f.write("")
+        getLogger(self.name).disabled = True
+
+        cfg = Config(default=MumoManager.cfg_default)
+        cfg.modules.mod_dir = mod_dir
+        cfg.modules.cfg_dir = cfg_dir
+        cfg.modules.slow_handler_threshold = 0
+
+        self.man = MumoManager(None, None, cfg)
+        self.man.start()
+        self.man.loadModules()
+        self.man.startModules()
+        self.man.announceConnected()
+        drain(self.man)
+
+        self.path = os.path.join(self.dir, "mumo.sock")
+        self.resyncs = 0
+        self.control = ControlServer(self.man, self.path, resync=self.resync, timeout=5)
+        self.control.start()
+
+    def tearDown(self):
+        self.control.stop()
+        self.man.stop()
+        self.man.join(2)
+        sys.modules.pop(self.name, None)
+        sys.path.remove(self.man.cfg.modules.mod_dir)
+        shutil.rmtree(self.dir)
+
+    def resync(self):
+        self.resyncs += 1
+
+    def call(self, command, *args):
+        response = request(self.path, command, args, timeout=10)
+        self.assertTrue(response['ok'], response.get('error'))
+        return response['result']
+
+    def error(self, command, *args):
+        response = request(self.path, command, args, timeout=10)
+        self.assertFalse(response['ok'])
+        return response['error']
+
+    def testSocketPermissions(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        umask = os.umask(0o022)
+        try:
+            path = os.path.join(self.dir, "other.sock")
+            control = ControlServer(self.man, path)
+            control.start()
+            try:
+                self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+                self.assertEqual(os.umask(0o022), 0o022)
+            finally:
+                control.stop()
+        finally:
+            os.umask(umask)
+
+    def testList(self):
+        self.assertEqual(self.call("list"), [{'name': self.name, 'status': "running", 'queue': 0}])
+        self.assertIn(self.name, format_result(self.call("list")))
+
+    def testStopAndStart(self):
+        old = self.man.modules[self.name]
+        self.assertEqual(self.call("stop", self.name), "%s stopped" % self.name)
+        self.assertFalse(old.is_alive())
+        self.assertEqual(self.call("list"), [])
+        self.assertIn("not loaded", self.error("stop", self.name))
+
+        self.assertEqual(self.call("start", self.name), "%s started" % self.name)
+        new = self.man.modules[self.name]
+        self.assertIsNot(new, old)
+        self.assertTrue(new.is_alive())
+        drain(self.man)
+        self.assertEqual(new.connects, 1)
+        self.assertIn("already running", self.error("start", self.name))
+
+    def testStartUnknown(self):
+        self.assertIn("Failed to start", self.error("start", "doesnotexist"))
+
+    def testReload(self):
+        old = self.man.modules[self.name]
+        self.assertEqual(self.call("reload", self.name), "%s reloaded" % self.name)
+        self.assertIsNot(self.man.modules[self.name], old)
+        self.assertIn("Failed to reload", self.error("reload", "doesnotexist"))
+
+    def testMetrics(self):
+        metrics = self.call("metrics")
+        self.assertTrue(metrics.endswith("# EOF\n"))
+        self.assertIn('mumo_queue_depth{worker="%s"} 0' % self.name, metrics)
+
+    def testResync(self):
+        self.call("resync")
+        self.assertEqual(self.resyncs, 1)
+
+    def testLogLevel(self):
+        logger = getLogger("control_test")
+        try:
+            self.assertEqual(self.call("loglevel", "control_test", "warning"),
+                             {'logger': "control_test", 'level': "WARNING"})
+            self.assertEqual(logger.level, logging.WARNING)
+            self.assertEqual(self.call("loglevel", "control_test", "10")['level'], "DEBUG")
+            self.assertIn("Unknown log level", self.error("loglevel", "control_test", "loud"))
+        finally:
+            logger.setLevel(logging.NOTSET)
+
+    def testBadRequests(self):
+        self.assertIn("Unknown command", self.error("explode"))
+        self.assertIn("Invalid arguments", self.error("reload"))
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10)
+            sock.connect(self.path)
+            with sock.makefile("rwb") as stream:
+                # Several requests on one connection, a broken one in between
+                stream.write(b'not json\n{"command": "list"}\n')
+                stream.flush()
+                self.assertIn(b'"ok": false', stream.readline())
+                self.assertIn(b'"ok": true', stream.readline())
+
+                # Arguments must be a list, a string would be split into characters
+                old = self.man.modules[self.name]
+                stream.write(b'{"command": "reload", "args": "%s"}\n' % self.name.encode("utf-8"))
+                stream.flush()
+                response = json.loads(stream.readline().decode("utf-8"))
+                self.assertFalse(response['ok'])
+                self.assertIn("expected a list", response['error'])
+                self.assertIs(self.man.modules[self.name], old)
+
+
+if __name__ == "__main__":
+    unittest.main()
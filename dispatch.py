@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# dispatch.py
+# Builds the functions handling the server callbacks Murmur sends us.
+#
+
+from hmac import compare_digest
+
+from mumo_manager import MumoManager
+
+# Server callbacks forwarded to the modules
+SERVER_CALLBACKS = ('userConnected',
+                    'userDisconnected',
+                    'userStateChanged',
+                    'userTextMessage',
+                    'channelCreated',
+                    'channelRemoved',
+                    'channelStateChanged')
+
+
+def validSecret(current, secret):
+    """
+    Constant time check of the secret in the context of an Ice call
+
+    @param current: Ice.Current of the call, may be None
+    @param secret: Expected secret encoded as UTF-8
+    """
+    try:
+        return compare_digest(current.ctx['secret'].encode('utf-8'), secret)
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+
+def serverDispatcher(function, secret, reject, direct=False):
+    """
+    Returns a servant method handling the given server callback in a
+    single frame. It checks the secret, if one is configured, and then
+    puts the announcement straight into the queue of the manager. With
+    direct set the announcement is handed to the manager's dispatchServer
+    instead, which may put it into the module queues right away.
+
+    The servant is expected to provide the manager, its queue as
+    managerQueue, the sid and the server proxy as attributes. Ice
+    always passes the current as last positional argument.
+
+    @param function: Name of the callback
+    @param secret: Ice secret or an empty string if none is used
+    @param reject: Called on an invalid secret, expected to raise
+    @param direct: Dispatch from the calling thread if possible
+    """
+    announce = MumoManager.announceServer.__wrapped__
+
+    if not secret:
+        def dispatch(self, *args):
+            if direct:
+                self.manager.dispatchServer(self.sid, function, self.server, *args)
+            else:
+                self.managerQueue.put((None, announce, (self.manager, self.sid, function, self.server) + args, {}))
+    else:
+        expected = secret.encode('utf-8')
+
+        def dispatch(self, *args):
+            try:
+                valid = compare_digest(args[-1].ctx['secret'].encode('utf-8'), expected)
+            except (AttributeError, KeyError, TypeError, IndexError):
+                valid = False
+            if not valid:
+                reject()
+            if direct:
+                self.manager.dispatchServer(self.sid, function, self.server, *args)
+            else:
+                self.managerQueue.put((None, announce, (self.manager, self.sid, function, self.server) + args, {}))
+
+    dispatch.__name__ = function
+    return dispatch
+
+
+def installServerDispatchers(cls, secret, reject, direct=False):
+    """
+    Adds the dispatchers for all server callbacks to a servant class
+    """
+    for function in SERVER_CALLBACKS:
+        setattr(cls, function, serverDispatcher(function, secret, reject, direct))
+    return cls
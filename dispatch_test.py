@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+from logging import getLogger
+from threading import Event, Thread
+
+from bench import micro
+from dispatch import installServerDispatchers, SERVER_CALLBACKS, serverDispatcher, validSecret
+from mumo_manager import MumoManager
+from mumo_module import MumoModule
+from mumo_replay import drain
+
+SECRET = "sëcret"
+
+
+class InvalidSecretException(Exception):
+    pass
+
+
+def reject():
+    raise InvalidSecretException()
+
+
+class CurrentMock(object):
+    def __init__(self, secret=None):
+        self.ctx = {} if secret is None else {'secret': secret}
+
+
+class ServantMock(object):
+    def __init__(self, manager, server, sid):
+        self.manager = manager
+        self.managerQueue = manager.message_queue()
+        self.sid = sid
+        self.server = server
+
+
+class DispatchTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("MumoManager").disabled = True
+
+    def testValidSecret(self):
+        secret = SECRET.encode('utf-8')
+        self.assertTrue(validSecret(CurrentMock(SECRET), secret))
+        self.assertFalse(validSecret(CurrentMock("secret"), secret))
+        self.assertFalse(validSecret(CurrentMock(), secret))
+        self.assertFalse(validSecret(None, secret))
+
+    def testInstall(self):
+        class Servant(ServantMock):
+            pass
+
+        installServerDispatchers(Servant, SECRET, reject)
+        for function in SERVER_CALLBACKS:
+            self.assertEqual(getattr(Servant, function).__name__, function)
+
+    def testRejectsInvalidSecret(self):
+        man = MumoManager(None, None)
+        dispatch = serverDispatcher("userStateChanged", SECRET, reject)
+        servant = ServantMock(man, "server", 1)
+
+        for current in (CurrentMock("wrong"), CurrentMock(), None):
+            with self.assertRaises(InvalidSecretException):
+                dispatch(servant, "state", current)
+        with self.assertRaises(InvalidSecretException):
+            dispatch(servant)
+        self.assertEqual(man.message_queue().qsize(), 0)
+
+    def testAnnounce(self):
+        class Module(MumoModule):
+            def __init__(self, name, manager, configuration=None):
+                MumoModule.__init__(self, name, manager, configuration)
+                self.calls = []
+
+            def connected(self):
+                self.manager().subscribeServerCallbacks(self)
+
+            def userStateChanged(self, server, state, context=None):
+                self.calls.append(("userStateChanged", server, state, context))
+
+            def userTextMessage(self, server, user, message, current=None):
+                self.calls.append(("userTextMessage", server, user, message, current))
+
+        man = MumoManager(None, None)
+        man.start()
+        try:
+            mod = man.loadModuleCls("module", Module)
+            man.startModules()
+            man.announceConnected()
+            drain(man)
+
+            current = CurrentMock(SECRET)
+            for secret in (SECRET, ""):
+                servant = ServantMock(man, "server", 1)
+                serverDispatcher("userStateChanged", secret, reject)(servant, "state", current)
+                serverDispatcher("userTextMessage", secret, reject)(servant, "user", "hi", current)
+            drain(man)
+
+            self.assertEqual(mod.calls, [("userStateChanged", "server", "state", current),
+                                         ("userTextMessage", "server", "user", "hi", current)] * 2)
+            self.assertEqual(man.events[("userStateChanged", 1)], 2)
+        finally:
+            man.stop()
+            man.join(2)
+
+    def testMatchesLegacyDispatch(self):
+        """
+        The fused dispatchers timed in bench.micro announce exactly what the
+        decorators they replaced did.
+        """
+        man = MumoManager(None, None)
+        queue = man.message_queue()
+        legacy = micro.LegacyServant(man, "server", 1)
+        fused = micro.FusedServant(man, "server", 1)
+
+        current = micro.CurrentMock(micro.SECRET)
+        announced = []
+        for servant in (legacy, fused):
+            servant.userStateChanged("state", current)
+            self.assertEqual(queue.qsize(), 1)
+            announced.append(queue.get_nowait())
+
+            for invalid in (micro.CurrentMock("wrong"), micro.CurrentMock()):
+                with self.assertRaises(micro.InvalidSecretException):
+                    servant.userStateChanged("state", invalid)
+            self.assertEqual(queue.qsize(), 0)
+
+        self.assertEqual(announced[0], announced[1])
+        self.assertEqual(announced[0][2][1:], (1, "userStateChanged", "server", "state", current))
+
+    def testMicrobenchmark(self):
+        result = micro.runMicrobenchmark('dispatch', 10, 1)
+        self.assertEqual(result['benchmark'], 'dispatch')
+        self.assertGreater(result['before_us'], 0)
+        self.assertGreater(result['after_us'], 0)
+
+
+class DirectDispatchTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("MumoManager").disabled = True
+
+        class Module(MumoModule):
+            def __init__(self, name, manager, configuration=None):
+                MumoModule.__init__(self, name, manager, configuration)
+                self.calls = []
+                self.called = Event()
+
+            def connected(self):
+                self.manager().subscribeMetaCallbacks(self)
+                self.manager().subscribeServerCallbacks(self)
+
+            def started(self, server, current=None):
+                self.calls.append(("started", server))
+
+            def userStateChanged(self, server, state, current=None):
+                self.calls.append((server, state))
+                self.called.set()
+
+        self.man = MumoManager(None, None)
+        self.man.directDispatch = True
+        self.man.start()
+        self.mod = self.man.loadModuleCls("module", Module)
+        self.man.startModules()
+        self.man.announceConnected()
+        # Subscriptions hop back from the module to the manager
+        drain(self.man)
+        drain(self.man)
+
+    def tearDown(self):
+        self.man.stop()
+        self.man.join(2)
+
+    def block(self):
+        """
+        Keeps the manager thread busy until the returned event is set
+        """
+        release = Event()
+        self.man.message_queue().put((None, release.wait, (), {}))
+        return release
+
+    def testBypassesManager(self):
+        release = self.block()
+        try:
+            self.man.dispatchServer(1, "userStateChanged", "server", "state")
+            self.assertTrue(self.mod.called.wait(2))
+            self.assertEqual(self.mod.calls, [("server", "state")])
+        finally:
+            release.set()
+        drain(self.man)
+        self.assertEqual(self.man.events[("userStateChanged", 1)], 1)
+
+    def testKeepsOrderBehindRoutedAnnouncements(self):
+        release = self.block()
+        try:
+            self.man.dispatchMeta(1, "started", "server")
+            self.man.dispatchServer(1, "userStateChanged", "server", 1)
+            self.man.dispatchServer(2, "userStateChanged", "other", 2)
+            self.assertTrue(self.mod.called.wait(2))
+            # Only the other server is unaffected by the pending announcement
+            self.assertEqual(self.mod.calls, [("other", 2)])
+        finally:
+            release.set()
+        drain(self.man)
+        drain(self.man)
+        self.assertEqual(self.mod.calls, [("other", 2), ("started", "server"), ("server", 1)])
+        self.assertEqual(self.man.pending, {1: 0})
+
+    def testRoutesEventsActivatingLazyModules(self):
+        self.man.lazyFunctions = frozenset(["userStateChanged"])
+        release = self.block()
+        try:
+            self.man.dispatchServer(1, "userStateChanged", "server", "state")
+            self.assertFalse(self.mod.called.wait(0.1))
+        finally:
+            release.set()
+        drain(self.man)
+        drain(self.man)
+        self.assertEqual(self.mod.calls, [("server", "state")])
+
+    def testUnsubscribe(self):
+        self.mod.manager().unsubscribeServerCallbacks(self.mod)
+        drain(self.man)
+        self.man.dispatchServer(1, "userStateChanged", "server", "state")
+        drain(self.man)
+        self.assertEqual(self.mod.calls, [])
+
+    def testOrderPerServer(self):
+        count = 500
+
+        def announce(sid):
+            servant = ServantMock(self.man, sid, sid)
+            dispatch = serverDispatcher("userStateChanged", SECRET, reject, direct=True)
+            current = CurrentMock(SECRET)
+            for i in range(count):
+                if i % 50 == 0:
+                    self.man.dispatchMeta(sid, "started", sid)
+                dispatch(servant, i, current)
+
+        threads = [Thread(target=announce, args=(sid,)) for sid in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for _ in range(3):
+            drain(self.man)
+
+        for sid in range(1, 5):
+            expected = []
+            for i in range(count):
+                if i % 50 == 0:
+                    expected.append(("started", sid))
+                expected.append((sid, i))
+            self.assertEqual([call for call in self.mod.calls if call[0] == sid or call == ("started", sid)],
+                             expected)
+        self.assertEqual(self.man.events[("userStateChanged", 4)], count)
+
+    def testCountsConcurrentAnnouncements(self):
+        count = 2000
+        dispatch = serverDispatcher("userStateChanged", SECRET, reject, direct=True)
+
+        def announce():
+            servant = ServantMock(self.man, "server", 1)
+            current = CurrentMock(SECRET)
+            for i in range(count):
+                dispatch(servant, i, current)
+
+        def announceRouted():
+            for i in range(count):
+                self.man.announceServer(1, "userStateChanged", "server", i)
+
+        threads = [Thread(target=announce) for _ in range(4)] + [Thread(target=announceRouted)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for _ in range(3):
+            drain(self.man)
+
+        self.assertEqual(self.man.events[("userStateChanged", 1)], 5 * count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# exporter.py
+# Optional HTTP endpoint serving mumo metrics in the OpenMetrics
+# text format for Prometheus and compatible scrapers.
+#
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from threading import Thread
+
+from instrumentation import HISTOGRAM_BUCKETS, memoryUsage
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def escape(value):
+    """
+    Escapes a label value for the OpenMetrics text format.
+    """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsWriter(object):
+    """
+    Collects metric families and renders them as OpenMetrics text.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help):
+        self.lines.append("# TYPE %s %s" % (name, kind))
+        self.lines.append("# HELP %s %s" % (name, help))
+
+    def sample(self, name, labels, value):
+        if labels:
+            labels = ",".join('%s="%s"' % (key, escape(val)) for key, val in labels)
+            self.lines.append("%s{%s} %s" % (name, labels, number(value)))
+        else:
+            self.lines.append("%s %s" % (name, number(value)))
+
+    def histogram(self, name, labels, statistics):
+        """
+        Adds the samples of a histogram from the non-cumulative bucket
+        counts of instrumentation.HandlerStatistics.
+        """
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, statistics['buckets']):
+            cumulative += count
+            self.sample(name + "_bucket", labels + (("le", repr(bound)),), cumulative)
+        self.sample(name + "_bucket", labels + (("le", "+Inf"),), statistics['count'])
+        self.sample(name + "_count", labels, statistics['count'])
+        self.sample(name + "_sum", labels, statistics['total'])
+
+    def render(self):
+        return "\n".join(self.lines + ["# EOF", ""])
+
+
+def renderMetrics(statistics):
+    """
+    Renders the result of MumoManager.getStatistics as OpenMetrics text.
+    """
+    out = MetricsWriter()
+
+    workers = [("manager", statistics['manager'])] + sorted(statistics['modules'].items())
+
+    out.family("mumo_queue_depth", "gauge", "Messages waiting in the queue of a worker.")
+    for worker, stats in workers:
+        out.sample("mumo_queue_depth", (("worker", worker),), stats['depth'])
+
+    out.family("mumo_queue_peak", "gauge", "Highest number of messages waiting in the queue of a worker.")
+    for worker, stats in workers:
+        if stats['peak'] is not None:
+            out.sample("mumo_queue_peak", (("worker", worker),), stats['peak'])
+
+    out.family("mumo_handler_duration_seconds", "histogram", "Execution time of worker handlers.")
+    for worker, stats in workers:
+        for handler, hstats in sorted(stats['handlers'].items()):
+            out.histogram("mumo_handler_duration_seconds", (("worker", worker), ("handler", handler)), hstats)
+
+    out.family("mumo_handler_wait_seconds", "counter", "Time messages spent queued before their handler ran.")
+    for worker, stats in workers:
+        for handler, hstats in sorted(stats['handlers'].items()):
+            out.sample("mumo_handler_wait_seconds_total", (("worker", worker), ("handler", handler)), hstats['wait'])
+
+    out.family("mumo_handler_exceptions", "counter", "Exceptions raised by worker handlers.")
+    for worker, stats in workers:
+        for handler, hstats in sorted(stats['handlers'].items()):
+            out.sample("mumo_handler_exceptions_total", (("worker", worker), ("handler", handler)),
+                       hstats['exceptions'])
+
+    out.family("mumo_events", "counter", "Callbacks announced to the modules by callback and virtual server.")
+    for (callback, sid), count in sorted(statistics['events'].items(), key=lambda item: (item[0][0], item[0][1])):
+        out.sample("mumo_events_total", (("callback", callback), ("server", sid)), count)
+
+    out.family("mumo_ice_call_duration_seconds", "histogram", "Duration of the Ice calls made by mumo.")
+    for operation, stats in sorted(statistics['ice'].items()):
+        out.histogram("mumo_ice_call_duration_seconds", (("operation", operation),), stats)
+
+    out.family("mumo_ice_call_errors", "counter", "Ice calls made by mumo which raised an exception.")
+    for operation, stats in sorted(statistics['ice'].items()):
+        out.sample("mumo_ice_call_errors_total", (("operation", operation),), stats['exceptions'])
+
+    out.family("mumo_watchdog_reconnects", "counter", "Callback re-attachments by the connection watchdog.")
+    out.sample("mumo_watchdog_reconnects_total", (), statistics['reconnects'])
+
+    current, peak = memoryUsage()
+    if current is not None:
+        out.family("mumo_process_resident_memory_bytes", "gauge", "Resident memory of the mumo process.")
+        out.sample("mumo_process_resident_memory_bytes", (), current * 1024)
+    if peak is not None:
+        out.family("mumo_process_peak_resident_memory_bytes", "gauge", "Peak resident memory of the mumo process.")
+        out.sample("mumo_process_peak_resident_memory_bytes", (), peak * 1024)
+
+    return out.render()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        try:
+            body = renderMetrics(self.server.manager.getStatistics()).encode("utf-8")
+        except Exception as e:
+            self.server.log.exception(e)
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.log.debug(format, *args)
+
+
+class MetricsExporter(object):
+    """
+    Serves the statistics of a MumoManager on /metrics. Requests are
+    handled in their own daemon threads and only read snapshots of the
+    statistics, the dispatch path is never blocked by a scrape.
+    """
+
+    def __init__(self, manager, host="127.0.0.1", port=0):
+        """
+        @param manager: MumoManager to export statistics of
+        @param host: Address to listen on
+        @param port: Port to listen on, 0 picks a free one
+        """
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.log = getLogger("MetricsExporter")
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        """
+        Starts listening. Raises OSError if the address can not be bound.
+        """
+        self.httpd = ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.manager = self.manager
+        self.httpd.log = self.log
+        self.port = self.httpd.server_address[1]
+
+        self.thread = Thread(target=self.httpd.serve_forever, name="MetricsExporter")
+        self.thread.daemon = True
+        self.thread.start()
+        self.log.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+            self.thread = None
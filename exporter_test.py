@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import urllib.error
+import urllib.request
+from logging import getLogger
+
+from exporter import escape, MetricsExporter, renderMetrics
+from mumo_manager import MumoManager
+from mumo_module import MumoModule
+from mumo_replay import drain
+
+
+class ExporterTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("MumoManager").disabled = True
+        getLogger("MetricsExporter").disabled = True
+
+        class FailingModule(MumoModule):
+            def connected(self):
+                self.manager().subscribeServerCallbacks(self)
+
+            def userStateChanged(self, server, state, context=None):
+                if state == "fail":
+                    raise ValueError()
+
+        self.man = MumoManager(None, None)
+        self.man.start()
+        self.man.loadModuleCls("failing", FailingModule)
+        getLogger("failing").disabled = True
+        self.man.startModules()
+        self.man.announceConnected()
+        drain(self.man)
+
+        self.exporter = MetricsExporter(self.man)
+        self.exporter.start()
+
+    def tearDown(self):
+        self.exporter.stop()
+        self.man.stop()
+        self.man.join(2)
+
+    def scrape(self, path="/metrics"):
+        with urllib.request.urlopen("http://127.0.0.1:%d%s" % (self.exporter.port, path), timeout=5) as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("application/openmetrics-text"))
+            return response.read().decode("utf-8")
+
+    def samples(self, text):
+        samples = {}
+        for line in text.splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def testScrape(self):
+        for i in range(3):
+            self.man.announceServer(1, "userStateChanged", None, "ok")
+        self.man.announceServer(2, "userStateChanged", None, "fail")
+        with self.man.iceCalls.timed("Meta.getUptime"):
+            pass
+        self.man.countReconnect()
+        drain(self.man)
+
+        text = self.scrape()
+        self.assertTrue(text.endswith("# EOF\n"))
+        samples = self.samples(text)
+
+        self.assertEqual(samples['mumo_events_total{callback="userStateChanged",server="1"}'], 3)
+        self.assertEqual(samples['mumo_events_total{callback="userStateChanged",server="2"}'], 1)
+        self.assertEqual(samples['mumo_queue_depth{worker="failing"}'], 0)
+        self.assertEqual(samples['mumo_handler_duration_seconds_count{worker="failing",handler="userStateChanged"}'],
+                         4)
+        self.assertEqual(samples['mumo_handler_duration_seconds_bucket{worker="failing",handler="userStateChanged",'
+                                 'le="+Inf"}'], 4)
+        self.assertEqual(samples['mumo_handler_exceptions_total{worker="failing",handler="userStateChanged"}'], 1)
+        self.assertEqual(samples['mumo_ice_call_duration_seconds_count{operation="Meta.getUptime"}'], 1)
+        self.assertEqual(samples['mumo_watchdog_reconnects_total'], 1)
+
+        # Every family is declared exactly once
+        families = [line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")]
+        self.assertEqual(len(families), len(set(families)))
+
+    def testBucketsCumulative(self):
+        for i in range(5):
+            self.man.announceServer(1, "userStateChanged", None, "ok")
+        drain(self.man)
+
+        samples = self.samples(renderMetrics(self.man.getStatistics()))
+        buckets = [value for name, value in samples.items()
+                   if name.startswith('mumo_handler_duration_seconds_bucket{worker="failing",'
+                                      'handler="userStateChanged"')]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1], 5)
+
+    def testNotFound(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.scrape("/")
+        self.assertEqual(cm.exception.code, 404)
+
+    def testEscape(self):
+        self.assertEqual(escape('a"b\\c\nd'), 'a\\"b\\\\c\\nd')
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# healthmonitor.py
+# Watches the Ice connection to the Mumble server and re-attaches the
+# callbacks of servers that restarted while we were not looking.
+#
+
+from logging import getLogger
+from threading import Event, Lock, Thread
+from time import monotonic
+
+
+class HealthMonitor(Thread):
+    """
+    Single long-lived thread watching the connection to the server.
+
+    The monitor sleeps until the close callback of the connection fires
+    or, at the latest, check_interval seconds passed and probes the
+    connection with a single call. The probe catches servers which hung
+    or connections which went half-open without being closed. Once the
+    connection is lost it reports the loss and reconnects every
+    retry_interval seconds. Once reconnected all callbacks are attached
+    again as the server drops callbacks it failed to reach meanwhile.
+    The uptimes of the virtual servers are only fetched then and compared
+    against the monotonic clock to tell which of them restarted.
+    """
+
+    def __init__(self, connect, reattach, disconnected, retry_interval=1.0, check_interval=None, tolerance=2.0,
+                 clock=monotonic):
+        """
+        @param connect: connect(closed, full) establishes the connection, makes
+                        sure closed() is called once it goes away and returns a
+                        tuple of the server uptime and, if full is true, a dict
+                        {sid:uptime} of the watched virtual servers which are
+                        running or None otherwise.
+        @param reattach: reattach(restarted) re-attaches the meta callback and
+                         the callbacks of all running virtual servers. restarted
+                         is the set of virtual servers which restarted while
+                         the connection was down. Returns True on success.
+        @param disconnected: disconnected() is called once per connection loss
+        @param retry_interval: Seconds between reconnection attempts
+        @param check_interval: Seconds between probes of a healthy connection,
+                               None to only rely on the close callback. connect
+                               is expected to fail within that time on a hung
+                               server and only fetches the server uptime.
+        @param tolerance: Seconds a boot time estimate may drift before it is
+                          taken as a restart
+        @param clock: Monotonic clock to estimate boot times with
+        """
+        Thread.__init__(self, name="HealthMonitor")
+        self.daemon = True
+        self.connect = connect
+        self.reattach = reattach
+        self.disconnected = disconnected
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        self.tolerance = tolerance
+        self.clock = clock
+        self.log = getLogger("HealthMonitor")
+
+        self.wakeup = Event()
+        self.lock = Lock()
+        self.running = True
+        self.closed_connection = False
+        self.lost = False
+
+        self.meta_boot = None  # Estimated boot time of the server
+        self.boots = {}  # {sid:estimated boot time}
+
+    def closed(self, *args):
+        """
+        Close callback of the connection. May be called from any thread.
+        """
+        self.closed_connection = True
+        self.wakeup.set()
+
+    def serverStarted(self, sid):
+        """
+        Tells the monitor a virtual server was started and attached while
+        connected so a later reconnect does not attach it a second time.
+        """
+        with self.lock:
+            self.boots[sid] = self.clock()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def run(self):
+        timeout = 0
+        while True:
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            if not self.running:
+                break
+
+            if self.closed_connection:
+                self.closed_connection = False
+                self.connectionLost()
+
+            try:
+                healthy = self.check()
+            except Exception as e:
+                self.log.debug("Connection check failed: %s", e)
+                healthy = False
+
+            if healthy:
+                timeout = self.check_interval
+            else:
+                self.connectionLost()
+                timeout = self.retry_interval
+
+    def connectionLost(self):
+        if self.lost:
+            return
+
+        self.lost = True
+        self.log.error("Connection to server lost, reconnecting every %gs", self.retry_interval)
+        try:
+            self.disconnected()
+        except Exception as e:
+            self.log.exception(e)
+
+    def check(self):
+        """
+        Connects and, after a connection loss or a restart of the server,
+        re-attaches all callbacks.
+
+        @return True if the connection is up and all callbacks are attached
+        """
+        full = self.lost or self.meta_boot is None
+        meta_uptime, uptimes = self.connect(self.closed, full)
+        now = self.clock()
+        meta_boot = now - meta_uptime
+
+        with self.lock:
+            if self.meta_boot is None:
+                # First contact, callbacks were attached by the caller
+                self.meta_boot = meta_boot
+                self.boots = dict((sid, now - uptime) for sid, uptime in uptimes.items())
+                return True
+
+            restarted = abs(meta_boot - self.meta_boot) > self.tolerance
+            if not full:
+                # Restarted between two probes, handle it like a lost connection
+                return not restarted
+
+            boots = {}
+            stale = set()
+            for sid, uptime in uptimes.items():
+                boots[sid] = now - uptime
+                previous = self.boots.get(sid)
+                if restarted or previous is None or abs(boots[sid] - previous) > self.tolerance:
+                    stale.add(sid)
+
+        if restarted:
+            self.log.info("Reconnected to restarted server, re-attaching all callbacks")
+        elif stale:
+            self.log.info("Reconnected to server, virtual servers %s restarted, re-attaching all callbacks",
+                          ", ".join(str(sid) for sid in sorted(stale)))
+        else:
+            self.log.info("Reconnected to server, re-attaching all callbacks")
+
+        if not self.reattach(stale):
+            return False
+
+        with self.lock:
+            self.meta_boot = meta_boot
+            self.boots = boots
+        self.lost = False
+        return True
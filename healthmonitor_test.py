@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import unittest
+from logging import getLogger
+from threading import Event, Lock
+
+from healthmonitor import HealthMonitor
+
+
+class FakeServer(object):
+    """
+    Server whose uptimes follow the real monotonic clock
+    """
+
+    def __init__(self, sids):
+        self.lock = Lock()
+        self.up = True
+        self.boot = time.monotonic() - 100
+        self.boots = dict((sid, self.boot) for sid in sids)
+        self.closed = None
+        self.connects = 0
+        self.fullConnects = 0
+
+    def connect(self, closed, full):
+        with self.lock:
+            self.connects += 1
+            if not self.up:
+                raise ConnectionRefusedError()
+            self.closed = closed
+            now = time.monotonic()
+            if not full:
+                return int(now - self.boot), None
+            self.fullConnects += 1
+            return int(now - self.boot), dict((sid, int(now - boot)) for sid, boot in self.boots.items())
+
+    def crash(self):
+        with self.lock:
+            self.up = False
+        self.closed()
+
+    def restart(self, sids=None):
+        """
+        Restarts the given virtual servers or the whole server
+        """
+        with self.lock:
+            now = time.monotonic()
+            if sids is None:
+                self.boot = now
+                sids = self.boots.keys()
+            for sid in sids:
+                self.boots[sid] = now
+            self.up = True
+
+
+class HealthMonitorTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("HealthMonitor").disabled = True
+        self.server = FakeServer([1, 2, 3])
+        self.reattached = []
+        self.reattachedEvent = Event()
+        self.disconnects = 0
+        self.disconnectedEvent = Event()
+        self.monitor = HealthMonitor(self.server.connect, self.reattach, self.disconnected,
+                                     retry_interval=0.05)
+        self.monitor.start()
+        self.waitFor(lambda: self.server.connects == 1)
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.monitor.join(2)
+
+    def reattach(self, restarted):
+        self.reattached.append(restarted)
+        self.reattachedEvent.set()
+        return True
+
+    def disconnected(self):
+        self.disconnects += 1
+        self.disconnectedEvent.set()
+
+    def waitFor(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def testNoPollingWhileHealthy(self):
+        time.sleep(0.3)
+        self.assertEqual(self.server.connects, 1)
+        self.assertEqual(self.reattached, [])
+        self.assertEqual(self.disconnects, 0)
+
+    def testHungServerDetected(self):
+        self.monitor.stop()
+        self.monitor.join(2)
+        self.server.fullConnects = 0
+        self.monitor = HealthMonitor(self.server.connect, self.reattach, self.disconnected,
+                                     retry_interval=0.05, check_interval=0.1)
+        self.monitor.start()
+        self.waitFor(lambda: self.server.connects >= 3)
+        # Probes of a healthy connection only fetch the server uptime
+        self.assertEqual(self.server.fullConnects, 1)
+
+        # Probes time out but the connection is never closed
+        with self.server.lock:
+            self.server.up = False
+        self.assertTrue(self.disconnectedEvent.wait(1))
+        self.assertEqual(self.disconnects, 1)
+
+        with self.server.lock:
+            self.server.up = True
+        self.assertTrue(self.reattachedEvent.wait(1))
+        self.assertEqual(self.reattached, [set()])
+        self.assertEqual(self.server.fullConnects, 2)
+
+    def testDisconnectDetectedImmediately(self):
+        start = time.monotonic()
+        self.server.crash()
+        self.assertTrue(self.disconnectedEvent.wait(1))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+        # Keeps retrying, but reports the loss only once
+        self.waitFor(lambda: self.server.connects >= 4)
+        self.assertEqual(self.disconnects, 1)
+
+    def testReconnectWithoutRestart(self):
+        self.server.crash()
+        self.assertTrue(self.disconnectedEvent.wait(1))
+        with self.server.lock:
+            self.server.up = True
+
+        # Callbacks are attached again even though nothing restarted
+        self.assertTrue(self.reattachedEvent.wait(1))
+        self.assertEqual(self.reattached, [set()])
+
+    def testServerRestart(self):
+        self.server.crash()
+        self.assertTrue(self.disconnectedEvent.wait(1))
+        self.server.restart()
+
+        self.assertTrue(self.reattachedEvent.wait(1))
+        self.assertEqual(self.reattached, [{1, 2, 3}])
+        self.assertEqual(self.disconnects, 1)
+
+    def testVirtualServerRestart(self):
+        self.server.crash()
+        self.assertTrue(self.disconnectedEvent.wait(1))
+        self.server.restart([2])
+
+        self.assertTrue(self.reattachedEvent.wait(1))
+        self.assertEqual(self.reattached, [{2}])
+
+    def testRestartBetweenProbes(self):
+        self.monitor.stop()
+        self.monitor.join(2)
+        self.monitor = HealthMonitor(self.server.connect, self.reattach, self.disconnected,
+                                     retry_interval=0.05, check_interval=0.1)
+        self.monitor.start()
+        self.waitFor(lambda: self.server.connects >= 2)
+
+        # The connection survived, the new boot time gives the restart away
+        self.server.restart()
+        self.assertTrue(self.reattachedEvent.wait(1))
+        self.assertEqual(self.reattached, [{1, 2, 3}])
+        self.assertEqual(self.disconnects, 1)
+
+    def testServerStartedWhileConnected(self):
+        with self.server.lock:
+            self.server.boots[4] = time.monotonic()
+        self.monitor.serverStarted(4)
+
+        self.server.crash()
+        self.assertTrue(self.disconnectedEvent.wait(1))
+        with self.server.lock:
+            self.server.up = True
+
+        self.assertTrue(self.reattachedEvent.wait(1))
+        self.assertEqual(self.reattached, [set()])
+
+    def testFailedReattachIsRetried(self):
+        results = [False, True]
+        self.monitor.reattach = lambda restarted: results.pop(0)
+
+        self.server.crash()
+        self.assertTrue(self.disconnectedEvent.wait(1))
+        self.server.restart([1])
+
+        self.waitFor(lambda: not results)
+        self.waitFor(lambda: not self.monitor.lost)
+        self.assertEqual(self.disconnects, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# iceconfig.py
+# Turns the [ice] section of the configuration into Ice properties for
+# the communicator and the object adapter serving our callbacks.
+#
+
+from config import x2bool
+
+# Name of the object adapter Murmur delivers its callbacks to
+CALLBACK_ADAPTER = 'Callback.Client'
+
+# Tuning options of the [ice] section
+ICE_TUNING_DEFAULTS = (('callback_threads', int, 1),
+                       ('callback_threads_max', int, 0),
+                       ('callback_serialize', x2bool, True),
+                       ('message_size_max', int, 1024),
+                       ('compress', x2bool, False))
+
+
+def iceProperties(ice, adapter=CALLBACK_ADAPTER):
+    """
+    Returns the Ice properties for the tuning options of the [ice] section
+
+    Murmur delivers the callbacks of all virtual servers over a single
+    connection. With callback_serialize Ice dispatches the requests of
+    a connection one after another, which keeps the callbacks of every
+    virtual server in the order Murmur sent them no matter how many
+    threads the pool has. Without it the pool dispatches concurrently
+    and the order of callbacks is undefined.
+
+    @param ice: [ice] configuration section
+    @param adapter: Name of the object adapter serving the callbacks
+    @return List of (property, value) tuples
+    @raise ValueError: If the configuration is inconsistent
+    """
+    threads = ice.callback_threads
+    if threads < 1:
+        raise ValueError("callback_threads must be at least 1, got %d" % threads)
+
+    threads_max = ice.callback_threads_max or threads
+    if threads_max < threads:
+        raise ValueError("callback_threads_max (%d) must not be less than callback_threads (%d)"
+                         % (threads_max, threads))
+
+    if ice.message_size_max < 0:
+        raise ValueError("message_size_max must not be negative, got %d" % ice.message_size_max)
+
+    properties = [('%s.ThreadPool.Size' % adapter, str(threads)),
+                  ('%s.ThreadPool.SizeMax' % adapter, str(threads_max)),
+                  ('%s.ThreadPool.Serialize' % adapter, '1' if ice.callback_serialize else '0'),
+                  ('Ice.MessageSizeMax', str(ice.message_size_max))]
+
+    if ice.compress:
+        properties.append(('Ice.Override.Compress', '1'))
+
+    return properties
+
+
+def overriddenProperties(properties, raw):
+    """
+    Returns the names of properties also set in the raw passthrough
+
+    @param properties: List of (property, value) tuples
+    @param raw: List of (property, value) tuples from [iceraw]
+    """
+    rawnames = set(name for name, _ in raw)
+    return [name for name, _ in properties if name in rawnames]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from config import Config
+from iceconfig import ICE_TUNING_DEFAULTS, iceProperties, overriddenProperties
+
+
+def iceConfig(**options):
+    ice = Config(default={'ice': ICE_TUNING_DEFAULTS}).ice
+    ice.__dict__.update(options)
+    return ice
+
+
+class IceConfigTest(unittest.TestCase):
+    def testDefaults(self):
+        self.assertEqual(iceProperties(iceConfig()),
+                         [('Callback.Client.ThreadPool.Size', '1'),
+                          ('Callback.Client.ThreadPool.SizeMax', '1'),
+                          ('Callback.Client.ThreadPool.Serialize', '1'),
+                          ('Ice.MessageSizeMax', '1024')])
+
+    def testTuning(self):
+        properties = dict(iceProperties(iceConfig(callback_threads=4, callback_threads_max=8,
+                                                  callback_serialize=False, message_size_max=0,
+                                                  compress=True), adapter="Adapter"))
+        self.assertEqual(properties, {'Adapter.ThreadPool.Size': '4',
+                                      'Adapter.ThreadPool.SizeMax': '8',
+                                      'Adapter.ThreadPool.Serialize': '0',
+                                      'Ice.MessageSizeMax': '0',
+                                      'Ice.Override.Compress': '1'})
+
+    def testValidation(self):
+        self.assertRaises(ValueError, iceProperties, iceConfig(callback_threads=0))
+        self.assertRaises(ValueError, iceProperties, iceConfig(callback_threads=4, callback_threads_max=2))
+        self.assertRaises(ValueError, iceProperties, iceConfig(message_size_max=-1))
+
+    def testOverridden(self):
+        properties = iceProperties(iceConfig())
+        raw = [('Ice.MessageSizeMax', '4096'), ('Ice.ThreadPool.Server.Size', '5')]
+        self.assertEqual(overriddenProperties(properties, raw), ['Ice.MessageSizeMax'])
+        self.assertEqual(overriddenProperties(properties, []), [])
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
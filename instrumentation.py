@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# instrumentation.py
+# Low overhead statistics about the message queues and handlers
+# of Worker threads.
+#
+
+import os
+import sys
+import traceback
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from queue import Queue
+from logging import getLogger
+from threading import Event, Lock, Thread
+from time import monotonic
+
+try:
+    import resource
+except ImportError:  # Not available on all platforms
+    resource = None
+
+# Upper bounds in seconds of the execution time histogram buckets. A last
+# bucket without upper bound catches everything slower.
+HISTOGRAM_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                     0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class InstrumentedQueue(Queue):
+    """
+    Queue remembering when each item was put into it as well as
+    the highest number of items it held at once.
+
+    After a get the enqueue time of the returned item is available
+    as enqueued. This is only meaningful for queues with a single
+    consumer like the message queue of a Worker.
+    """
+
+    def _init(self, maxsize):
+        Queue._init(self, maxsize)
+        self.timestamps = deque()
+        self.peak = 0
+        self.enqueued = None
+
+    def _put(self, item):
+        self.queue.append(item)
+        self.timestamps.append(monotonic())
+        if len(self.queue) > self.peak:
+            self.peak = len(self.queue)
+
+    def _get(self):
+        self.enqueued = self.timestamps.popleft()
+        return self.queue.popleft()
+
+    def resetPeak(self):
+        with self.mutex:
+            self.peak = len(self.queue)
+
+    def withdraw(self, predicate):
+        """
+        Removes all items matching predicate which were not fetched yet.
+
+        @return List of the removed items
+        """
+        with self.mutex:
+            removed = []
+            kept = deque()
+            timestamps = deque()
+            for item, timestamp in zip(self.queue, self.timestamps):
+                if predicate(item):
+                    removed.append(item)
+                else:
+                    kept.append(item)
+                    timestamps.append(timestamp)
+            self.queue = kept
+            self.timestamps = timestamps
+            self.unfinished_tasks -= len(removed)
+            return removed
+
+
+class HandlerStatistics(object):
+    """
+    Call statistics of a single handler. Times are in seconds.
+    """
+
+    __slots__ = ("count", "exceptions", "total", "max", "wait", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.exceptions = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.wait = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def add(self, duration, wait, failed):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.wait += wait
+        self.buckets[bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+        if failed:
+            self.exceptions += 1
+
+    def asDict(self):
+        return {'count': self.count,
+                'exceptions': self.exceptions,
+                'total': self.total,
+                'max': self.max,
+                'wait': self.wait,
+                'buckets': list(self.buckets)}
+
+
+class WorkerStatistics(object):
+    """
+    Statistics of all handlers executed by one Worker. Only the
+    worker thread itself records, other threads may take snapshots.
+    """
+
+    def __init__(self):
+        self.handlers = {}  # {name:HandlerStatistics}
+
+    def record(self, fu, enqueued, start, end, failed):
+        """
+        @param fu: Function that was executed
+        @param enqueued: Time the message was queued or None if unknown
+        @param start: Time the execution started
+        @param end: Time the execution finished
+        @param failed: True if the function raised an exception
+        """
+        name = getattr(fu, "__name__", None) or repr(fu)
+        self.add(name, end - start, start - enqueued if enqueued is not None else 0.0, failed)
+
+    def add(self, name, duration, wait, failed):
+        try:
+            handler = self.handlers[name]
+        except KeyError:
+            handler = self.handlers[name] = HandlerStatistics()
+        handler.add(duration, wait, failed)
+
+    def snapshot(self):
+        """
+        @return Dictionary of {handler name:statistics dictionary}
+        """
+        return dict((name, handler.asDict()) for name, handler in list(self.handlers.items()))
+
+
+class CallStatistics(WorkerStatistics):
+    """
+    Statistics of calls issued from arbitrary threads, e.g. the Ice
+    calls mumo itself makes to the server.
+    """
+
+    def __init__(self):
+        WorkerStatistics.__init__(self)
+        self.lock = Lock()
+
+    def add(self, name, duration, wait, failed):
+        with self.lock:
+            WorkerStatistics.add(self, name, duration, wait, failed)
+
+    @contextmanager
+    def timed(self, name):
+        """
+        Context manager recording the execution time of its body as
+        a call of the given name. Exceptions count as failed calls.
+
+        >>> with statistics.timed("Meta.getUptime"):
+        ...     meta.getUptime()
+        """
+        start = monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.add(name, monotonic() - start, 0.0, failed)
+
+
+class SlowHandlerDetector(Thread):
+    """
+    Watchdog thread noticing workers which are stuck in a single message.
+
+    If a worker executes the same message for longer than threshold
+    seconds the stack of its thread is logged together with the worker
+    name, the handler and the depth of its queue. Reports for the same
+    worker are rate limited to one per repeat seconds.
+    """
+
+    def __init__(self, workers, threshold, repeat=60.0, interval=None):
+        """
+        @param workers: Callable returning a list of (name, worker) tuples to watch
+        @param threshold: Seconds a message may take before it is reported
+        @param repeat: Minimum seconds between two reports for the same worker
+        @param interval: Seconds between checks, defaults to a fraction of threshold
+        """
+        Thread.__init__(self, name="SlowHandlerDetector")
+        self.daemon = True
+        self.workers = workers
+        self.threshold = threshold
+        self.repeat = repeat
+        self.interval = interval if interval is not None else min(max(threshold / 4.0, 0.01), 1.0)
+        self.log = getLogger("SlowHandlerDetector")
+
+        self.reported = {}  # {worker name:monotonic time of last report}
+        self.reports = 0
+        self.__stopped = Event()
+
+    def run(self):
+        while not self.__stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.log.exception(e)
+
+    def stop(self):
+        self.__stopped.set()
+
+    def check(self, now=None):
+        """
+        Checks all workers once and logs the ones stuck for too long.
+
+        @param now: Monotonic time to check against, defaults to now
+        @return List of (name, handler, seconds, queue depth, stack) tuples reported
+        """
+        if now is None:
+            now = monotonic()
+
+        reports = []
+        for name, worker in self.workers():
+            current = worker.currentMessage()
+            if current is None:
+                continue
+
+            fu, start = current
+            elapsed = now - start
+            if elapsed < self.threshold:
+                continue
+
+            last = self.reported.get(name)
+            if last is not None and now - last < self.repeat:
+                continue
+
+            frame = sys._current_frames().get(worker.ident)
+            if frame is None or worker.currentMessage() is not current:
+                # Finished in the meantime
+                continue
+            stack = "".join(traceback.format_stack(frame))
+
+            handler = getattr(fu, "__qualname__", None) or repr(fu)
+            depth = worker.message_queue().qsize()
+            self.log.warning("Worker '%s' is stuck in '%s' for %.1fs with %d queued messages, stack:\n%s",
+                             name, handler, elapsed, depth, stack)
+
+            self.reported[name] = now
+            self.reports += 1
+            reports.append((name, handler, elapsed, depth, stack))
+
+        return reports
+
+
+def memoryUsage():
+    """
+    Returns a tuple of the current and the peak resident set size of
+    the process in KiB. Values not available on this platform are None.
+    """
+    current = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    return current, peak
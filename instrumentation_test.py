@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+from logging import getLogger
+from threading import Event
+from time import monotonic, sleep
+
+from instrumentation import HandlerStatistics, HISTOGRAM_BUCKETS, InstrumentedQueue, SlowHandlerDetector
+from mumo_manager import MumoManager
+from mumo_module import MumoModule
+from mumo_replay import drain
+from worker import Worker, local_thread, local_thread_blocking
+
+
+class InstrumentationTest(unittest.TestCase):
+    def testQueue(self):
+        q = InstrumentedQueue()
+        for i in range(3):
+            q.put(i)
+        self.assertEqual(q.peak, 3)
+        self.assertEqual(q.get(), 0)
+        first = q.enqueued
+        self.assertEqual(q.get(), 1)
+        self.assertGreaterEqual(q.enqueued, first)
+        q.resetPeak()
+        self.assertEqual(q.peak, 1)
+
+    def testQueueWithdraw(self):
+        q = InstrumentedQueue()
+        for i in range(5):
+            q.put(i)
+        self.assertEqual(q.withdraw(lambda item: item % 2), [1, 3])
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual([q.get() for _ in range(3)], [0, 2, 4])
+        self.assertEqual(len(q.timestamps), 0)
+
+    def testHistogram(self):
+        stats = HandlerStatistics()
+        stats.add(0.0, 0.0, False)
+        stats.add(HISTOGRAM_BUCKETS[0], 0.5, False)
+        stats.add(0.003, 0.0, True)
+        stats.add(3600.0, 0.0, False)
+
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.exceptions, 1)
+        self.assertEqual(stats.max, 3600.0)
+        self.assertEqual(stats.wait, 0.5)
+        self.assertEqual(stats.buckets[0], 2)
+        self.assertEqual(stats.buckets[HISTOGRAM_BUCKETS.index(0.005)], 1)
+        self.assertEqual(stats.buckets[-1], 1)
+        self.assertEqual(sum(stats.buckets), stats.count)
+
+
+class InstrumentedWorker(Worker):
+    @local_thread_blocking
+    def work(self, duration=0.0):
+        sleep(duration)
+
+    @local_thread
+    def sleep(self, duration):
+        sleep(duration)
+
+    @local_thread_blocking
+    def fail(self):
+        raise ValueError()
+
+
+class WorkerInstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("Instrumented").disabled = True
+        self.w = InstrumentedWorker("Instrumented")
+        self.w.start()
+
+    def tearDown(self):
+        self.w.stop()
+        self.w.join(2)
+
+    def testHandlerStatistics(self):
+        self.w.work(0.01)
+        self.w.work()
+        self.assertRaises(ValueError, self.w.fail)
+
+        stats = self.w.statistics()
+        self.assertTrue(stats["enabled"])
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["peak"], 1)
+
+        work = stats["handlers"]["work"]
+        self.assertEqual(work["count"], 2)
+        self.assertEqual(work["exceptions"], 0)
+        self.assertGreaterEqual(work["total"], 0.01)
+        self.assertGreaterEqual(work["max"], 0.01)
+        self.assertEqual(stats["handlers"]["fail"]["exceptions"], 1)
+
+    def testQueueWait(self):
+        self.w.sleep(0.05)
+        self.w.work()
+        stats = self.w.statistics()["handlers"]["work"]
+        self.assertGreaterEqual(stats["wait"], 0.04)
+        self.assertEqual(self.w.statistics()["peak"], 2)
+
+    def testToggle(self):
+        self.w.setInstrumentation(False)
+        self.w.work()
+        self.assertEqual(self.w.statistics()["handlers"], {})
+        self.assertFalse(self.w.statistics()["enabled"])
+
+        self.w.setInstrumentation(True)
+        self.w.work()
+        self.assertEqual(self.w.statistics()["handlers"]["work"]["count"], 1)
+
+        self.w.resetStatistics()
+        self.assertEqual(self.w.statistics()["handlers"], {})
+
+
+class SlowHandlerDetectorTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("Stuck").disabled = True
+        getLogger("SlowHandlerDetector").disabled = True
+        self.release = Event()
+        self.w = InstrumentedWorker("Stuck")
+        self.w.start()
+        self.detector = SlowHandlerDetector(lambda: [("stuck", self.w)], threshold=0.05, repeat=10.0)
+
+    def tearDown(self):
+        self.release.set()
+        self.w.stop()
+        self.w.join(2)
+
+    def hang(self):
+        self.w.call_by_name(self, "waitForRelease")
+        self.w.sleep(0)  # Queued behind the hanging message
+        while self.w.currentMessage() is None:
+            sleep(0.001)
+
+    def waitForRelease(self):
+        self.release.wait(5)
+
+    def testIdle(self):
+        self.assertIsNone(self.w.currentMessage())
+        self.assertEqual(self.detector.check(), [])
+
+    def testReport(self):
+        self.hang()
+        self.assertEqual(self.detector.check(), [])  # Below threshold
+
+        reports = self.detector.check(monotonic() + 1.0)
+        self.assertEqual(len(reports), 1)
+        name, handler, elapsed, depth, stack = reports[0]
+        self.assertEqual(name, "stuck")
+        self.assertEqual(handler, "Worker.call_by_name")
+        self.assertGreaterEqual(elapsed, 1.0)
+        self.assertEqual(depth, 1)
+        self.assertIn("waitForRelease", stack)
+
+        # Rate limited
+        self.assertEqual(self.detector.check(monotonic() + 2.0), [])
+        self.assertEqual(len(self.detector.check(monotonic() + 12.0)), 1)
+        self.assertEqual(self.detector.reports, 2)
+
+        self.release.set()
+        self.w.work()
+        self.assertIsNone(self.w.currentMessage())
+
+    def testThread(self):
+        self.detector.interval = 0.01
+        self.detector.start()
+        try:
+            self.hang()
+            for i in range(200):
+                if self.detector.reports:
+                    break
+                sleep(0.01)
+            self.assertEqual(self.detector.reports, 1)
+        finally:
+            self.detector.stop()
+            self.detector.join(2)
+
+
+class ManagerInstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("MumoManager").disabled = True
+
+        class CountingModule(MumoModule):
+            def connected(self):
+                self.manager().subscribeServerCallbacks(self)
+
+            def userStateChanged(self, server, state, context=None):
+                pass
+
+        self.man = MumoManager(None, None)
+        self.man.start()
+        self.mod = self.man.loadModuleCls("counting", CountingModule)
+        self.man.startModules()
+        self.man.announceConnected()
+        drain(self.man)
+
+    def tearDown(self):
+        self.man.stop()
+        self.man.join(2)
+
+    def testGetStatistics(self):
+        for i in range(10):
+            self.man.announceServer(1, "userStateChanged", None, None)
+        drain(self.man)
+
+        stats = self.man.getStatistics()
+        self.assertEqual(stats["manager"]["handlers"]["announceServer"]["count"], 10)
+        module = stats["modules"]["counting"]
+        self.assertEqual(module["handlers"]["userStateChanged"]["count"], 10)
+        self.assertEqual(module["depth"], 0)
+        self.assertGreaterEqual(module["peak"], 1)
+
+        self.man.setInstrumentation(False)
+        self.assertFalse(self.man.getStatistics()["modules"]["counting"]["enabled"])
+        self.man.resetStatistics()
+        self.assertEqual(self.man.getStatistics()["modules"]["counting"]["handlers"], {})
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
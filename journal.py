@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# journal.py
+# Append-only binary journal of the callbacks announced by the
+# MumoManager. Journals can be replayed into a manager without
+# Ice using mumo_replay.py.
+#
+
+import marshal
+import os
+import struct
+from threading import RLock, Timer
+from time import monotonic
+
+JOURNAL_MAGIC = b"MUMOJRN1"
+
+# Record header: monotonic timestamp, record kind, sid, payload length
+RECORD_HEADER = struct.Struct("<dBiI")
+
+KIND_SERVER = 0
+KIND_META = 1
+KIND_START = 2  # Marks the start of a new run, timestamps are not comparable across runs
+
+# Key marking a dictionary as the attribute snapshot of an object
+CLASS_KEY = "\0class"
+
+# Objects nested deeper than this are not recorded
+MAX_DEPTH = 8
+
+
+class JournalFormatException(Exception):
+    pass
+
+
+def snapshot(obj, depth=0):
+    """
+    Converts the given callback argument into something marshal can store.
+
+    Primitives and containers are kept as they are, other objects are
+    stored as a dictionary of their attributes. Ice proxies and the
+    Ice.Current of a call (which carries the Ice secret) are never
+    recorded and replaced with None.
+
+    @param obj: Object to convert
+    @param depth: Current nesting depth
+    @return Marshallable representation of obj
+    """
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        return obj
+
+    if depth >= MAX_DEPTH:
+        return None
+
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(item, depth + 1) for item in obj)
+
+    if isinstance(obj, dict):
+        return dict((key, snapshot(value, depth + 1)) for key, value in obj.items())
+
+    if hasattr(obj, "ice_getIdentity"):
+        # Proxies only make sense for the connection they came from
+        return None
+
+    cls = type(obj).__name__
+    if cls == "Current" and hasattr(obj, "ctx"):
+        return None
+
+    try:
+        attributes = vars(obj)
+    except TypeError:
+        return None
+
+    state = {CLASS_KEY: cls}
+    for name, value in attributes.items():
+        if not name.startswith("_"):
+            state[name] = snapshot(value, depth + 1)
+    return state
+
+
+class JournalObject(object):
+    """
+    Stand-in for an object recorded by snapshot(). Exposes the recorded
+    attributes and remembers the name of the original class.
+    """
+
+    def __init__(self, cls, attributes):
+        self.__dict__.update(attributes)
+        self._cls = cls
+
+    def __repr__(self):
+        attributes = ", ".join("%s=%r" % item for item in sorted(vars(self).items()) if not item[0].startswith("_"))
+        return "%s(%s)" % (self._cls, attributes)
+
+
+def restore(obj):
+    """
+    Reverses snapshot(). Recorded objects are returned as JournalObject
+    instances.
+
+    @param obj: Value as read from the journal
+    @return Restored value
+    """
+    if isinstance(obj, list):
+        return [restore(item) for item in obj]
+
+    if isinstance(obj, tuple):
+        return tuple(restore(item) for item in obj)
+
+    if isinstance(obj, dict):
+        if CLASS_KEY in obj:
+            attributes = dict((key, restore(value)) for key, value in obj.items() if key != CLASS_KEY)
+            return JournalObject(obj[CLASS_KEY], attributes)
+        return dict((key, restore(value)) for key, value in obj.items())
+
+    return obj
+
+
+class Journal(object):
+    """
+    Writer for the event journal.
+
+    Records are buffered in memory and written in blocks, at the latest
+    flush_interval seconds after they were added. Every journal starts
+    with a KIND_START marker as the monotonic timestamps of different
+    runs appended to the same file are unrelated. Once the
+    current file grows beyond max_bytes it is rotated to <path>.1,
+    older files move up to <path>.<backups> and are dropped beyond that.
+    Records may be added from any thread, records added after the
+    journal was closed are dropped.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=5, flush_interval=1.0, buffer_size=64 * 1024):
+        """
+        @param path: File to write to, appended to if it already exists
+        @param max_bytes: Rotate once the file is larger than this, 0 to never rotate
+        @param backups: Number of rotated files to keep
+        @param flush_interval: Seconds after which buffered records are written out at the latest
+        @param buffer_size: Bytes to buffer before writing
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+
+        self.records = 0
+        self.__lock = RLock()
+        self.__buffer = []
+        self.__buffered = 0
+        self.__file = None
+        self.__size = 0
+        self.__last_flush = monotonic()
+        self.__timer = None
+        self.__open()
+        self.__append(KIND_START, 0, marshal.dumps(("", (), {})), monotonic())
+
+    def __open(self):
+        self.__file = open(self.path, "ab")
+        self.__size = self.__file.tell()
+        if self.__size == 0:
+            self.__file.write(JOURNAL_MAGIC)
+            self.__file.flush()
+            self.__size = len(JOURNAL_MAGIC)
+
+    def __rotate(self):
+        self.__file.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = "%s.%d" % (self.path, i)
+                if os.path.exists(src):
+                    os.replace(src, "%s.%d" % (self.path, i + 1))
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.__open()
+
+    def record(self, kind, sid, function, args=(), kwargs=None, timestamp=None):
+        """
+        Appends an event to the journal.
+
+        @param kind: KIND_SERVER or KIND_META
+        @param sid: Virtual server id the event was announced for
+        @param function: Name of the callback
+        @param args: Callback arguments without the server proxy
+        @param kwargs: Callback keyword arguments
+        @param timestamp: Monotonic timestamp of the event, defaults to now
+        """
+        if timestamp is None:
+            timestamp = monotonic()
+
+        payload = marshal.dumps((function, snapshot(tuple(args)), snapshot(kwargs or {})))
+        with self.__lock:
+            if self.__file is None:
+                return
+
+            self.__append(kind, sid, payload, timestamp)
+            self.records += 1
+
+            if self.__buffered >= self.buffer_size or timestamp - self.__last_flush >= self.flush_interval:
+                self.flush()
+            elif self.__timer is None:
+                # Make sure the records are written out even if nothing follows
+                self.__timer = Timer(self.flush_interval, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def __append(self, kind, sid, payload, timestamp):
+        self.__buffer.append(RECORD_HEADER.pack(timestamp, kind, sid, len(payload)))
+        self.__buffer.append(payload)
+        self.__buffered += RECORD_HEADER.size + len(payload)
+
+    def flush(self):
+        """
+        Writes out all buffered records.
+        """
+        with self.__lock:
+            self.__last_flush = monotonic()
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if not self.__buffer or self.__file is None:
+                return
+
+            self.__file.write(b"".join(self.__buffer))
+            self.__file.flush()
+            self.__size += self.__buffered
+            self.__buffer = []
+            self.__buffered = 0
+
+            if self.max_bytes and self.__size > self.max_bytes:
+                self.__rotate()
+
+    def close(self):
+        """
+        Flushes and closes the journal.
+        """
+        with self.__lock:
+            if self.__file:
+                self.flush()
+                self.__file.close()
+                self.__file = None
+
+
+def readJournal(path, markers=False):
+    """
+    Reads all records of a journal file. A record cut short at the end of
+    the file, e.g. because mumo was killed mid write, is ignored.
+
+    @param path: Journal file to read
+    @param markers: Also return the KIND_START markers of each run
+    @return Generator of (timestamp, kind, sid, function, args, kwargs) tuples
+    """
+    with open(path, "rb") as f:
+        if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise JournalFormatException("'%s' is not a mumo journal" % path)
+
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+
+            timestamp, kind, sid, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+
+            if kind == KIND_START and not markers:
+                continue
+
+            function, args, kwargs = marshal.loads(payload)
+            yield timestamp, kind, sid, function, restore(args), restore(kwargs)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from logging import getLogger
+
+from journal import (Journal,
+                     JournalFormatException,
+                     KIND_META,
+                     KIND_SERVER,
+                     KIND_START,
+                     readJournal,
+                     snapshot)
+from mumo_manager import MumoManager
+from mumo_module import MumoModule
+from mumo_replay import drain, loadConfig, replay, ReplayMurmur, ReplayServer
+
+
+class StateMock(object):
+    def __init__(self, session, channel, name):
+        self.session = session
+        self.channel = channel
+        self.name = name
+        self.identity = ""
+
+
+class Current(object):
+    def __init__(self):
+        self.ctx = {"secret": "verysecret"}
+
+
+class ProxyMock(object):
+    def __init__(self, sid=1):
+        self.sid = sid
+
+    def id(self):
+        return self.sid
+
+    def ice_getIdentity(self):
+        return None
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "events.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testSnapshot(self):
+        state = snapshot((StateMock(1, 2, "name"), ProxyMock(), Current(), [1, (2.0, "3")], {"a": b"b"}))
+        self.assertEqual(state[0]["session"], 1)
+        self.assertEqual(state[0]["name"], "name")
+        self.assertIsNone(state[1])
+        self.assertIsNone(state[2])
+        self.assertEqual(state[3], [1, (2.0, "3")])
+        self.assertEqual(state[4], {"a": b"b"})
+
+    def testRoundTrip(self):
+        journal = Journal(self.path)
+        journal.record(KIND_META, 1, "started", (ProxyMock(), Current()), timestamp=1.0)
+        journal.record(KIND_SERVER, 1, "userStateChanged", (StateMock(5, 3, "foo"), Current()), timestamp=1.5)
+        journal.record(KIND_SERVER, 2, "userDisconnected", (StateMock(6, 0, "bar"),), {"context": None},
+                       timestamp=2.0)
+        journal.close()
+
+        records = list(readJournal(self.path))
+        self.assertEqual(len(records), 3)
+
+        self.assertEqual(records[0][:4], (1.0, KIND_META, 1, "started"))
+        self.assertEqual(records[0][4], (None, None))
+
+        timestamp, kind, sid, function, args, kwargs = records[1]
+        self.assertEqual((timestamp, kind, sid, function), (1.5, KIND_SERVER, 1, "userStateChanged"))
+        self.assertEqual((args[0].session, args[0].channel, args[0].name), (5, 3, "foo"))
+        self.assertEqual(args[0]._cls, "StateMock")
+        self.assertEqual(kwargs, {})
+
+        self.assertEqual(records[2][2], 2)
+        self.assertEqual(records[2][5], {"context": None})
+
+        # Reopening appends
+        journal = Journal(self.path)
+        journal.record(KIND_SERVER, 3, "channelCreated", (), timestamp=3.0)
+        journal.close()
+        self.assertEqual([r[2] for r in readJournal(self.path)], [1, 1, 2, 3])
+
+    def testBuffering(self):
+        journal = Journal(self.path, flush_interval=3600)
+        journal.record(KIND_SERVER, 1, "userConnected", (StateMock(1, 0, "a"),))
+        self.assertEqual(list(readJournal(self.path)), [])
+        journal.flush()
+        self.assertEqual(len(list(readJournal(self.path))), 1)
+        journal.close()
+
+    def testFlushAfterInterval(self):
+        journal = Journal(self.path, flush_interval=0.1)
+        journal.record(KIND_SERVER, 1, "userConnected", (StateMock(1, 0, "a"),))
+        self.assertEqual(list(readJournal(self.path)), [])
+        time.sleep(0.3)
+        self.assertEqual(len(list(readJournal(self.path))), 1)
+        journal.close()
+
+    def testRunMarkers(self):
+        for run in range(2):
+            journal = Journal(self.path)
+            journal.record(KIND_SERVER, 1, "userConnected", (StateMock(run, 0, "a"),))
+            journal.close()
+
+        self.assertEqual([r[1] for r in readJournal(self.path)], [KIND_SERVER] * 2)
+        self.assertEqual([r[1] for r in readJournal(self.path, markers=True)],
+                         [KIND_START, KIND_SERVER] * 2)
+
+    def testTruncatedRecord(self):
+        journal = Journal(self.path)
+        journal.record(KIND_SERVER, 1, "userConnected", (StateMock(1, 0, "a"),))
+        journal.record(KIND_SERVER, 1, "userConnected", (StateMock(2, 0, "b"),))
+        journal.close()
+
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual(len(list(readJournal(self.path))), 1)
+
+        with open(self.path, "wb") as f:
+            f.write(b"garbage!")
+        self.assertRaises(JournalFormatException, list, readJournal(self.path))
+
+    def testRotation(self):
+        journal = Journal(self.path, max_bytes=200, backups=2, flush_interval=0)
+        for i in range(20):
+            journal.record(KIND_SERVER, 1, "userStateChanged", (StateMock(i, 0, "x" * 20),))
+        journal.close()
+
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertTrue(os.path.exists(self.path + ".2"))
+        self.assertFalse(os.path.exists(self.path + ".3"))
+
+        for path in (self.path, self.path + ".1", self.path + ".2"):
+            self.assertLessEqual(os.path.getsize(path), 400)
+
+        sessions = []
+        for path in (self.path + ".2", self.path + ".1", self.path):
+            sessions.extend(args[0].session for _, _, _, _, args, _ in readJournal(path))
+        self.assertEqual(sessions, sorted(sessions))
+        self.assertEqual(sessions[-1], 19)
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("MumoManager").disabled = True
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "events.journal")
+
+        class RecordingModule(MumoModule):
+            def __init__(self, name, manager, configuration=None):
+                MumoModule.__init__(self, name, manager, configuration)
+                self.events = []
+
+            def connected(self):
+                self.manager().subscribeServerCallbacks(self)
+                self.manager().subscribeMetaCallbacks(self)
+
+            def started(self, server, context=None):
+                self.events.append(("started", server.id(), None))
+
+            def userStateChanged(self, server, state, context=None):
+                self.events.append(("userStateChanged", server.id(), state.channel))
+
+        self.modcls = RecordingModule
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def runManager(self, cfg=None):
+        man = MumoManager(ReplayMurmur(), None) if cfg is None else MumoManager(ReplayMurmur(), None, cfg)
+        man.start()
+        mod = man.loadModuleCls("recorder", self.modcls)
+        man.startModules()
+        man.announceConnected()
+        drain(man)
+        return man, mod
+
+    def testRecordAndReplay(self):
+        man, mod = self.runManager()
+        man.call_by_name_blocking(man, "startJournal", self.path)
+        man.announceMeta(1, "started", ProxyMock(), Current())
+        for channel in range(10):
+            man.announceServer(1, "userStateChanged", ProxyMock(), StateMock(1, channel, "p"), Current())
+        man.announceServer(2, "userStateChanged", ProxyMock(2), StateMock(2, 42, "q"), Current())
+        drain(man)
+        recorded = list(mod.events)
+        man.stop()
+        man.join()
+
+        with open(self.path, "rb") as f:
+            self.assertNotIn(b"verysecret", f.read())
+
+        man, mod = self.runManager()
+        start = time.monotonic()
+        self.assertEqual(replay(man, [self.path], speed=0), 12)
+        drain(man)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(mod.events, recorded)
+        man.stop()
+        man.join()
+
+    def testReplaySpeed(self):
+        journal = Journal(self.path)
+        journal.record(KIND_SERVER, 1, "userStateChanged", (StateMock(1, 1, "p"),), timestamp=10.0)
+        journal.record(KIND_SERVER, 1, "userStateChanged", (StateMock(1, 2, "p"),), timestamp=10.2)
+        journal.close()
+
+        man, mod = self.runManager()
+        start = time.monotonic()
+        replay(man, [self.path], speed=2.0)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        drain(man)
+        self.assertEqual([e[2] for e in mod.events], [1, 2])
+        man.stop()
+        man.join()
+
+    def testReplayIgnoresGapsBetweenRuns(self):
+        for timestamp in (10.0, 3600.0):
+            journal = Journal(self.path)
+            journal.record(KIND_SERVER, 1, "userStateChanged", (StateMock(1, 1, "p"),), timestamp=timestamp)
+            journal.close()
+
+        man, mod = self.runManager()
+        start = time.monotonic()
+        self.assertEqual(replay(man, [self.path], speed=1.0), 2)
+        self.assertLess(time.monotonic() - start, 1.0)
+        man.stop()
+        man.join()
+
+    def testReplayDoesNotRecord(self):
+        ini = os.path.join(self.tmp, "mumo.ini")
+        with open(ini, "w") as f:
+            f.write("[journal]\nfile = %s\n" % self.path)
+
+        cfg = loadConfig(ini)
+        self.assertEqual(cfg.journal.file, "")
+        man, mod = self.runManager(cfg)
+        man.announceServer(1, "userStateChanged", ProxyMock(), StateMock(1, 1, "p"), Current())
+        drain(man)
+        self.assertEqual(mod.events, [("userStateChanged", 1, 1)])
+        man.stop()
+        man.join()
+        self.assertFalse(os.path.exists(self.path))
+
+    def testReplayStandIns(self):
+        murmur = ReplayMurmur()
+        self.assertTrue(issubclass(murmur.InvalidChannelException, Exception))
+        self.assertEqual(murmur.PermissionEnter & murmur.PermissionSpeak, 0)
+        self.assertEqual(murmur.ACL(group="all", allow=1).group, "all")
+        self.assertIsInstance(murmur.UserInfo.UserLastActive, int)
+
+        server = ReplayServer(3)
+        self.assertEqual(server.id(), 3)
+        self.assertIsNone(server.getState(1))
+        self.assertEqual(server.calls, {"getState": 1})
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -87,9 +87,21 @@ class idlemove(MumoModule):
     def disconnected(self):
         self.affectedusers = {}
         if self.watchdog:
-            self.watchdog.stop()
+            self.watchdog.cancel()
             self.watchdog = None
 
+    def onStop(self):
+        MumoModule.onStop(self)
+        if self.watchdog:
+            self.watchdog.cancel()
+            self.watchdog = None
+
+    def exportState(self):
+        return getattr(self, "affectedusers", {})
+
+    def importState(self, state):
+        self.affectedusers = state
+
     def handleIdleMove(self):
         cfg = self.cfg()
         try:
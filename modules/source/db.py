@@ -30,6 +30,8 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import sqlite3
+from contextlib import contextmanager
+from time import monotonic
 
 
 # TODO: Functions returning channels probably should return a dict instead of a tuple
@@ -38,13 +40,66 @@ class SourceDB(object):
     NO_SERVER = ""
     NO_TEAM = -1
 
-    def __init__(self, path=":memory:"):
+    # Statements are kept as constants so sqlite3's per connection
+    # statement cache hands out the already prepared statement objects.
+    SQL_LOAD_CHANNELS = "SELECT sid, cid, game, server, team FROM controlled_channels ORDER BY sid, rowid"
+    SQL_LOAD_NAMES = "SELECT sid, game, server, team, name FROM mapped_names"
+    SQL_MAP_NAME = "INSERT OR REPLACE INTO mapped_names (sid, game, server, team, name) VALUES (?,?,?,?,?)"
+    SQL_REGISTER_CHANNEL = "INSERT INTO controlled_channels (sid, cid, game, server, team) VALUES (?,?,?,?,?)"
+    SQL_UNREGISTER_GAME = "DELETE FROM controlled_channels WHERE sid = ? AND game = ?"
+    SQL_UNREGISTER_SERVER = "DELETE FROM controlled_channels WHERE sid = ? AND game = ? AND server = ?"
+    SQL_UNREGISTER_TEAM = "DELETE FROM controlled_channels WHERE sid = ? AND game = ? AND server = ? AND team = ?"
+    SQL_DROP_CHANNEL = "DELETE FROM controlled_channels WHERE sid = ? AND cid = ?"
+
+    STATEMENT_CACHE_SIZE = 32
+
+    JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+    SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+    def __init__(self, path=":memory:", journal_mode=None, synchronous=None, commit_interval=0, commit_statements=0,
+                 schedule_flush=None):
         """
         Initialize the sqlite database in the given path. If no path
         is given the database is created in memory.
-        """
-        self.db = sqlite3.connect(path)
+
+        By default every modification is committed immediately. If commit_interval
+        (in milliseconds) or commit_statements is set modifications are grouped and
+        only committed once the interval passed or the given number of modifications
+        is pending. Pending modifications are visible to all queries immediately and
+        are committed on flush() or close().
+
+        Without further modifications nothing checks whether commit_interval passed.
+        schedule_flush is called with the delay in seconds whenever modifications
+        start to pend and is expected to call flush() from the thread using the
+        database once it passed, so pending modifications and the sqlite write
+        lock are never held for longer than commit_interval.
+
+        @param journal_mode Optional sqlite journal mode (e.g. "WAL")
+        @param synchronous Optional sqlite synchronous setting (e.g. "NORMAL")
+        @param commit_interval Maximum age of pending modifications in ms (0 to disable)
+        @param commit_statements Maximum number of pending modifications (0 to disable)
+        @param schedule_flush Optional schedule_flush(delay) arranging a call to flush()
+        """
+        self.commit_interval = commit_interval
+        self.commit_statements = commit_statements
+        self.schedule_flush = schedule_flush
+
+        self.__depth = 0  # Nesting level of active transaction() blocks
+        self.__pending = 0  # Modifications not yet committed
+        self.__pending_since = None  # Time of first pending modification
+
+        self.db = sqlite3.connect(path, cached_statements=self.STATEMENT_CACHE_SIZE)
         if self.db:
+            if journal_mode:
+                if journal_mode.upper() not in self.JOURNAL_MODES:
+                    raise ValueError("Invalid journal mode '%s'" % journal_mode)
+                self.db.execute("PRAGMA journal_mode = %s" % journal_mode.upper())
+
+            if synchronous:
+                if synchronous.upper() not in self.SYNCHRONOUS_MODES:
+                    raise ValueError("Invalid synchronous setting '%s'" % synchronous)
+                self.db.execute("PRAGMA synchronous = %s" % synchronous.upper())
+
             self.db.execute("""
                 CREATE TABLE IF NOT EXISTS controlled_channels(
                     sid INTEGER NOT NULL,
@@ -52,7 +107,7 @@ class SourceDB(object):
                     game TEXT NOT NULL,
                     server TEXT NOT NULL default "",
                     team INTEGER NOT NULL default -1,
-                    UNIQUE(sid, cid),
+                    UNIQUE(sid, cid), -- Index for lookups by cid
                     PRIMARY KEY (sid, game, server, team)
                 )""")
 
@@ -65,9 +120,10 @@ class SourceDB(object):
                     name TEXT NOT NULL,
                     PRIMARY KEY (sid, game, server, team)
                 )""")
-            self.db.execute("VACUUM")
             self.db.commit()
 
+            self.__loadCache()
+
     def close(self):
         """
         Closes the database connection
@@ -77,12 +133,135 @@ class SourceDB(object):
             self.db.close()
             self.db = None
 
+    def isGroupCommit(self):
+        """
+        True if modifications are grouped instead of being committed immediately
+        """
+        return self.commit_interval > 0 or self.commit_statements > 0
+
+    def pendingModifications(self):
+        """
+        Returns the number of modifications which have not been committed yet
+        """
+        return self.__pending
+
+    def flush(self):
+        """
+        Commits all pending modifications. Does nothing while inside a transaction
+        or after the database was closed.
+        """
+        if self.__depth or not self.db:
+            return
+
+        self.db.commit()
+        self.__pending = 0
+        self.__pending_since = None
+
+    @contextmanager
+    def transaction(self, rollback=True):
+        """
+        Unit of work. All modifications performed inside the with block
+        are committed together once the outermost block is left. If an
+        exception leaves a block all modifications done inside of it are
+        rolled back unless rollback is False. In group commit mode the whole
+        block counts as a single pending modification.
+
+        Usage:
+        >>> with db.transaction():
+        >>>     db.registerChannel(...)
+        >>>     db.mapName(...)
+        """
+        if not self.__depth and not self.db.in_transaction:
+            self.db.execute("BEGIN")
+
+        self.db.execute("SAVEPOINT sourcedb")
+        self.__depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.__depth -= 1
+            if not rollback:
+                self.db.execute("RELEASE sourcedb")
+                self.__modified()
+                raise
+
+            self.db.execute("ROLLBACK TO sourcedb")
+            self.db.execute("RELEASE sourcedb")
+            self.__loadCache()  # Drop rolled back modifications from the cache
+            if not self.__depth and not self.__pending:
+                self.db.commit()  # Nothing left to commit, end the transaction
+            raise
+
+        self.__depth -= 1
+        self.db.execute("RELEASE sourcedb")
+        self.__modified()
+
+    def __modified(self):
+        """
+        Called after every modification. Commits right away unless we are
+        inside a transaction or group commit is enabled and not yet due.
+        """
+        if self.__depth:
+            return
+
+        if not self.isGroupCommit():
+            self.db.commit()
+            return
+
+        now = monotonic()
+        self.__pending += 1
+        if self.__pending_since is None:
+            self.__pending_since = now
+            if self.commit_interval > 0 and self.schedule_flush:
+                self.schedule_flush(self.commit_interval / 1000.0)
+
+        if 0 < self.commit_statements <= self.__pending or \
+                0 < self.commit_interval <= (now - self.__pending_since) * 1000:
+            self.flush()
+
     def isOk(self):
         """
         True if the database is correctly initialized
         """
         return self.db is not None
 
+    @staticmethod
+    def __team(team):
+        """
+        Mirrors the INTEGER affinity of the team columns so cache
+        keys match what sqlite would compare against.
+        """
+        try:
+            return int(team)
+        except (TypeError, ValueError):
+            return team
+
+    def __loadCache(self):
+        """
+        (Re-)populates the in-memory lookup tables from the database. All
+        reads are served from these tables, the database is only used as
+        durable write-through storage.
+        """
+        self.__channels = {}  # {(sid, game, server, team): (sid, cid, game, server, team)}
+        self.__cids = {}  # {(sid, cid): (sid, cid, game, server, team)}
+        self.__names = {}  # {(sid, game, server, team): name}
+
+        for channel in self.db.execute(self.SQL_LOAD_CHANNELS):
+            self.__cacheChannel(channel)
+
+        for sid, game, server, team, name in self.db.execute(self.SQL_LOAD_NAMES):
+            self.__names[(sid, game, server, team)] = name
+
+    def __cacheChannel(self, channel):
+        sid, cid, game, server, team = channel
+        self.__channels[(sid, game, server, team)] = channel
+        self.__cids[(sid, cid)] = channel
+
+    def __uncacheChannel(self, channel):
+        sid, cid, game, server, team = channel
+        del self.__channels[(sid, game, server, team)]
+        del self.__cids[(sid, cid)]
+
     def nameFor(self, sid, game, server=NO_SERVER, team=NO_TEAM, default=""):
         """
         Returns the mapped name for the given parameters or default if no
@@ -91,9 +270,7 @@ class SourceDB(object):
         assert (sid is not None and game is not None)
         assert (not (team != self.NO_TEAM and server == self.NO_SERVER))
 
-        v = self.db.execute("SELECT name FROM mapped_names WHERE sid is ? and game is ? and server is ? and team is ?",
-                            [sid, game, server, team]).fetchone()
-        return v[0] if v else default
+        return self.__names.get((sid, game, server, self.__team(team)), default)
 
     def mapName(self, name, sid, game, server=NO_SERVER, team=NO_TEAM):
         """
@@ -104,9 +281,10 @@ class SourceDB(object):
         assert (sid is not None and game is not None)
         assert (not (team != self.NO_TEAM and server == self.NO_SERVER))
 
-        self.db.execute("INSERT OR REPLACE into mapped_names (sid, game, server, team, name) VALUES (?,?,?,?,?)",
-                        [sid, game, server, team, name])
-        self.db.commit()
+        team = self.__team(team)
+        self.db.execute(self.SQL_MAP_NAME, [sid, game, server, team, name])
+        self.__names[(sid, game, server, team)] = name
+        self.__modified()
 
     def cidFor(self, sid, game, server=NO_SERVER, team=NO_TEAM):
         """
@@ -120,10 +298,8 @@ class SourceDB(object):
         assert (sid is not None and game is not None)
         assert (not (team != self.NO_TEAM and server == self.NO_SERVER))
 
-        v = self.db.execute(
-            "SELECT cid FROM controlled_channels WHERE sid is ? and game is ? and server is ? and team is ?",
-            [sid, game, server, team]).fetchone()
-        return v[0] if v else None
+        channel = self.__channels.get((sid, game, server, self.__team(team)))
+        return channel[1] if channel else None
 
     def channelForCid(self, sid, cid):
         """
@@ -131,9 +307,7 @@ class SourceDB(object):
         Returns None if the cid is unknown.
         """
         assert (sid is not None and cid is not None)
-        return self.db.execute(
-            "SELECT sid, cid, game, server, team FROM controlled_channels WHERE sid is ? and cid is ?",
-            [sid, cid]).fetchone()
+        return self.__cids.get((sid, cid))
 
     def channelFor(self, sid, game, server=NO_SERVER, team=NO_TEAM):
         """
@@ -143,10 +317,7 @@ class SourceDB(object):
         assert (sid is not None and game is not None)
         assert (not (team != self.NO_TEAM and server == self.NO_SERVER))
 
-        v = self.db.execute(
-            "SELECT sid, cid, game, server, team FROM controlled_channels WHERE sid is ? and game is ? and server is ? and team is ?",
-            [sid, game, server, team]).fetchone()
-        return v
+        return self.__channels.get((sid, game, server, self.__team(team)))
 
     def channelsFor(self, sid, game, server=NO_SERVER, team=NO_TEAM):
         """
@@ -158,10 +329,11 @@ class SourceDB(object):
         assert (sid is not None and game is not None)
         assert (not (team != self.NO_TEAM and server == self.NO_SERVER))
 
-        suffix, params = self.__whereClauseForOptionals(server, team)
-        return self.db.execute(
-            "SELECT sid, cid, game, server, team FROM controlled_channels WHERE sid is ? and game is ?" + suffix,
-            [sid, game] + params).fetchall()
+        team = self.__team(team)
+        return [channel for channel in self.__channels.values()
+                if channel[0] == sid and channel[2] == game
+                and (server == self.NO_SERVER or channel[3] == server)
+                and (team == self.NO_TEAM or channel[4] == team)]
 
     def registerChannel(self, sid, cid, game, server=NO_SERVER, team=NO_TEAM):
         """
@@ -170,25 +342,26 @@ class SourceDB(object):
         assert (sid is not None and game is not None)
         assert (not (team != self.NO_TEAM and server == self.NO_SERVER))
 
-        self.db.execute("INSERT INTO controlled_channels (sid, cid, game, server, team) VALUES (?,?,?,?,?)",
-                        [sid, cid, game, server, team])
-        self.db.commit()
+        team = self.__team(team)
+        self.db.execute(self.SQL_REGISTER_CHANNEL, [sid, cid, game, server, team])
+        self.__cacheChannel((sid, cid, game, server, team))
+        self.__modified()
         return True
 
-    def __whereClauseForOptionals(self, server, team):
+    def __unregisterStatementFor(self, sid, game, server, team):
         """
-        Generates where class conditions that interpret missing server
-        or team as "don't care".
-        
-        Returns (suffix, additional parameters) tuple
+        Returns the delete statement and parameters for unregistering channels.
+        Missing server or team are interpreted as "don't care".
+
+        Returns (statement, parameters) tuple
         """
 
         if server != self.NO_SERVER and team != self.NO_TEAM:
-            return " and server is ? and team is ?", [server, team]
+            return self.SQL_UNREGISTER_TEAM, [sid, game, server, team]
         elif server != self.NO_SERVER:
-            return " and server is ?", [server]
+            return self.SQL_UNREGISTER_SERVER, [sid, game, server]
         else:
-            return "", []
+            return self.SQL_UNREGISTER_GAME, [sid, game]
 
     def unregisterChannel(self, sid, game, server=NO_SERVER, team=NO_TEAM):
         """
@@ -197,9 +370,11 @@ class SourceDB(object):
         assert (sid is not None and game is not None)
         assert (not (team != self.NO_TEAM and server == self.NO_SERVER))
 
-        suffix, params = self.__whereClauseForOptionals(server, team)
-        self.db.execute("DELETE FROM controlled_channels WHERE sid is ? and game is ?" + suffix, [sid, game] + params)
-        self.db.commit()
+        team = self.__team(team)
+        self.db.execute(*self.__unregisterStatementFor(sid, game, server, team))
+        for channel in self.channelsFor(sid, game, server, team):
+            self.__uncacheChannel(channel)
+        self.__modified()
 
     def dropChannel(self, sid, cid):
         """
@@ -207,8 +382,11 @@ class SourceDB(object):
         """
         assert (sid is not None and cid is not None)
 
-        self.db.execute("DELETE FROM controlled_channels WHERE sid is ? and cid is ?", [sid, cid])
-        self.db.commit()
+        self.db.execute(self.SQL_DROP_CHANNEL, [sid, cid])
+        channel = self.__cids.get((sid, cid))
+        if channel:
+            self.__uncacheChannel(channel)
+        self.__modified()
 
     def isRegisteredChannel(self, sid, cid):
         """
@@ -216,14 +394,13 @@ class SourceDB(object):
         """
         assert (sid is not None and cid is not None)
 
-        res = self.db.execute("SELECT cid FROM controlled_channels WHERE sid is ? and cid is ?", [sid, cid]).fetchone()
-        return res is not None
+        return (sid, cid) in self.__cids
 
     def registeredChannels(self):
         """
         Returns channels as a list of (sid, cid, game, server team) tuples grouped by sid
         """
-        return self.db.execute("SELECT sid, cid, game, server, team FROM controlled_channels ORDER by sid").fetchall()
+        return sorted(self.__channels.values(), key=lambda channel: channel[0])
 
     def reset(self):
         """
@@ -231,8 +408,33 @@ class SourceDB(object):
         """
         self.db.execute("DELETE FROM mapped_names")
         self.db.execute("DELETE FROM controlled_channels")
-        self.db.commit()
+        self.__channels.clear()
+        self.__cids.clear()
+        self.__names.clear()
+        self.flush()
+
+    def vacuum(self):
+        """
+        Commits pending modifications and rebuilds the database file to
+        reclaim unused space. This is a maintenance operation which is
+        not performed automatically.
+        """
+        self.flush()
+        self.db.execute("VACUUM")
 
 
 if __name__ == "__main__":
-    pass
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options] DATABASE")
+    parser.add_option('--vacuum', action='store_true', default=False,
+                      help='rebuild the database file to reclaim unused space')
+    (option, args) = parser.parse_args()
+
+    if len(args) != 1 or not option.vacuum:
+        parser.print_help()
+        raise SystemExit(1)
+
+    db = SourceDB(args[0])
+    db.vacuum()
+    db.close()
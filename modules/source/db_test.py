@@ -29,7 +29,10 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os
 import sqlite3
+import tempfile
+import time
 import unittest
 
 from .db import SourceDB
@@ -296,6 +299,228 @@ class SourceDBTest(unittest.TestCase):
         self.assertEqual(self.db.nameFor(sid, game, server), "Game Server")
         self.assertEqual(self.db.nameFor(sid, game, server, team), "Game Server Team")
 
+    def testTransactionCommit(self):
+        self.db.reset()
+
+        sid = 1
+        game = "tf"
+        server = "serv"
+        with self.db.transaction():
+            self.db.registerChannel(sid, 1, game)
+            self.db.registerChannel(sid, 2, game, server)
+            with self.db.transaction():
+                self.db.mapName("Game", sid, game)
+            self.assertTrue(self.db.db.in_transaction)
+
+        self.assertFalse(self.db.db.in_transaction)
+        self.assertEqual(self.db.cidFor(sid, game), 1)
+        self.assertEqual(self.db.cidFor(sid, game, server), 2)
+        self.assertEqual(self.db.nameFor(sid, game), "Game")
+
+    def testTransactionRollback(self):
+        self.db.reset()
+
+        sid = 1
+        game = "tf"
+        self.db.registerChannel(sid, 1, game)
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db.transaction():
+                self.db.registerChannel(sid, 2, game, "serv")
+                self.db.registerChannel(sid, 3, game)  # Violates constraint
+
+        self.assertFalse(self.db.db.in_transaction)
+        self.assertEqual(self.db.cidFor(sid, game), 1)
+        self.assertEqual(self.db.cidFor(sid, game, "serv"), None)
+
+    def testTransactionWithoutRollback(self):
+        self.db.reset()
+
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction(rollback=False):
+                self.db.registerChannel(1, 1, "tf")
+                raise RuntimeError()
+
+        self.assertFalse(self.db.db.in_transaction)
+        self.assertEqual(self.db.cidFor(1, "tf"), 1)
+
+    def testGroupCommitStatements(self):
+        db = SourceDB(commit_statements=3)
+        self.assertTrue(db.isGroupCommit())
+
+        sid = 1
+        game = "tf"
+        db.registerChannel(sid, 1, game)
+        db.mapName("Game", sid, game)
+        self.assertEqual(db.pendingModifications(), 2)
+        self.assertTrue(db.db.in_transaction)
+        self.assertEqual(db.cidFor(sid, game), 1)  # Pending changes are visible
+
+        db.registerChannel(sid, 2, game, "serv")
+        self.assertEqual(db.pendingModifications(), 0)
+        self.assertFalse(db.db.in_transaction)
+
+        with db.transaction():
+            db.registerChannel(sid, 3, game, "serv", 1)
+            db.registerChannel(sid, 4, game, "serv", 2)
+        self.assertEqual(db.pendingModifications(), 1)
+
+        db.flush()
+        self.assertEqual(db.pendingModifications(), 0)
+        self.assertFalse(db.db.in_transaction)
+        db.close()
+
+    def testGroupCommitInterval(self):
+        db = SourceDB(commit_interval=60 * 60 * 1000)
+
+        db.registerChannel(1, 1, "tf")
+        db.registerChannel(1, 2, "tf", "serv")
+        self.assertEqual(db.pendingModifications(), 2)
+
+        db.commit_interval = 1
+        time.sleep(0.01)
+        db.registerChannel(1, 3, "tf", "serv", 1)
+        self.assertEqual(db.pendingModifications(), 0)
+        db.close()
+
+    def testGroupCommitScheduledFlush(self):
+        delays = []
+        db = SourceDB(commit_interval=500, schedule_flush=delays.append)
+
+        db.registerChannel(1, 1, "tf")
+        db.registerChannel(1, 2, "tf", "serv")
+        self.assertEqual(delays, [0.5])
+        self.assertTrue(db.db.in_transaction)
+
+        db.flush()
+        self.assertFalse(db.db.in_transaction)
+        db.registerChannel(1, 3, "tf", "serv", 1)
+        self.assertEqual(delays, [0.5, 0.5])
+
+        db.close()
+        db.flush()  # Late flushes are ignored
+
+    def testGroupCommitRollbackKeepsPending(self):
+        db = SourceDB(commit_statements=100)
+
+        db.registerChannel(1, 1, "tf")
+        with self.assertRaises(sqlite3.IntegrityError):
+            with db.transaction():
+                db.registerChannel(1, 2, "tf")
+
+        self.assertEqual(db.cidFor(1, "tf"), 1)
+        db.flush()
+        self.assertEqual(db.cidFor(1, "tf"), 1)
+        db.close()
+
+    def testPragmas(self):
+        fd, path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        try:
+            db = SourceDB(path, journal_mode="wal", synchronous="normal", commit_statements=10)
+            self.assertEqual(db.db.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(db.db.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+
+            db.registerChannel(1, 1, "tf")
+            db.close()
+
+            db = SourceDB(path)
+            self.assertEqual(db.cidFor(1, "tf"), 1)  # Committed on close
+            db.close()
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        self.assertRaises(ValueError, SourceDB, journal_mode="nonsense")
+        self.assertRaises(ValueError, SourceDB, synchronous="nonsense")
+
+    def testCacheSurvivesReopen(self):
+        fd, path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        try:
+            db = SourceDB(path)
+            db.registerChannel(1, 10, "tf")
+            db.registerChannel(1, 11, "tf", "serv", "2")
+            db.mapName("Game", 1, "tf")
+            db.close()
+
+            db = SourceDB(path)
+            self.assertEqual(db.cidFor(1, "tf"), 10)
+            self.assertEqual(db.cidFor(1, "tf", "serv", 2), 11)
+            self.assertEqual(db.cidFor(1, "tf", "serv", "2"), 11)
+            self.assertEqual(db.channelForCid(1, 11), (1, 11, "tf", "serv", 2))
+            self.assertEqual(db.nameFor(1, "tf"), "Game")
+            db.close()
+        finally:
+            os.remove(path)
+
+    def testLookupsIssueNoQueries(self):
+        self.db.reset()
+
+        sids = range(1, 3)
+        servers = ["[A-1:%d]" % i for i in range(3)]
+        teams = range(2)
+
+        cid = 0
+        for sid in sids:
+            self.db.registerChannel(sid, cid, "tf")
+            cid += 1
+            for server in servers:
+                self.db.registerChannel(sid, cid, "tf", server)
+                self.db.mapName("Server %s" % server, sid, "tf", server)
+                cid += 1
+                for team in teams:
+                    self.db.registerChannel(sid, cid, "tf", server, team)
+                    cid += 1
+
+        lookups = [(sid, "tf", server, team) for sid in sids for server in servers for team in teams]
+        expected = [self.db.db.execute(
+            "SELECT cid FROM controlled_channels WHERE sid is ? and game is ? and server is ? and team is ?",
+            key).fetchone()[0] for key in lookups]
+
+        statements = []
+        self.db.db.set_trace_callback(statements.append)
+        try:
+            self.assertEqual([self.db.cidFor(*key) for key in lookups], expected)
+            for sid, game, server, team in lookups:
+                cid = self.db.cidFor(sid, game, server, team)
+                self.assertEqual(self.db.channelForCid(sid, cid), (sid, cid, game, server, team))
+                self.assertEqual(self.db.channelFor(sid, game, server, team), (sid, cid, game, server, team))
+                self.assertTrue(self.db.isRegisteredChannel(sid, cid))
+                self.assertEqual(self.db.nameFor(sid, game, server), "Server %s" % server)
+            self.assertEqual(len(self.db.channelsFor(1, "tf")), 1 + len(servers) * (1 + len(teams)))
+            self.assertIsNone(self.db.cidFor(3, "tf"))
+        finally:
+            self.db.db.set_trace_callback(None)
+
+        self.assertEqual(statements, [])
+
+    def assertIndexedPlan(self, statement, params, constraint):
+        plan = self.db.db.execute("EXPLAIN QUERY PLAN " + statement, params).fetchall()
+        self.assertTrue(plan)
+        for row in plan:
+            detail = row[-1]
+            self.assertTrue(detail.startswith("SEARCH") and "USING" in detail, detail)
+            self.assertIn(constraint, detail)
+
+    def testQueryPlans(self):
+        self.db.reset()
+
+        self.assertIndexedPlan(SourceDB.SQL_UNREGISTER_GAME, [1, "tf"],
+                               "(sid=? AND game=?)")
+        self.assertIndexedPlan(SourceDB.SQL_UNREGISTER_SERVER, [1, "tf", "serv"],
+                               "(sid=? AND game=? AND server=?)")
+        self.assertIndexedPlan(SourceDB.SQL_UNREGISTER_TEAM, [1, "tf", "serv", 1],
+                               "(sid=? AND game=? AND server=? AND team=?)")
+        self.assertIndexedPlan(SourceDB.SQL_DROP_CHANNEL, [1, 5],
+                               "(sid=? AND cid=?)")
+
+    def testVacuum(self):
+        self.db.registerChannel(1, 1, "tf")
+        self.db.vacuum()
+        self.assertEqual(self.db.cidFor(1, "tf"), 1)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
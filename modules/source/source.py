@@ -36,11 +36,66 @@
 #
 
 import re
+from collections import namedtuple
+from functools import lru_cache
+from threading import Timer
+from time import monotonic
 
 from config import commaSeperatedStrings, x2bool, commaSeperatedIntegers
 from mumo_module import MumoModule
 from .db import SourceDB
-from .users import (User, UserRegistry)
+from .users import (User, UserRegistry, ReadOnlyDict)
+
+
+class CompletedCall(object):
+    """
+    Result of a call which was executed synchronously. Mirrors
+    the result() interface of an Ice future.
+    """
+
+    def __init__(self, fu, *args):
+        self.__result = None
+        self.__exception = None
+        try:
+            self.__result = fu(*args)
+        except Exception as e:
+            self.__exception = e
+
+    def result(self):
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__result
+
+
+class AsyncResultCall(object):
+    """
+    Wraps the begin_/end_ style asynchronous invocation of Ice < 3.7
+    into the result() interface of an Ice future.
+    """
+
+    def __init__(self, proxy, operation, *args):
+        self.__end = getattr(proxy, "end_" + operation)
+        self.__async_result = getattr(proxy, "begin_" + operation)(*args)
+
+    def result(self):
+        return self.__end(self.__async_result)
+
+
+def invokeAsync(proxy, operation, *args):
+    """
+    Starts the given operation on an Ice proxy without waiting for its
+    completion. Returns an object whose result() method waits for the call
+    to finish and returns its result or raises its exception. Proxies without
+    support for asynchronous invocation are called synchronously.
+    """
+    method = getattr(proxy, operation + "Async", None)
+    if method is not None:
+        return method(*args)  # Ice >= 3.7 returns an Ice.Future
+
+    if hasattr(proxy, "begin_" + operation):
+        return AsyncResultCall(proxy, operation, *args)
+
+    return CompletedCall(getattr(proxy, operation), *args)
 
 
 # noinspection PyPep8Naming
@@ -56,15 +111,28 @@ class source(MumoModule):
         ('teams', commaSeperatedStrings, ["Lobby", "Spectator", "Team one", "Team two", "Team three", "Team four"]),
         ('restrict', x2bool, True),
         ('serverregex', re.compile, re.compile("^\[[\w\d\-\(\):]{1,20}\]$")),
-        ('deleteifunused', x2bool, True)
+        ('deleteifunused', x2bool, True),
+        ('provisionteams', x2bool, False)
     )
 
+    # Seconds a garbage collection sweep is delayed to batch deletions
+    GC_BATCH_WINDOW = 1.0
+
+    # Flat, immutable game settings with game specific overrides already applied
+    GameConfig = namedtuple('GameConfig', [option[0] for option in default_game_config])
+
     default_config = {'source': (
         ('database', str, "source.sqlite"),
+        ('journalmode', str, ""),
+        ('synchronous', str, ""),
+        ('commitinterval', int, 0),
+        ('commitstatements', int, 0),
         ('basechannelid', int, 0),
         ('mumbleservers', commaSeperatedIntegers, []),
         ('gameregex', re.compile, re.compile("^(tf|dod|cstrike|hl2mp)$")),
-        ('groupprefix', str, "source_")
+        ('groupprefix', str, "source_"),
+        ('parsecachesize', int, 512),
+        ('deletedelay', float, 0.0)
     ),
 
         # The generic section defines default values which can be overridden in
@@ -78,16 +146,84 @@ class source(MumoModule):
     def __init__(self, name, manager, configuration=None):
         MumoModule.__init__(self, name, manager, configuration)
         self.murmur = manager.getMurmurModule()
+        self.compileGameConfigs()
+        self.users = UserRegistry()
+        self.provisioning = []  # [(mumble_server, game, server, team, server_cid, pending addChannel call), ...]
+
+        self.gcqueue = {}  # {(sid, game, server):(mumble_server, deadline)}
+        self.gctimer = None
+        self.flushtimer = None
+
+        # Only a small set of distinct context and identity strings is seen
+        # at any time. As parsing only depends on the configuration, results
+        # (including invalid ones) are cached by raw string.
+        cachesize = self.cfg().source.parsecachesize
+        self.parseSourceContext = lru_cache(maxsize=cachesize)(self.parseSourceContext)
+        self.parseSourceIdentity = lru_cache(maxsize=cachesize)(self.parseSourceIdentity)
+
+    def compileGameConfigs(self):
+        """
+        Resolves the generic and all game specific configuration sections
+        into GameConfig objects once so events do not have to probe the
+        configuration.
+        """
+        cfg = self.cfg()
+
+        def compileSection(section):
+            values = dict((option, section[option]) for option in self.GameConfig._fields)
+            values['teams'] = tuple(values['teams'])
+            return self.GameConfig(**values)
+
+        self.genericgameconfig = compileSection(cfg.generic)
+        self.gameconfigs = {}  # {game:GameConfig}
+        for sectionname, section in vars(cfg).items():
+            if sectionname.startswith("game:"):
+                self.gameconfigs[sectionname[len("game:"):]] = compileSection(section)
+
+    def parseCacheInfo(self):
+        """
+        Returns hit/miss statistics of the context and identity parse caches
+        as a dict of functools cache info tuples.
+        """
+        return {'context': self.parseSourceContext.cache_info(),
+                'identity': self.parseSourceIdentity.cache_info()}
 
     def onStart(self):
         MumoModule.onStart(self)
         cfg = self.cfg()
-        self.db = SourceDB(cfg.source.database)
+        self.db = SourceDB(cfg.source.database,
+                           journal_mode=cfg.source.journalmode,
+                           synchronous=cfg.source.synchronous,
+                           commit_interval=cfg.source.commitinterval,
+                           commit_statements=cfg.source.commitstatements,
+                           schedule_flush=self.scheduleDatabaseFlush)
 
     def onStop(self):
         MumoModule.onStop(self)
+        if self.gctimer:
+            self.gctimer.cancel()
+            self.gctimer = None
+        if self.flushtimer:
+            self.flushtimer.cancel()
+            self.flushtimer = None
         self.db.close()
 
+    def scheduleDatabaseFlush(self, delay):
+        """
+        Commits pending database modifications after delay seconds on the
+        module thread, sqlite connections may not be shared between threads.
+        """
+        if self.flushtimer is not None:
+            return
+
+        self.flushtimer = Timer(delay, self.call_by_name, [self, "flushDatabase"])
+        self.flushtimer.daemon = True
+        self.flushtimer.start()
+
+    def flushDatabase(self):
+        self.flushtimer = None
+        self.db.flush()
+
     def connected(self):
         """
         Makes sure the the plugin is correctly configured once the connection
@@ -115,36 +251,65 @@ class source(MumoModule):
         """
         Makes sure the plugins internal datatbase
         matches the actual state of the servers.
+
+        Fetches the channel list once per server and reconciles
+        all registered channels in a single transaction.
         """
         log = self.log()
         log.debug("Validating channel database")
 
-        current_sid = -1
-        current_mumble_server = None
-
-        for sid, cid, game, server, team in self.db.registeredChannels():
-            if current_sid != sid:
-                current_mumble_server = self.meta.getServer(sid)
-                current_sid = sid
-
-            try:
-                state = current_mumble_server.getChannelState(cid)
-                self.db.mapName(state.name, sid, game, server, team)
-                # TODO: Verify ACL?
-
-            except self.murmur.InvalidChannelException:
-                # Channel no longer exists
-                log.debug("(%d) Channel %d no longer exists. Dropped.", sid, cid)
-                self.db.dropChannel(sid, cid)
-            except AttributeError:
-                # Server no longer exists
-                assert (current_mumble_server is None)
-                log.debug("(%d) Server for channel %d no longer exists. Dropped.", sid, cid)
-                self.db.dropChannel(sid, cid)
+        registered = {}  # {sid:[(sid, cid, game, server, team), ...]}
+        for channel in self.db.registeredChannels():
+            registered.setdefault(channel[0], []).append(channel)
+
+        with self.db.transaction():
+            for sid, channels in registered.items():
+                mumble_server = self.meta.getServer(sid)
+                if mumble_server is None:
+                    # Server no longer exists
+                    log.debug("(%d) Server no longer exists. Dropped %d channels.", sid, len(channels))
+                    for _, cid, _, _, _ in channels:
+                        self.db.dropChannel(sid, cid)
+                    continue
+
+                try:
+                    states = mumble_server.getChannels()
+                except self.murmur.ServerBootedException:
+                    log.debug("(%d) Server not running. Skipped validation of %d channels.", sid, len(channels))
+                    continue
+
+                for _, cid, game, server, team in channels:
+                    state = states.get(cid)
+                    if state is None:
+                        # Channel no longer exists
+                        log.debug("(%d) Channel %d no longer exists. Dropped.", sid, cid)
+                        self.db.dropChannel(sid, cid)
+                    elif self.db.nameFor(sid, game, server, team, default=None) != state.name:
+                        self.db.mapName(state.name, sid, game, server, team)
+                    # TODO: Verify ACL?
 
     def disconnected(self):
         pass
 
+    def exportState(self):
+        """
+        Hands the known users and pending channel removals to a
+        reloaded instance as plain data.
+        """
+        users = {}  # {sid:{session:(state, identity, game, server)}}
+        for sid, sessions in self.users.users.items():
+            users[sid] = dict((session, (user.state, dict(user.identity), user.game, user.server))
+                              for session, user in sessions.items())
+        return {'users': users, 'gcqueue': dict(self.gcqueue)}
+
+    def importState(self, state):
+        for sid, sessions in state['users'].items():
+            for session, (userstate, identity, game, server) in sessions.items():
+                self.users.addOrUpdate(sid, session, User(userstate, ReadOnlyDict(identity), game, server))
+
+        self.gcqueue.update(state['gcqueue'])
+        self.scheduleGarbageCollection()
+
     def removeFromGroups(self, mumble_server, session, game, server, team):
         """
         Removes the client from all relevant groups
@@ -225,9 +390,86 @@ class source(MumoModule):
         """
         chan = self.db.channelFor(sid, old.game, old.server, old.identity['team'])
         if chan:
-            _, cid, game, _, _ = chan
-            if self.getGameConfig(game, "deleteifunused"):
-                self.deleteIfUnused(mumble_server, cid)
+            _, cid, game, server, _ = chan
+            if self.gameConfigFor(game).deleteifunused:
+                self.scheduleDeleteIfUnused(mumble_server, game, server)
+
+    def scheduleDeleteIfUnused(self, mumble_server, game, server):
+        """
+        Queues the server channel of the given game server for deletion once
+        the configured grace period passed. If the channel is occupied again
+        before that it is spared. Leaving it again restarts the grace period.
+        """
+        sid = mumble_server.id()
+        delay = self.cfg().source.deletedelay
+
+        if delay <= 0:
+            server_cid = self.db.cidFor(sid, game, server)
+            if server_cid is not None:
+                self.deleteIfUnused(mumble_server, server_cid)
+            return
+
+        self.log().debug("(%d) Scheduling vacancy check of %s/%s in %.1fs", sid, game, server, delay)
+        self.gcqueue[(sid, game, server)] = (mumble_server, monotonic() + delay)
+        self.scheduleGarbageCollection()
+
+    def scheduleGarbageCollection(self):
+        """
+        Makes sure a sweep is scheduled for the earliest deadline in the queue.
+        Sweeps are started slightly after a deadline so deletions due shortly
+        after each other are handled in a single batch.
+        """
+        if self.gctimer is not None or not self.gcqueue:
+            return
+
+        deadline = min(deadline for _, deadline in self.gcqueue.values())
+        delay = max(0.0, deadline - monotonic()) + self.GC_BATCH_WINDOW
+
+        self.gctimer = Timer(delay, self.call_by_name, [self, "collectGarbage"])
+        self.gctimer.daemon = True
+        self.gctimer.start()
+
+    def collectGarbage(self, now=None):
+        """
+        Deletes all queued server channels whose grace period passed and
+        which are still unused. Returns the number of deleted channels.
+        """
+        self.gctimer = None
+        log = self.log()
+
+        if now is None:
+            now = monotonic()
+
+        due = [key for key, (_, deadline) in self.gcqueue.items() if deadline <= now]
+
+        deleted = 0
+        try:
+            with self.db.transaction(rollback=False):
+                for key in due:
+                    mumble_server, _ = self.gcqueue.pop(key)
+                    sid, game, server = key
+
+                    server_cid = self.db.cidFor(sid, game, server)
+                    if server_cid is None:
+                        continue  # Already gone
+
+                    try:
+                        if self.deleteIfUnused(mumble_server, server_cid):
+                            deleted += 1
+                    except self.murmur.InvalidChannelException:
+                        log.debug("(%d) Channel %d vanished before it could be deleted", sid, server_cid)
+                        self.db.unregisterChannel(sid, game, server)
+                    except self.murmur.ServerBootedException:
+                        log.debug("(%d) Server not running. Skipped deletion of channel %d.", sid, server_cid)
+                    except Exception as e:
+                        log.error("(%d) Deleting unused channel %d failed: %s", sid, server_cid, e)
+
+            if due:
+                log.debug("Garbage collection: %d channels checked, %d deleted, %d queued", len(due), deleted,
+                          len(self.gcqueue))
+        finally:
+            self.scheduleGarbageCollection()
+        return deleted
 
     def userTransition(self, mumble_server, old, new):
         """
@@ -262,17 +504,20 @@ class source(MumoModule):
         if moved and old:
             self.userLeftChannel(mumble_server, old, sid)
 
+        # Only now wait for channels which were created ahead of time
+        self.finishProvisioning()
+
     def getGameName(self, game):
         """
         Returns the unexpanded game specific game name template.
         """
-        return self.getGameConfig(game, "name")
+        return self.gameConfigFor(game).name
 
     def getServerName(self, game):
         """
         Returns the unexpanded game specific server name template.
         """
-        return self.getGameConfig(game, "servername")
+        return self.gameConfigFor(game).servername
 
     def getTeamName(self, game, index):
         """
@@ -280,13 +525,14 @@ class source(MumoModule):
         If the index is invalid the stringified index is returned.
         """
         try:
-            return self.getGameConfig(game, "teams")[index]
+            return self.gameConfigFor(game).teams[index]
         except IndexError:
             return str(index)
 
     def setACLsForGameChannel(self, mumble_server, game_cid, game):
         """
         Sets the appropriate ACLs for a game channel for the given cid.
+        The call is issued asynchronously if possible, see invokeAsync.
         """
         # Shorthands
         ACL = self.murmur.ACL
@@ -296,22 +542,23 @@ class source(MumoModule):
 
         groupname = '~' + self.cfg().source.groupprefix + game
 
-        mumble_server.setACL(game_cid,
-                             [ACL(applyHere=True,  # Deny everything
-                                  applySubs=True,
-                                  userid=-1,
-                                  group='all',
-                                  deny=EAT | W | S),
-                              ACL(applyHere=True,  # Allow enter and traverse to players
-                                  applySubs=False,
-                                  userid=-1,
-                                  group=groupname,
-                                  allow=EAT)],
-                             [], True)
+        return invokeAsync(mumble_server, "setACL", game_cid,
+                           [ACL(applyHere=True,  # Deny everything
+                                applySubs=True,
+                                userid=-1,
+                                group='all',
+                                deny=EAT | W | S),
+                            ACL(applyHere=True,  # Allow enter and traverse to players
+                                applySubs=False,
+                                userid=-1,
+                                group=groupname,
+                                allow=EAT)],
+                           [], True)
 
     def setACLsForServerChannel(self, mumble_server, server_cid, game, server):
         """
         Sets the appropriate ACLs for a server channel for the given cid.
+        The call is issued asynchronously if possible, see invokeAsync.
         """
         # Shorthands
         ACL = self.murmur.ACL
@@ -321,17 +568,18 @@ class source(MumoModule):
 
         groupname = '~' + self.cfg().source.groupprefix + game + "_" + server
 
-        mumble_server.setACL(server_cid,
-                             [ACL(applyHere=True,  # Allow enter and traverse to players
-                                  applySubs=False,
-                                  userid=-1,
-                                  group=groupname,
-                                  allow=EAT)],
-                             [], True)
+        return invokeAsync(mumble_server, "setACL", server_cid,
+                           [ACL(applyHere=True,  # Allow enter and traverse to players
+                                applySubs=False,
+                                userid=-1,
+                                group=groupname,
+                                allow=EAT)],
+                           [], True)
 
     def setACLsForTeamChannel(self, mumble_server, team_cid, game, server, team):
         """
         Sets the appropriate ACLs for a team channel for the given cid.
+        The call is issued asynchronously if possible, see invokeAsync.
         """
         # Shorthands
         ACL = self.murmur.ACL
@@ -341,18 +589,19 @@ class source(MumoModule):
 
         groupname = '~' + self.cfg().source.groupprefix + game + "_" + server + "_" + str(team)
 
-        mumble_server.setACL(team_cid,
-                             [ACL(applyHere=True,  # Allow enter and traverse to players
-                                  applySubs=False,
-                                  userid=-1,
-                                  group=groupname,
-                                  allow=EAT | W | S)],
-                             [], True)
+        return invokeAsync(mumble_server, "setACL", team_cid,
+                           [ACL(applyHere=True,  # Allow enter and traverse to players
+                                applySubs=False,
+                                userid=-1,
+                                group=groupname,
+                                allow=EAT | W | S)],
+                           [], True)
 
-    def getOrCreateGameChannelFor(self, mumble_server, game, server, sid, cfg, log, namevars):
+    def getOrCreateGameChannelFor(self, mumble_server, game, server, sid, cfg, log, namevars, pending):
         """
         Helper function for getting or creating only the game channel. Returns
-        the cid of the exisitng or created game channel.
+        the cid of the exisitng or created game channel. Calls which still
+        have to be waited for are appended to pending.
         """
         sid = mumble_server.id()
         game_cid = self.db.cidFor(sid, game)
@@ -362,21 +611,22 @@ class source(MumoModule):
 
             log.debug("(%d) Creating game channel '%s' below %d", sid, game_channel_name, cfg.source.basechannelid)
             game_cid = mumble_server.addChannel(game_channel_name, cfg.source.basechannelid)
-            self.db.registerChannel(sid, game_cid, game)  # Make sure we don't have orphaned server channels around
-            self.db.unregisterChannel(sid, game, server)
+            self.db.unregisterChannel(sid, game)  # Make sure we don't have orphaned server channels around
+            self.db.registerChannel(sid, game_cid, game)
 
-            if self.getGameConfig(game, "restrict"):
+            if self.gameConfigFor(game).restrict:
                 log.debug("(%d) Setting ACL's for new game channel (cid %d)", sid, game_cid)
-                self.setACLsForGameChannel(mumble_server, game_cid, game)
+                pending.append(self.setACLsForGameChannel(mumble_server, game_cid, game))
 
             log.debug("(%d) Game channel created and registered (cid %d)", sid, game_cid)
         return game_cid
 
-    def getOrCreateServerChannelFor(self, mumble_server, game, server, team, sid, log, namevars, game_cid):
+    def getOrCreateServerChannelFor(self, mumble_server, game, server, team, sid, log, namevars, game_cid, pending):
         """
         Helper function for getting or creating only the server channel. The game
         channel must already exist. Returns the cid of the existing or created
-        server channel.
+        server channel. Calls which still have to be waited for are appended
+        to pending.
         """
         server_cid = self.db.cidFor(sid, game, server)
         if server_cid is None:
@@ -385,58 +635,122 @@ class source(MumoModule):
 
             log.debug("(%d) Creating server channel '%s' below %d", sid, server_channel_name, game_cid)
             server_cid = mumble_server.addChannel(server_channel_name, game_cid)
+            self.db.unregisterChannel(sid, game, server)  # Make sure we don't have orphaned team channels around
             self.db.registerChannel(sid, server_cid, game, server)
-            self.db.unregisterChannel(sid, game, server, team)  # Make sure we don't have orphaned team channels around
 
-            if self.getGameConfig(game, "restrict"):
+            if self.gameConfigFor(game).restrict:
                 log.debug("(%d) Setting ACL's for new server channel (cid %d)", sid, server_cid)
-                self.setACLsForServerChannel(mumble_server, server_cid, game, server)
+                pending.append(self.setACLsForServerChannel(mumble_server, server_cid, game, server))
 
             log.debug("(%d) Server channel created and registered (cid %d)", sid, server_cid)
         return server_cid
 
-    def getOrCreateTeamChannelFor(self, mumble_server, game, server, team, sid, log, server_cid):
+    def getOrCreateTeamChannelFor(self, mumble_server, game, server, team, sid, log, server_cid, pending,
+                                  creation=None):
         """
         Helper function for getting or creating only the team channel. Game and
         server channel must already exist. Returns the cid of the existing or
-        created team channel.
+        created team channel. Calls which still have to be waited for are
+        appended to pending. If the addChannel call for the team channel has
+        already been issued it can be passed as creation.
         """
 
         team_cid = self.db.cidFor(sid, game, server, team)
         if team_cid is None:
-            team_channel_name = self.db.nameFor(sid, game, server, team,
-                                                default=self.getTeamName(game, team))
-
-            log.debug("(%d) Creating team channel '%s' below %d", sid, team_channel_name, server_cid)
-            team_cid = mumble_server.addChannel(team_channel_name, server_cid)
+            if creation is None:
+                creation = self.createTeamChannel(mumble_server, game, server, team, sid, log, server_cid)
+            team_cid = creation.result()
             self.db.registerChannel(sid, team_cid, game, server, team)
 
-            if self.getGameConfig(game, "restrict"):
+            if self.gameConfigFor(game).restrict:
                 log.debug("(%d) Setting ACL's for new team channel (cid %d)", sid, team_cid)
-                self.setACLsForTeamChannel(mumble_server, team_cid, game, server, team)
+                pending.append(self.setACLsForTeamChannel(mumble_server, team_cid, game, server, team))
 
             log.debug("(%d) Team channel created and registered (cid %d)", sid, team_cid)
         return team_cid
 
+    def createTeamChannel(self, mumble_server, game, server, team, sid, log, server_cid):
+        """
+        Issues the addChannel call for a team channel. Returns the pending call.
+        """
+        team_channel_name = self.db.nameFor(sid, game, server, team,
+                                            default=self.getTeamName(game, team))
+
+        log.debug("(%d) Creating team channel '%s' below %d", sid, team_channel_name, server_cid)
+        return invokeAsync(mumble_server, "addChannel", team_channel_name, server_cid)
+
     def getOrCreateChannelFor(self, mumble_server, game, server, team):
         """
         Checks whether a requested team channel already exists. If not
         all missing parts of the channel structure are created. Returns
         the cid of the existing or created team channel.
+
+        Independent calls (e.g. ACL setup of a parent and creation of its
+        child) are issued concurrently. If the game is configured to
+        provision all teams the creation of the other team channels of the
+        server is started as well but only finished on the next call to
+        finishProvisioning.
         """
         sid = mumble_server.id()
         cfg = self.cfg()
         log = self.log()
 
+        # Make sure previously started channel creations are accounted for
+        self.finishProvisioning()
+
         namevars = {'game': game,
                     'server': server}
 
-        game_cid = self.getOrCreateGameChannelFor(mumble_server, game, server, sid, cfg, log, namevars)
-        server_cid = self.getOrCreateServerChannelFor(mumble_server, game, server, team, sid, log, namevars, game_cid)
-        team_cid = self.getOrCreateTeamChannelFor(mumble_server, game, server, team, sid, log, server_cid)
+        pending = []
+        # Registrations mirror channels which already exist on the server, keep them even if a later step fails
+        with self.db.transaction(rollback=False):
+            game_cid = self.getOrCreateGameChannelFor(mumble_server, game, server, sid, cfg, log, namevars, pending)
+            server_cid = self.getOrCreateServerChannelFor(mumble_server, game, server, team, sid, log, namevars,
+                                                          game_cid, pending)
+
+            if self.gameConfigFor(game).provisionteams:
+                for other_team in range(len(self.gameConfigFor(game).teams)):
+                    if other_team != team and self.db.cidFor(sid, game, server, other_team) is None:
+                        creation = self.createTeamChannel(mumble_server, game, server, other_team, sid, log,
+                                                          server_cid)
+                        self.provisioning.append((mumble_server, game, server, other_team, server_cid, creation))
+
+            team_cid = self.getOrCreateTeamChannelFor(mumble_server, game, server, team, sid, log, server_cid,
+                                                      pending)
+
+        for call in pending:
+            call.result()
 
         return team_cid
 
+    def finishProvisioning(self):
+        """
+        Waits for team channels which were created ahead of time by
+        getOrCreateChannelFor and registers them.
+        """
+        if not self.provisioning:
+            return
+
+        log = self.log()
+        provisioning = self.provisioning
+        self.provisioning = []
+
+        pending = []
+        with self.db.transaction(rollback=False):
+            for mumble_server, game, server, team, server_cid, creation in provisioning:
+                sid = mumble_server.id()
+                try:
+                    self.getOrCreateTeamChannelFor(mumble_server, game, server, team, sid, log, server_cid, pending,
+                                                   creation)
+                except Exception as e:
+                    log.error("(%d) Provisioning of team channel %s/%s/%d failed: %s", sid, game, server, team, e)
+
+        for call in pending:
+            try:
+                call.result()
+            except Exception as e:
+                log.error("Setting ACL's for provisioned team channel failed: %s", e)
+
     def moveUserToCid(self, server, state, cid):
         """
         Low level helper for moving a user to a channel known by its ID
@@ -524,19 +838,20 @@ class source(MumoModule):
         # Unused. Delete server and children
         log.debug("(%s) Channel %d unused. Will be deleted.", sid, server_channel_cid)
         mumble_server.removeChannel(server_channel_cid)
+        self.db.unregisterChannel(sid, cur_game, cur_server)
         return True
 
     def isValidGameType(self, game):
         return self.cfg().source.gameregex.match(game) is not None
 
     def isValidServer(self, game, server):
-        return self.getGameConfig(game, "serverregex").match(server) is not None
+        return self.gameConfigFor(game).serverregex.match(server) is not None
 
     def parseSourceContext(self, context):
         """
         Parse source engine context string. Returns tuple with
         game name and server identification. Returns None for both 
-        if context string is invalid.
+        if context string is invalid. Results are cached (see __init__).
         """
         try:
             prefix, server = context.split('\x00')[0:2]
@@ -557,7 +872,8 @@ class source(MumoModule):
     def parseSourceIdentity(self, identity):
         """
         Parse comma separated source engine identity string key value pairs
-        and return them as a dict. Returns None for invalid identity strings.
+        and return them as a read-only dict. Returns None for invalid identity
+        strings. Results are cached (see __init__).
         
         Usage: parseSourceIndentity("universe:0;account_type:0;id:00000000;instance:0;team:0")    
         """
@@ -571,22 +887,22 @@ class source(MumoModule):
             if "team" not in d:
                 return None
 
-            return d
+            return ReadOnlyDict(d)
         except (AttributeError, ValueError):
             return None
 
+    def gameConfigFor(self, game):
+        """
+        Returns the GameConfig for the given game. Falls back to the generic
+        configuration for games without a specific section.
+        """
+        return self.gameconfigs.get(game, self.genericgameconfig)
+
     def getGameConfig(self, game, variable):
         """
         Return the game specific value for the given variable if it exists. Otherwise the generic value
         """
-
-        sectionname = "game:" + game
-        cfg = self.cfg()
-
-        if sectionname not in cfg:
-            return cfg.generic[variable]
-
-        return cfg[sectionname][variable]
+        return getattr(self.gameConfigFor(game), variable)
 
     def dlog(self, sid, state, what, *argc):
         """ Debug log output helper for user state related things """
@@ -607,7 +923,7 @@ class source(MumoModule):
 
         if old_user and not old_user.hasContextOrIdentityChanged(new_state):
             # No change in relevant fields. Simply update state for reference
-            old_user.updateState(new_state)
+            self.users.updateState(sid, session, new_state)
             self.dlog(sid, new_state, "State change irrelevant for plugin")
             return
 
@@ -32,9 +32,11 @@
 import queue
 import re
 import unittest
+from time import monotonic
 
 import config
 from . import source
+from .source import invokeAsync
 from .users import User
 
 
@@ -42,6 +44,10 @@ class InvalidChannelExceptionMock(Exception):
     pass
 
 
+class ServerBootedExceptionMock(Exception):
+    pass
+
+
 class StateMock():
     def __init__(self, cid=0, session=0, userid=-1):
         self.channel = cid
@@ -94,11 +100,22 @@ class ServerMock():
         return self.channels[cid]
 
     def getChannelState(self, cid):
+        self.rpcs += 1
         return self._getChan(cid)
 
+    def getChannels(self):
+        self.rpcs += 1
+        return dict(self.channels)
+
     def setState(self, state):
         self.user_state.append(state)
 
+    def removeChannel(self, cid):
+        self._getChan(cid)
+        for child in [c.id for c in self.channels.values() if c.parent == cid]:
+            self.removeChannel(child)
+        del self.channels[cid]
+
     def setACL(self, cid, acls, groups, inherit):
         c = self._getChan(cid)
         c.acls = acls
@@ -107,6 +124,7 @@ class ServerMock():
         self.uid = 1000
         self.channels = {}  # See addChannel
         self.user_state = []
+        self.rpcs = 0
 
 
 class ACLMock(object):
@@ -121,6 +139,7 @@ class ACLMock(object):
 
 class MurmurMock(object):
     InvalidChannelException = InvalidChannelExceptionMock
+    ServerBootedException = ServerBootedExceptionMock
     ACL = ACLMock
     PermissionEnter = 1
     PermissionTraverse = 2
@@ -249,6 +268,22 @@ class Test(unittest.TestCase):
         self.assertEqual(self.s.getGameConfig("wugu", "name"), "%(game)s")
         self.assertEqual(self.s.getGameConfig("tf", "name"), "Team Fortress 2")
 
+    def testCompiledGameConfig(self):
+        self.resetState()
+
+        tf = self.s.gameConfigFor("tf")
+        self.assertEqual(tf.name, "Team Fortress 2")
+        self.assertEqual(tf.teams, ("Lobby", "Spectator", "Blue", "Red"))
+        self.assertEqual(tf.serverregex.pattern, "^\\[A-1:123\\]$")
+        self.assertTrue(tf.deleteifunused)
+
+        generic = self.s.gameConfigFor("wugu")
+        self.assertIs(generic, self.s.gameConfigFor("dod"))
+        self.assertEqual(generic.name, "%(game)s")
+        self.assertEqual(generic.teams[2], "Team one")
+
+        self.assertRaises(AttributeError, setattr, tf, "name", "Other")
+
     def testIdentityParser(self):
         self.resetState()
 
@@ -302,6 +337,37 @@ class Test(unittest.TestCase):
         actual = self.s.parseSourceContext("Source engine: tf\x00[A-1:2807761920(3281)]\x00")
         self.assertEqual(none, actual)
 
+    def testParseCaches(self):
+        self.resetState()
+
+        mm = ManagerMock()
+        s = source("source", mm, config.Config(None, source.default_config))
+
+        context = "Source engine: dod\x00[A-1:2807761920(3281)]\x00"
+        invalid = "Source engine: fake\x00[A-1:2807761920(3281)]\x00"
+        for i in range(3):
+            self.assertEqual(s.parseSourceContext(context), ("dod", "[A-1:2807761920(3281)]"))
+            self.assertEqual(s.parseSourceContext(invalid), (None, None))
+
+        info = s.parseCacheInfo()['context']
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.hits, 4)
+
+        identity = "universe:1;account_type:2;id:00000003;instance:4;team:5"
+        first = s.parseSourceIdentity(identity)
+        self.assertIs(s.parseSourceIdentity(identity), first)
+        self.assertEqual(s.parseSourceIdentity("nonsense"), None)
+        self.assertEqual(s.parseSourceIdentity("nonsense"), None)
+
+        info = s.parseCacheInfo()['identity']
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.hits, 2)
+
+        # Shared results must not be modifiable
+        self.assertRaises(TypeError, first.__setitem__, "team", 1)
+        self.assertRaises(TypeError, first.update, {"team": 1})
+        self.assertEqual(first["team"], 5)
+
     def checkACLThings(self, acls, things):
         self.assertEqual(len(things), len(acls))
 
@@ -351,6 +417,84 @@ class Test(unittest.TestCase):
 
         # print self.s.db.db.execute("SELECT * FROM source").fetchall()
 
+    def testProvisionTeams(self):
+        self.resetState()
+
+        mumble_server = self.mserv
+        sid = mumble_server.id()
+        game = "tf"
+        server = "[A-1:123]"
+        team = 3
+        self.s.gameconfigs[game] = self.s.gameConfigFor(game)._replace(provisionteams=True)
+
+        cid = self.s.getOrCreateChannelFor(mumble_server, game, server, team)
+        self.assertEqual(self.s.db.cidFor(sid, game, server, team), cid)
+        self.checkACLThings(mumble_server.channels[cid].acls, [{'group': '~source_tf_[A-1:123]_3'}])
+
+        # Other teams are created but only registered once provisioning is finished
+        self.assertEqual(len(self.s.provisioning), 3)
+        self.assertEqual(self.s.db.cidFor(sid, game, server, 0), None)
+
+        self.s.finishProvisioning()
+        self.assertEqual(self.s.provisioning, [])
+
+        names = ["Lobby", "Spectator", "Blue", "Red"]
+        for other_team in range(4):
+            other_cid = self.s.db.cidFor(sid, game, server, other_team)
+            self.assertNotEqual(other_cid, None)
+            self.assertEqual(mumble_server.channels[other_cid].name, names[other_team])
+            self.checkACLThings(mumble_server.channels[other_cid].acls,
+                                [{'group': '~source_tf_[A-1:123]_%d' % other_team}])
+
+        self.assertEqual(len(mumble_server.channels), 2 + 4)
+
+        # Nothing left to provision
+        self.assertEqual(self.s.getOrCreateChannelFor(mumble_server, game, server, 0),
+                         self.s.db.cidFor(sid, game, server, 0))
+        self.assertEqual(self.s.provisioning, [])
+        self.assertEqual(len(mumble_server.channels), 2 + 4)
+
+    def testInvokeAsync(self):
+        class FutureMock(object):
+            def __init__(self, value):
+                self.value = value
+
+            def result(self):
+                return self.value
+
+        class ProxyMock(object):
+            def __init__(self):
+                self.calls = []
+
+            def addChannel(self, name, parent):
+                self.calls.append("sync")
+                return 1
+
+            def addChannelAsync(self, name, parent):
+                self.calls.append("async")
+                return FutureMock(2)
+
+            def begin_setACL(self, cid):
+                self.calls.append("begin")
+                return cid
+
+            def end_setACL(self, r):
+                self.calls.append("end")
+                return r
+
+            def removeChannel(self, cid):
+                raise InvalidChannelExceptionMock()
+
+        proxy = ProxyMock()
+        self.assertEqual(invokeAsync(proxy, "addChannel", "name", 0).result(), 2)
+        call = invokeAsync(proxy, "setACL", 5)
+        self.assertEqual(proxy.calls, ["async", "begin"])
+        self.assertEqual(call.result(), 5)
+        self.assertEqual(proxy.calls, ["async", "begin", "end"])
+
+        call = invokeAsync(proxy, "removeChannel", 5)
+        self.assertRaises(InvalidChannelExceptionMock, call.result)
+
     def testGetGameName(self):
         self.resetState()
 
@@ -454,6 +598,154 @@ class Test(unittest.TestCase):
         self.s.validateChannelDB()
         self.assertEqual(len(self.s.db.registeredChannels()), 3)
 
+    def testValidateChannelDBBatched(self):
+        self.resetState()
+
+        mumble_server = self.mserv
+        sid = mumble_server.id()
+        for server in range(50):
+            self.s.getOrCreateChannelFor(mumble_server, 'cstrike', '[A-1:%d]' % server, 1)
+
+        registered = len(self.s.db.registeredChannels())
+        self.assertEqual(registered, 1 + 50 * 2)
+
+        # Rename one, delete another one
+        renamed_cid = self.s.db.cidFor(sid, 'cstrike', '[A-1:3]')
+        mumble_server.channels[renamed_cid].name = "Renamed"
+        deleted_cid = self.s.db.cidFor(sid, 'cstrike', '[A-1:4]', 1)
+        del mumble_server.channels[deleted_cid]
+
+        mumble_server.rpcs = 0
+        self.s.validateChannelDB()
+
+        self.assertEqual(mumble_server.rpcs, 1)
+        self.assertEqual(len(self.s.db.registeredChannels()), registered - 1)
+        self.assertFalse(self.s.db.isRegisteredChannel(sid, deleted_cid))
+        self.assertEqual(self.s.db.nameFor(sid, 'cstrike', '[A-1:3]'), "Renamed")
+
+    def testDeferredDeleteIfUnused(self):
+        self.resetState()
+
+        mumble_server = self.mserv
+        sid = mumble_server.id()
+        game = "tf"
+        server = "[A-1:123]"
+        self.s.cfg().source.deletedelay = 5
+
+        def join(session):
+            user = User(StateMock(session=session), {'team': 2}, game, server)
+            self.s.userTransition(mumble_server, None, user)
+            return user
+
+        # Last player leaves, server channel is only queued for deletion
+        user = join(1)
+        server_cid = self.s.db.cidFor(sid, game, server)
+        self.s.userTransition(mumble_server, user, None)
+        self.assertIn((sid, game, server), self.s.gcqueue)
+        self.assertEqual(self.s.collectGarbage(), 0)
+        self.assertIn(server_cid, mumble_server.channels)
+
+        # Player rejoins within the grace period, channel is spared
+        user = join(2)
+        self.assertEqual(self.s.collectGarbage(monotonic() + 10), 0)
+        self.assertIn(server_cid, mumble_server.channels)
+        self.assertEqual(self.s.gcqueue, {})
+
+        # Player leaves again and the grace period passes
+        self.s.userTransition(mumble_server, user, None)
+        self.assertEqual(self.s.collectGarbage(monotonic() + 10), 1)
+        self.assertNotIn(server_cid, mumble_server.channels)
+        self.assertEqual(self.s.db.cidFor(sid, game, server), None)
+        self.assertEqual(self.s.db.cidFor(sid, game, server, 2), None)
+        self.assertNotEqual(self.s.db.cidFor(sid, game), None)
+        self.assertEqual(self.s.gcqueue, {})
+
+    def testGarbageCollectionSurvivesServerErrors(self):
+        self.resetState()
+
+        mumble_server = self.mserv
+        sid = mumble_server.id()
+        self.s.cfg().source.deletedelay = 5
+
+        servers = ["[A-1:%d]" % i for i in range(3)]
+        for session, server in enumerate(servers):
+            user = User(StateMock(session=session), {'team': 2}, "tf", server)
+            self.s.userTransition(mumble_server, None, user)
+            self.s.userTransition(mumble_server, user, None)
+        cids = [self.s.db.cidFor(sid, "tf", server) for server in servers]
+        self.s.gctimer.cancel()
+        self.s.gctimer = None
+
+        errors = {cids[0]: ServerBootedExceptionMock(), cids[1]: RuntimeError("broken")}
+        remove = mumble_server.removeChannel
+
+        def removeChannel(cid):
+            if cid in errors:
+                raise errors[cid]
+            remove(cid)
+
+        mumble_server.removeChannel = removeChannel
+        try:
+            # Not due yet, needs another sweep
+            self.s.gcqueue[(sid, "tf", "[A-1:9]")] = (mumble_server, monotonic() + 60)
+            self.assertEqual(self.s.collectGarbage(monotonic() + 10), 1)
+        finally:
+            del mumble_server.removeChannel
+            if self.s.gctimer:
+                self.s.gctimer.cancel()
+
+        self.assertNotIn(cids[2], mumble_server.channels)
+        self.assertIn(cids[0], mumble_server.channels)
+        self.assertIn(cids[1], mumble_server.channels)
+        self.assertEqual(list(self.s.gcqueue.keys()), [(sid, "tf", "[A-1:9]")])
+        self.assertIsNotNone(self.s.gctimer)
+
+    def testStateTransfer(self):
+        self.resetState()
+
+        mumble_server = self.mserv
+        sid = mumble_server.id()
+        self.s.cfg().source.deletedelay = 5
+
+        user = User(StateMock(session=1), {'team': 2}, "tf", "[A-1:123]")
+        self.s.userTransition(mumble_server, None, user)
+        gone = User(StateMock(session=2), {'team': 3}, "tf", "[A-1:124]")
+        self.s.userTransition(mumble_server, None, gone)
+        self.s.userTransition(mumble_server, gone, None)
+
+        state = self.s.exportState()
+
+        reloaded = source("source", self.mm, self.s.cfg())
+        reloaded.db = self.s.db
+        reloaded.connected()
+        reloaded.importState(state)
+        try:
+            transferred = reloaded.users.get(sid, 1)
+            self.assertEqual(transferred.state, user.state)
+            self.assertEqual(transferred.identity, {'team': 2})
+            self.assertTrue(reloaded.users.usingChannel(sid, user.state.channel))
+            self.assertEqual(reloaded.users.get(sid, 2), None)
+            self.assertEqual(list(reloaded.gcqueue.keys()), [(sid, "tf", "[A-1:124]")])
+            self.assertIsNotNone(reloaded.gctimer)
+        finally:
+            reloaded.gctimer.cancel()
+            self.s.gctimer.cancel()
+
+    def testImmediateDeleteIfUnused(self):
+        self.resetState()
+
+        mumble_server = self.mserv
+        sid = mumble_server.id()
+        self.s.cfg().source.deletedelay = 0
+
+        user = User(StateMock(session=1), {'team': 2}, "tf", "[A-1:123]")
+        self.s.userTransition(mumble_server, None, user)
+        server_cid = self.s.db.cidFor(sid, "tf", "[A-1:123]")
+        self.s.userTransition(mumble_server, user, None)
+
+        self.assertNotIn(server_cid, mumble_server.channels)
+        self.assertEqual(self.s.gcqueue, {})
+
     def testSetACLsForGameChannel(self):
         self.resetState()
 
@@ -29,6 +29,19 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+class ReadOnlyDict(dict):
+    """
+    dict which refuses modification. Used for parsed data which
+    is shared between users.
+    """
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("'%s' object is read-only" % type(self).__name__)
+
+    __setitem__ = __delitem__ = __ior__ = __readonly
+    clear = pop = popitem = setdefault = update = __readonly
+
+
 class User(object):
     """
     User to hold state as well as parsed data fields in a
@@ -72,11 +85,14 @@ class User(object):
 class UserRegistry(object):
     """
     Registry to store User objects for given servers
-    and sessions.
+    and sessions. Additionally keeps an index of which
+    sessions occupy which channel.
     """
 
     def __init__(self):
-        self.users = {}  # {session:user, ...}
+        self.users = {}  # {sid:{session:user, ...}, ...}
+        self.occupancy = {}  # {(sid, cid):set(session, ...), ...}
+        self.locations = {}  # {(sid, session):cid, ...}
 
     def get(self, sid, session):
         """
@@ -99,6 +115,8 @@ class UserRegistry(object):
             self.users[sid][session] = user
         else:
             return False
+
+        self.__locate(sid, session, user)
         return True
 
     def addOrUpdate(self, sid, session, user):
@@ -112,6 +130,21 @@ class UserRegistry(object):
         else:
             self.users[sid][session] = user
 
+        self.__locate(sid, session, user)
+        return True
+
+    def updateState(self, sid, session, state):
+        """
+        Updates the state of a registered user. Use this instead of
+        User.updateState for registered users to keep the channel
+        occupancy up to date.
+        """
+        user = self.get(sid, session)
+        if not user:
+            return False
+
+        user.updateState(state)
+        self.__locate(sid, session, user)
         return True
 
     def remove(self, sid, session):
@@ -122,14 +155,42 @@ class UserRegistry(object):
             del self.users[sid][session]
         except KeyError:
             return False
+
+        self.__vacate(sid, session)
         return True
 
     def usingChannel(self, sid, cid):
         """
         Return true if any user in the registry is occupying the given channel
         """
-        for user in self.users[sid].values():
-            if user.state and user.state.channel == cid:
-                return True
+        return (sid, cid) in self.occupancy
+
+    def __locate(self, sid, session, user):
+        """
+        Moves the session to the channel given in the user's state in the occupancy index
+        """
+        self.__vacate(sid, session)
+
+        cid = getattr(user.state, "channel", None)
+        if cid is None:
+            return
+
+        self.locations[(sid, session)] = cid
+        try:
+            self.occupancy[(sid, cid)].add(session)
+        except KeyError:
+            self.occupancy[(sid, cid)] = {session}
+
+    def __vacate(self, sid, session):
+        """
+        Removes the session from the occupancy index
+        """
+        try:
+            cid = self.locations.pop((sid, session))
+        except KeyError:
+            return
 
-        return False
+        occupants = self.occupancy[(sid, cid)]
+        occupants.discard(session)
+        if not occupants:
+            del self.occupancy[(sid, cid)]
@@ -34,6 +34,12 @@ import unittest
 from .users import User, UserRegistry
 
 
+class StateMock(object):
+    def __init__(self, cid=0, session=0):
+        self.channel = cid
+        self.session = session
+
+
 class Test(unittest.TestCase):
 
     def getSomeUsers(self, n=5):
@@ -74,6 +80,71 @@ class Test(unittest.TestCase):
         self.assertFalse(r.remove(sid[0], session[0]))
         self.assertEqual(r.get(sid[0], session[0]), None)
 
+    def testChannelOccupancy(self):
+        r = UserRegistry()
+
+        sid = 1
+        a = User(StateMock(cid=10, session=1), {'team': 2}, "tf", "Someserver")
+        b = User(StateMock(cid=10, session=2), {'team': 2}, "tf", "Someserver")
+
+        self.assertFalse(r.usingChannel(sid, 10))
+        r.add(sid, 1, a)
+        r.add(sid, 2, b)
+        self.assertTrue(r.usingChannel(sid, 10))
+        self.assertFalse(r.usingChannel(sid + 1, 10))
+
+        # Move one user by updating the registry
+        a.state.channel = 11
+        r.addOrUpdate(sid, 1, a)
+        self.assertTrue(r.usingChannel(sid, 10))
+        self.assertTrue(r.usingChannel(sid, 11))
+
+        # Move the other one by a state change
+        self.assertTrue(r.updateState(sid, 2, StateMock(cid=11, session=2)))
+        self.assertFalse(r.usingChannel(sid, 10))
+        self.assertTrue(r.usingChannel(sid, 11))
+        self.assertFalse(r.updateState(sid, 3, StateMock(cid=11, session=3)))
+
+        r.remove(sid, 1)
+        self.assertTrue(r.usingChannel(sid, 11))
+        r.remove(sid, 2)
+        self.assertFalse(r.usingChannel(sid, 11))
+        self.assertEqual(r.occupancy, {})
+        self.assertEqual(r.locations, {})
+
+    def testUsingChannelReadsNoStates(self):
+        class CountingStateMock(StateMock):
+            reads = 0
+
+            @property
+            def channel(self):
+                CountingStateMock.reads += 1
+                return self.cid
+
+            @channel.setter
+            def channel(self, cid):
+                self.cid = cid
+
+        r = UserRegistry()
+
+        sid = 1
+        players = 500
+        channels = 20
+        for session in range(players):
+            r.add(sid, session, User(CountingStateMock(cid=session % channels, session=session), {'team': 2}, "tf", "s"))
+
+        # Check for vacancy of all occupied and as many unoccupied channels
+        cids = list(range(2 * channels))
+
+        CountingStateMock.reads = 0
+        indexed = [r.usingChannel(sid, cid) for cid in cids]
+        self.assertEqual(CountingStateMock.reads, 0)
+
+        # Previous implementation scanning all users
+        scanned = [any(user.state.channel == cid for user in r.users[sid].values()) for cid in cids]
+        self.assertGreater(CountingStateMock.reads, len(cids))
+        self.assertEqual(scanned, indexed)
+
     def testUser(self):
         u = User("State", {'team': 2}, "tf", "Someserver")
         self.assertTrue(u.valid())
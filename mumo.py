@@ -41,14 +41,20 @@ from logging import (debug,
                      exception,
                      getLogger)
 from optparse import OptionParser
-from threading import Timer
 
 import Ice
 import IcePy
 
 from config import (Config,
                     commaSeperatedIntegers)
+from callbackregistry import CallbackRegistry
+from control import ControlServer
+from dispatch import installServerDispatchers, validSecret
+from exporter import MetricsExporter
+from healthmonitor import HealthMonitor
+from iceconfig import CALLBACK_ADAPTER, ICE_TUNING_DEFAULTS, iceProperties, overriddenProperties
 from mumo_manager import MumoManager
+from slicecache import SliceCache
 
 #
 # --- Default configuration values
@@ -60,35 +66,73 @@ default.update({'ice': (('host', str, '127.0.0.1'),
                         ('slice', str, ''),
                         ('secret', str, ''),
                         ('slicedirs', str, '/usr/share/slice;/usr/share/Ice/slice'),
+                        ('slicecache', str, 'slicecache/'),
                         ('watchdog', int, 30),
+                        ('retry', float, 1.0),
+                        ('attach_threads', int, 8),
                         ('callback_host', str, '127.0.0.1'),
-                        ('callback_port', int, -1)),
+                        ('callback_port', int, -1)) + ICE_TUNING_DEFAULTS,
 
                 'iceraw': None,
                 'murmur': (('servers', commaSeperatedIntegers, []),),
+                'metrics': (('host', str, '127.0.0.1'),
+                            ('port', int, 0)),
+                'control': (('socket', str, ''),),
                 'system': (('pidfile', str, 'mumo.pid'),),
                 'log': (('level', int, logging.DEBUG),
                         ('file', str, 'mumo.log'))})
 
 
-def load_slice(slice):
+def slice_include_args():
     #
-    # --- Loads a given slicefile, used by dynload_slice and fsload_slice
+    # --- Returns the slice include directory arguments to compile with.
     #    This function works around a number of differences between Ice python
     #    versions and distributions when it comes to slice include directories.
     #
     fallback_slicedirs = ["-I" + sdir for sdir in cfg.ice.slicedirs.split(';')]
 
     if not hasattr(Ice, "getSliceDir"):
-        Ice.loadSlice('-I%s %s' % (" ".join(fallback_slicedirs), slice))
+        return fallback_slicedirs
+
+    slicedir = Ice.getSliceDir()
+    if not slicedir:
+        return fallback_slicedirs
+    return ['-I' + slicedir]
+
+
+def load_slice(slice):
+    #
+    # --- Loads a given slicefile, used by dynload_slice and fsload_slice
+    #
+    if not hasattr(Ice, "getSliceDir"):
+        Ice.loadSlice('%s %s' % (" ".join(slice_include_args()), slice))
     else:
-        slicedir = Ice.getSliceDir()
-        if not slicedir:
-            slicedirs = fallback_slicedirs
-        else:
-            slicedirs = ['-I' + slicedir]
+        Ice.loadSlice('', slice_include_args() + [slice])
+
+
+def load_cached_slice(slice_text, include_dirs=()):
+    #
+    # --- Makes the bindings for the given slice importable from the slice
+    #    cache, compiling them with slice2py (IcePy.compile) if they are not
+    #    cached yet. Returns False if the cache is disabled or not usable, in
+    #    which case the slice has to be loaded without it.
+    #
+    if not cfg.ice.slicecache or not hasattr(IcePy, "compile"):
+        return False
 
-        Ice.loadSlice('', slicedirs + [slice])
+    args = slice_include_args() + ['-I' + sdir for sdir in include_dirs]
+
+    def compile(source, output_dir):
+        return IcePy.compile(["slice2py", "--output-dir", output_dir] + args + [source]) == 0
+
+    cache = SliceCache(cfg.ice.slicecache)
+    try:
+        path = cache.load(slice_text, Ice.stringVersion(), args, compile)
+    except Exception as e:
+        warning("Slice cache not usable, loading slice without it: %s", e)
+        return False
+
+    return cache.importBindings(path)
 
 
 def dynload_slice(prx):
@@ -112,6 +156,9 @@ def dynload_slice(prx):
                                  (), (), ((), IcePy._t_string, False, 0), ())
 
         slice = op.invoke(prx, ((), None))
+        if load_cached_slice(slice):
+            return
+
         (dynslicefiledesc, dynslicefilepath) = tempfile.mkstemp(suffix='.ice')
         dynslicefile = os.fdopen(dynslicefiledesc, 'w')
         dynslicefile.write(slice)
@@ -131,6 +178,9 @@ def fsload_slice(slice):
     # --- Load slice from file system
     #
     debug("Loading slice from filesystem: %s" % slice)
+    with open(slice) as f:
+        if load_cached_slice(f.read(), [os.path.dirname(os.path.abspath(slice))]):
+            return
     load_slice(slice)
 
 
@@ -143,7 +193,10 @@ def do_main_program():
     debug('Initializing Ice...')
     initdata = Ice.InitializationData()
     initdata.properties = Ice.createProperties([], initdata.properties)
-    for prop, val in cfg.iceraw:
+    properties = iceProperties(cfg.ice)
+    for prop in overriddenProperties(properties, cfg.iceraw):
+        warning('%s from [iceraw] overrides the value derived from [ice]', prop)
+    for prop, val in properties + list(cfg.iceraw):
         initdata.properties.setProperty(prop, val)
 
     initdata.properties.setProperty('Ice.ImplicitContext', 'Shared')
@@ -170,6 +223,8 @@ def do_main_program():
         def __init__(self, manager):
             Ice.Application.__init__(self)
             self.manager = manager
+            self.monitor = None
+            self.metaConnection = None
 
         def run(self, args):
             self.shutdownOnInterrupt()
@@ -178,12 +233,17 @@ def do_main_program():
                 return 1
 
             if cfg.ice.watchdog > 0:
-                self.metaUptime = -1
-                self.checkConnection()
+                self.monitor = HealthMonitor(self.probeConnection,
+                                             self.reattachCallbacks,
+                                             self.connectionLost,
+                                             retry_interval=cfg.ice.retry,
+                                             check_interval=cfg.ice.watchdog)
+                self.monitor.start()
 
             # Serve till we are stopped
             self.communicator().waitForShutdown()
-            self.watchdog.cancel()
+            if self.monitor:
+                self.monitor.stop()
 
             if self.interrupted():
                 warning('Caught interrupt, shutting down')
@@ -212,7 +272,7 @@ def do_main_program():
             else:
                 cbp = ''
 
-            adapter = ice.createObjectAdapterWithEndpoints('Callback.Client',
+            adapter = ice.createObjectAdapterWithEndpoints(CALLBACK_ADAPTER,
                                                            'tcp -h %s%s' % (cfg.ice.callback_host, cbp))
             adapter.activate()
             self.adapter = adapter
@@ -221,6 +281,12 @@ def do_main_program():
             metacbprx = adapter.addWithUUID(metaCallback(self))
             self.metacb = MumbleServer.MetaCallbackPrx.uncheckedCast(metacbprx)
 
+            self.callbacks = CallbackRegistry(adapter,
+                                              lambda server, sid: serverCallback(self.manager, server, sid),
+                                              MumbleServer.ServerCallbackPrx.uncheckedCast,
+                                              threads=cfg.ice.attach_threads,
+                                              timed=self.manager.iceCalls.timed)
+
             return self.attachCallbacks()
 
         def attachCallbacks(self):
@@ -230,17 +296,26 @@ def do_main_program():
 
             # Ice.ConnectionRefusedException
             debug('Attaching callbacks')
+            timed = self.manager.iceCalls.timed
             try:
                 info('Attaching meta callback')
-                self.meta.addCallback(self.metacb)
+                with timed('Meta.addCallback'):
+                    self.meta.addCallback(self.metacb)
 
-                for server in self.meta.getBootedServers():
-                    sid = server.id()
+                with timed('Meta.getBootedServers'):
+                    servers = self.meta.getBootedServers()
+
+                watched = []
+                for server in servers:
+                    with timed('Server.id'):
+                        sid = server.id()
                     if not cfg.murmur.servers or sid in cfg.murmur.servers:
                         info('Setting callbacks for virtual server %d', sid)
-                        servercbprx = self.adapter.addWithUUID(serverCallback(self.manager, server, sid))
-                        servercb = MumbleServer.ServerCallbackPrx.uncheckedCast(servercbprx)
-                        server.addCallback(servercb)
+                        watched.append((sid, server))
+
+                self.callbacks.attachAll(watched)
+                # Drop the servants of servers which are no longer running
+                self.callbacks.retain(set(sid for sid, server in watched))
 
             except (MumbleServer.InvalidSecretException, Ice.UnknownUserException, Ice.ConnectionRefusedException) as e:
                 if isinstance(e, Ice.ConnectionRefusedException):
@@ -261,33 +336,62 @@ def do_main_program():
             self.manager.announceConnected(self.meta)
             return True
 
-        def checkConnection(self):
+        def probeConnection(self, closed, full):
             """
-            Tries to retrieve the server uptime to determine wheter the server is
-            still responsive or has restarted in the meantime
+            Connects to the server if needed and returns its uptime for the
+            health monitor, with full also those of the watched virtual
+            servers. The closed callback is hooked up to every new connection,
+            heartbeats keep it open while idle. Every call is bounded by the
+            watchdog interval so a hung server or a half-open connection makes
+            the probe fail instead of blocking the monitor.
             """
-            # debug('Watchdog run')
-            try:
-                uptime = self.meta.getUptime()
-                if self.metaUptime > 0:
-                    # Check if the server didn't restart since we last checked, we assume
-                    # since the last time we ran this check the watchdog interval +/- 5s
-                    # have passed. This should be replaced by implementing a Keepalive in
-                    # Murmur.
-                    if not ((uptime - 5) <= (self.metaUptime + cfg.ice.watchdog) <= (uptime + 5)):
-                        # Seems like the server restarted, re-attach the callbacks
-                        self.attachCallbacks()
-
-                self.metaUptime = uptime
-            except Ice.Exception as e:
-                error('Connection to server lost, will try to reestablish callbacks in next watchdog run (%ds)',
-                      cfg.ice.watchdog)
-                debug(str(e))
-                self.attachCallbacks()
-
-            # Renew the timer
-            self.watchdog = Timer(cfg.ice.watchdog, self.checkConnection)
-            self.watchdog.start()
+            timed = self.manager.iceCalls.timed
+            timeout = cfg.ice.watchdog * 1000
+            meta = self.meta.ice_invocationTimeout(timeout)
+            with timed('Meta.getUptime'):
+                uptime = meta.getUptime()
+
+            connection = meta.ice_getConnection()
+            if connection is not self.metaConnection:
+                connection.setCloseCallback(closed)
+                connection.setACM(cfg.ice.watchdog, Ice.ACMClose.CloseOff, Ice.ACMHeartbeat.HeartbeatAlways)
+                self.metaConnection = connection
+
+            if not full:
+                return uptime, None
+
+            uptimes = {}
+            with timed('Meta.getBootedServers'):
+                servers = meta.getBootedServers()
+            for server in servers:
+                server = server.ice_invocationTimeout(timeout)
+                with timed('Server.id'):
+                    sid = server.id()
+                if cfg.murmur.servers and sid not in cfg.murmur.servers:
+                    continue
+                try:
+                    with timed('Server.getUptime'):
+                        uptimes[sid] = server.getUptime()
+                except Ice.OperationNotExistException:
+                    # Older servers only tell their own uptime
+                    uptimes[sid] = uptime
+
+            return uptime, uptimes
+
+        def reattachCallbacks(self, restarted):
+            """
+            Called by the health monitor after reconnecting with the virtual
+            servers which restarted meanwhile. The server drops callbacks it
+            failed to reach while we were gone, so all of them are attached
+            again, attaching a known callback is harmless.
+            """
+            self.manager.countReconnect()
+            return self.attachCallbacks()
+
+        def connectionLost(self):
+            self.connected = False
+            self.metaConnection = None
+            self.manager.announceDisconnected()
 
     def checkSecret(func):
         """
@@ -297,20 +401,25 @@ def do_main_program():
         if not cfg.ice.secret:
             return func
 
+        secret = cfg.ice.secret.encode('utf-8')
+
         def newfunc(*args, **kws):
             if 'current' in kws:
                 current = kws["current"]
             else:
                 current = args[-1]
 
-            if not current or 'secret' not in current.ctx or current.ctx['secret'] != cfg.ice.secret:
-                error('Server transmitted invalid secret. Possible injection attempt.')
-                raise MumbleServer.InvalidSecretException()
+            if not validSecret(current, secret):
+                rejectSecret()
 
             return func(*args, **kws)
 
         return newfunc
 
+    def rejectSecret():
+        error('Server transmitted invalid secret. Possible injection attempt.')
+        raise MumbleServer.InvalidSecretException()
+
     def fortifyIceFu(retval=None, exceptions=(Ice.Exception,)):
         """
         Decorator that catches exceptions,logs them and returns a safe retval
@@ -354,13 +463,15 @@ def do_main_program():
             This function is called when a virtual server is started
             and makes sure the callbacks get attached if needed.
             """
-            sid = server.id()
+            timed = self.app.manager.iceCalls.timed
+            with timed('Server.id'):
+                sid = server.id()
             if not cfg.murmur.servers or sid in cfg.murmur.servers:
-                info('Setting callbacks for virtual server %d', server.id())
+                info('Setting callbacks for virtual server %d', sid)
+                if self.app.monitor:
+                    self.app.monitor.serverStarted(sid)
                 try:
-                    servercbprx = self.app.adapter.addWithUUID(serverCallback(self.app.manager, server, sid))
-                    servercb = MumbleServer.ServerCallbackPrx.uncheckedCast(servercbprx)
-                    server.addCallback(servercb)
+                    self.app.callbacks.attach(server, sid)
 
                 # Apparently this server was restarted without us noticing
                 except (MumbleServer.InvalidSecretException, Ice.UnknownUserException) as e:
@@ -373,7 +484,7 @@ def do_main_program():
             else:
                 debug('Virtual server %d got started', sid)
 
-            self.app.manager.announceMeta(sid, "started", server, current)
+            self.app.manager.dispatchMeta(sid, "started", server, current)
 
         @fortifyIceFu()
         @checkSecret
@@ -390,7 +501,9 @@ def do_main_program():
                         info('Watched virtual server %d got stopped', sid)
                     else:
                         debug('Virtual server %d got stopped', sid)
-                    self.app.manager.announceMeta(sid, "stopped", server, current)
+                    self.app.manager.dispatchMeta(sid, "stopped", server, current)
+                    # Only full reattaches prune the registry, drop the servant right away
+                    self.app.callbacks.detach(sid)
                     return
                 except Ice.ConnectionRefusedException:
                     self.app.connected = False
@@ -398,16 +511,11 @@ def do_main_program():
 
             debug('Server shutdown stopped a virtual server')
 
-    def forwardServer(fu):
-        def new_fu(self, *args, **kwargs):
-            self.manager.announceServer(self.sid, fu.__name__, self.server, *args, **kwargs)
-
-        return new_fu
-
     class serverCallback(MumbleServer.ServerCallback):
         def __init__(self, manager, server, sid):
             MumbleServer.ServerCallback.__init__(self)
             self.manager = manager
+            self.managerQueue = manager.message_queue()
             self.sid = sid
             self.server = server
 
@@ -418,33 +526,8 @@ def do_main_program():
 
             server.id = id_replacement
 
-        @checkSecret
-        @forwardServer
-        def userStateChanged(self, u, current=None): pass
-
-        @checkSecret
-        @forwardServer
-        def userDisconnected(self, u, current=None): pass
-
-        @checkSecret
-        @forwardServer
-        def userConnected(self, u, current=None): pass
-
-        @checkSecret
-        @forwardServer
-        def channelCreated(self, c, current=None): pass
-
-        @checkSecret
-        @forwardServer
-        def channelRemoved(self, c, current=None): pass
-
-        @checkSecret
-        @forwardServer
-        def channelStateChanged(self, c, current=None): pass
-
-        @checkSecret
-        @forwardServer
-        def userTextMessage(self, u, m, current=None): pass
+    # Callbacks are generated to check the secret and enqueue in a single frame
+    installServerDispatchers(serverCallback, cfg.ice.secret, rejectSecret, cfg.modules.direct_dispatch)
 
     class customContextCallback(MumbleServer.ServerContextCallback):
         def __init__(self, contextActionCallback, *ctx):
@@ -462,15 +545,40 @@ def do_main_program():
     #
     info('Starting mumble moderator')
     debug('Initializing manager')
-    manager = MumoManager(MumbleServer, customContextCallback)
+    manager = MumoManager(MumbleServer, customContextCallback, cfg)
     manager.start()
+    if option.profile:
+        manager.startProfiling()
     manager.loadModules()
     manager.startModules()
 
+    exporter = None
+    if cfg.metrics.port > 0:
+        exporter = MetricsExporter(manager, cfg.metrics.host, cfg.metrics.port)
+        try:
+            exporter.start()
+        except OSError as e:
+            error('Could not start metrics exporter on %s:%d: %s', cfg.metrics.host, cfg.metrics.port, e)
+            exporter = None
+
     debug("Initializing mumoIceApp")
     app = mumoIceApp(manager)
+
+    control = None
+    if cfg.control.socket:
+        control = ControlServer(manager, cfg.control.socket, resync=app.attachCallbacks)
+        try:
+            control.start()
+        except OSError as e:
+            error('Could not create control socket %s: %s', cfg.control.socket, e)
+            control = None
+
     state = app.main(sys.argv[:1], initData=initdata)
 
+    if control:
+        control.stop()
+    if exporter:
+        exporter.stop()
     manager.stopModules()
     manager.stop()
     info('Shutdown complete')
@@ -516,6 +624,9 @@ if __name__ == '__main__':
                       help='run as daemon', default=False)
     parser.add_option('-a', '--app', action='store_true', dest='force_app',
                       help='do not run as daemon', default=False)
+    parser.add_option('-p', '--profile', action='store_true', dest='profile',
+                      help='sample all threads and write collapsed stacks to the file configured in [profile]',
+                      default=False)
     (option, args) = parser.parse_args()
 
     if option.force_daemon and option.force_app:
@@ -530,6 +641,12 @@ if __name__ == '__main__':
         print(e, file=sys.stderr)
         sys.exit(1)
 
+    try:
+        iceProperties(cfg.ice)
+    except ValueError as e:
+        print('Fatal error, invalid [ice] configuration: %s' % e, file=sys.stderr)
+        sys.exit(1)
+
     # Initialise logger
     if cfg.log.file:
         try:
@@ -33,8 +33,13 @@ import os
 import queue
 import sys
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Lock, Thread
 
-from config import Config
+from config import Config, commaSeperatedStrings, x2bool
+from instrumentation import CallStatistics, InstrumentedQueue, SlowHandlerDetector
+from journal import Journal, KIND_META, KIND_SERVER
+from profiler import SamplingProfiler
 from worker import Worker, local_thread, local_thread_blocking
 
 
@@ -76,6 +81,34 @@ def debug_log(enable=True):
 debug_me = True
 
 
+class ContextMenu(object):
+    """
+    Context menu entries of a module on a single server. A single servant
+    serves all of them as default servant for a category of its own. Each
+    action gets its own identity in that category so servers can remove
+    entries one by one, incoming calls are routed by their action string.
+    """
+
+    def __init__(self, server, category, handle):
+        """
+        @param server Server the entries are shown on
+        @param category Identity category of the servant
+        @param handle handle(handler, server, action, user, target_session, target_channelid)
+                      called for entries being used
+        """
+        self.server = server
+        self.category = category
+        self.handle = handle
+        self.actions = {}  # {action:(handler, proxy)}
+
+    def contextAction(self, action, user, target_session, target_channelid, current=None):
+        entry = self.actions.get(action)
+        if entry is None:
+            # Entry got removed while the call was on its way
+            return
+        self.handle(entry[0], self.server, action, user, target_session, target_channelid)
+
+
 class MumoManagerRemote(object):
     """
     Manager object handed to MumoModules. This module
@@ -91,7 +124,7 @@ class MumoManagerRemote(object):
         self.__name = name
         self.__queue = queue
 
-        self.__context_callbacks = {}  # server -> action -> callback
+        self.__context_menus = {}  # server -> ContextMenu
 
     def getQueue(self):
         return self.__queue
@@ -183,20 +216,20 @@ class MumoManagerRemote(object):
         ContextUser)
         """
 
-        server_actions = self.__context_callbacks.get(server.id())
-        if not server_actions:
-            server_actions = {}
-            self.__context_callbacks[server.id()] = server_actions
+        menu = self.__context_menus.get(server.id())
+        if menu is None:
+            # All actions on a server share a single servant
+            menu = self.__master.createContextMenu(server, self.__handle_context_callback)
+            self.__context_menus[server.id()] = menu
 
-        action_cb = server_actions.get(action)
-        if not action_cb:
-            # We need to create an register a new context callback
-            action_cb = self.__master.createContextCallback(self.__handle_context_callback, handler, server)
-            server_actions[action] = action_cb
+        entry = menu.actions.get(action)
+        if entry is None:
+            entry = (handler, self.__master.createContextProxy(menu))
+            menu.actions[action] = entry
 
-        server.addContextCallback(user.session, action, text, action_cb, context)
+        server.addContextCallback(user.session, action, text, entry[1], context)
 
-    def __handle_context_callback(self, handler, server, action, user, target_session, target_channelid, current=None):
+    def __handle_context_callback(self, handler, server, action, user, target_session, target_channelid):
         """
         Small callback wrapper for context menu operations.
  
@@ -225,14 +258,30 @@ class MumoManagerRemote(object):
         @param action Action to remove
         """
 
+        menu = self.__context_menus.get(server.id())
         try:
-            cb = self.__context_callbacks[server.id()].pop(action)
-        except KeyError:
+            handler, cb = menu.actions.pop(action)
+        except (AttributeError, KeyError):
             # Nothing to unregister
             return
 
+        if not menu.actions:
+            del self.__context_menus[server.id()]
+            self.__master.removeContextMenu(menu)
+
         server.removeContextCallback(cb)
 
+    def dropContextMenus(self):
+        """
+        Removes the servants of all context menu entries from the adapter
+        without asking the servers to remove the entries. Used once the
+        module is gone, the servers drop entries whose callback fails.
+        """
+        menus = list(self.__context_menus.values())
+        self.__context_menus.clear()
+        for menu in menus:
+            self.__master.removeContextMenu(menu)
+
     def getMurmurModule(self):
         """
         Returns the Murmur module generated from the slice file
@@ -251,13 +300,36 @@ class MumoManager(Worker):
 
     cfg_default = {'modules': (('mod_dir', str, "modules/"),
                                ('cfg_dir', str, "modules-enabled/"),
-                               ('timeout', int, 2))}
+                               ('timeout', int, 2),
+                               ('instrumentation', x2bool, True),
+                               ('slow_handler_threshold', float, 10.0),
+                               ('slow_handler_repeat', float, 60.0),
+                               ('load_threads', int, 4),
+                               ('load_budget', float, 10.0),
+                               ('direct_dispatch', x2bool, False)),
+                   'journal': (('file', str, ''),
+                               ('max_bytes', int, 64 * 1024 * 1024),
+                               ('backups', int, 5),
+                               ('flush_interval', float, 1.0)),
+                   'profile': (('file', str, 'mumo.profile'),
+                               ('interval', float, 0.01),
+                               ('write_interval', float, 60.0),
+                               ('max_overhead', float, 0.01))}
+
+    # Options mumo itself reads from the [mumo] section of a module configuration
+    module_cfg_default = {'mumo': (('lazy', x2bool, False),
+                                   ('lazy_events', commaSeperatedStrings, []))}
 
     def __init__(self, murmur, context_callback_type, cfg=Config(default=cfg_default)):
         Worker.__init__(self, "MumoManager")
         self.queues = {}  # {queue:module}
         self.modules = {}  # {name:module}
         self.imports = {}  # {name:import}
+        self.lazy = {}  # {name:set(function)} of modules waiting for their first event
+        self.activating = {}  # {name:(queue, [buffered announcement])}
+        self.modulesStarted = False
+        self.connected = False
+        self.reloadLock = Lock()
         self.cfg = cfg
 
         self.murmur = murmur
@@ -267,8 +339,50 @@ class MumoManager(Worker):
         self.metaCallbacks = {}  # {sid:{queue:[handler]}}
         self.serverCallbacks = {}
 
+        # Direct dispatch state shared with Ice threads
+        self.directDispatch = self.cfg.modules.direct_dispatch if 'modules' in self.cfg else False
+        self.serverSnapshot = {}  # {sid:((queue, (handler, ...)), ...)} published copy of serverCallbacks
+        self.lazyFunctions = frozenset()  # Functions activating a lazy module
+        self.routeLocks = {}  # {sid:Lock}
+        self.pending = {}  # {sid:announcements routed through our queue and not handled yet}
+
         self.context_callback_type = context_callback_type
 
+        self.journal = None
+
+        self.events = {}  # {(function, sid):count}
+        self.iceCalls = CallStatistics()
+        self.reconnects = 0
+        self.detector = None
+        self.profiler = None
+
+        self.instrumentation = self.cfg.modules.instrumentation if 'modules' in self.cfg else True
+        self.setInstrumentation(self.instrumentation)
+
+    def onStart(self):
+        if 'journal' in self.cfg and self.cfg.journal.file:
+            self.startJournal(self.cfg.journal.file)
+
+        if 'modules' in self.cfg and self.cfg.modules.slow_handler_threshold > 0:
+            self.detector = SlowHandlerDetector(self.getWorkers,
+                                                self.cfg.modules.slow_handler_threshold,
+                                                self.cfg.modules.slow_handler_repeat)
+            self.detector.start()
+
+    def onStop(self):
+        self.stopJournal()
+        self.stopProfiling()
+        if self.detector:
+            self.detector.stop()
+            self.detector = None
+
+    def getWorkers(self):
+        """
+        Returns (name, worker) tuples for the manager and all loaded
+        modules. May be called from any thread.
+        """
+        return [("MumoManager", self)] + list(self.modules.items())
+
     def setClientAdapter(self, client_adapter):
         """
         Sets the ice adapter used for client-side callbacks. This is needed
@@ -297,6 +411,38 @@ class MumoManager(Worker):
             except KeyError as ValueError:
                 pass
 
+    def __unsubscribe_queue(self, queue):
+        """
+        Drops all meta and server callback handlers of a module queue
+
+        @return List of (mdict, server, handlers) tuples of the dropped subscriptions
+        """
+        removed = []
+        for mdict in (self.metaCallbacks, self.serverCallbacks):
+            for server, handlers in mdict.items():
+                dropped = handlers.pop(queue, None)
+                if dropped is not None:
+                    removed.append((mdict, server, dropped))
+        self.__publish_subscriptions()
+        return removed
+
+    def __publish_subscriptions(self):
+        """
+        Publishes an immutable copy of the server subscriptions for direct
+        dispatch. Must be called after every change to serverCallbacks.
+        """
+        everyone = tuple((queue, tuple(handlers))
+                         for queue, handlers in self.serverCallbacks.get(self.MAGIC_ALL, {}).items() if handlers)
+        snapshot = {self.MAGIC_ALL: everyone}
+        for server, queues in self.serverCallbacks.items():
+            if server != self.MAGIC_ALL:
+                snapshot[server] = everyone + tuple((queue, tuple(handlers))
+                                                    for queue, handlers in queues.items() if handlers)
+        self.serverSnapshot = snapshot
+
+    def __publish_lazy(self):
+        self.lazyFunctions = frozenset(function for functions in self.lazy.values() for function in functions)
+
     def __announce_to_dict(self, mdict, server, function, *args, **kwargs):
         """
         Call function on handlers for specific servers in one of our handler
@@ -308,6 +454,15 @@ class MumoManager(Worker):
         @param args Arguments for the function
         @param kwargs Keyword arguments for the function
         """
+        self.__announce_to_queue(mdict, None, server, function, *args, **kwargs)
+
+    def __announce_to_queue(self, mdict, only, server, function, *args, **kwargs):
+        """
+        Like __announce_to_dict but if only is given restricts the
+        announcement to the handlers registered with that module queue.
+        Without only the queues of activating modules are skipped, they
+        get the announcement from their buffer in _moduleActivated.
+        """
 
         # Announce to all handlers of the given serverlist
         if server == self.MAGIC_ALL:
@@ -315,15 +470,44 @@ class MumoManager(Worker):
         else:
             servers = [self.MAGIC_ALL, server]
 
+        if only is None and self.activating:
+            held = set(modqueue for modqueue, buffered in self.activating.values())
+        else:
+            held = ()
+
         for server in servers:
             try:
                 for queue, handlers in mdict[server].items():
+                    if only is not None and queue is not only or queue in held:
+                        continue
                     for handler in handlers:
                         self.__call_remote(queue, handler, function, *args, **kwargs)
             except KeyError:
                 # No handler registered for that server
                 pass
 
+    def __count(self, function, server):
+        """
+        Counts an announcement. Direct dispatch counts from several Ice
+        threads at once, the caller must hold the route lock of the server.
+        """
+        key = (function, server)
+        self.events[key] = self.events.get(key, 0) + 1
+
+    def __record(self, kind, server, function, args, kwargs):
+        """
+        Appends an announced event to the journal. The leading server
+        proxy argument is not recorded, replays substitute their own.
+        """
+        journal = self.journal
+        if journal is None:
+            return
+        try:
+            journal.record(kind, server, function, args[1:], kwargs)
+        except (OSError, ValueError) as e:
+            self.log().error("Failed to write event journal, journaling disabled: %s", e)
+            self.journal = None
+
     def __call_remote(self, queue, handler, function, *args, **kwargs):
         try:
             func = getattr(handler, function)  # Find out what to call on target
@@ -350,6 +534,7 @@ class MumoManager(Worker):
         Call connected handler on all handlers
         """
         self.meta = meta
+        self.connected = True
         for queue, module in self.queues.items():
             self.__call_remote(queue, module, "connected")
 
@@ -358,6 +543,7 @@ class MumoManager(Worker):
         """
         Call disconnected handler on all handlers
         """
+        self.connected = False
         for queue, module in self.queues.items():
             self.__call_remote(queue, module, "disconnected")
 
@@ -371,6 +557,13 @@ class MumoManager(Worker):
         @param args List of arguments
         @param kwargs List of keyword arguments
         """
+        if self.instrumentation:
+            with self.__route_lock(server):
+                self.__count(function, server)
+        if self.journal:
+            self.__record(KIND_META, server, function, args, kwargs)
+        if self.lazy or self.activating:
+            self.__lazy_announce(self.metaCallbacks, server, function, args, kwargs)
         self.__announce_to_dict(self.metaCallbacks, server, function, *args, **kwargs)
 
     @local_thread
@@ -383,8 +576,254 @@ class MumoManager(Worker):
         @param args List of arguments
         @param kwargs List of keyword arguments
         """
+        if self.instrumentation:
+            with self.__route_lock(server):
+                self.__count(function, server)
+        if self.journal:
+            self.__record(KIND_SERVER, server, function, args, kwargs)
+        if self.lazy or self.activating:
+            self.__lazy_announce(self.serverCallbacks, server, function, args, kwargs)
         self.__announce_to_dict(self.serverCallbacks, server, function, *args, **kwargs)
 
+    def __lazy_announce(self, mdict, server, function, args, kwargs):
+        """
+        Activates lazy modules waiting for the announced function and
+        buffers the announcement for all modules still activating.
+
+        An activated module only subscribes in its connected handler
+        which runs on the module thread. Until that handler finished we
+        hold on to every announcement, even for the subscriptions which
+        already reached us, and replay them to the module in
+        _moduleActivated.
+        """
+        log = self.log()
+        for name, functions in list(self.lazy.items()):
+            if function not in functions:
+                continue
+
+            del self.lazy[name]
+            self.__publish_lazy()
+            log.info("Activating lazy module '%s' on '%s'", name, function)
+            try:
+                self._addModuleDirectory()
+                modinst = self._constructModule(name)
+            except FailedLoadModuleException:
+                continue
+
+            modqueue = self._registerModule(name, modinst)
+            modinst.start()
+            self.activating[name] = (modqueue, [])
+            self.__call_remote(modqueue, modinst, "connected")
+            # Queued behind connected, so it reaches us after the subscriptions
+            modqueue.put((None, self.call_by_name, [self, "_moduleActivated", name], {}))
+
+        for modqueue, buffered in self.activating.values():
+            buffered.append((mdict, server, function, args, kwargs))
+
+    def _moduleActivated(self, name):
+        """
+        Replays the announcements buffered while a lazy or reloaded module
+        was activating to the handlers it subscribed meanwhile.
+        """
+        modqueue, buffered = self.activating.pop(name)
+        for mdict, server, function, args, kwargs in buffered:
+            self.__announce_to_queue(mdict, modqueue, server, function, *args, **kwargs)
+
+    #
+    # --- Dispatch from Ice threads
+    #
+
+    def __route_lock(self, server):
+        lock = self.routeLocks.get(server)
+        if lock is None:
+            lock = self.routeLocks.setdefault(server, Lock())
+        return lock
+
+    def dispatchServer(self, server, function, *args):
+        """
+        Announces a server callback. May be called from any thread.
+
+        With direct dispatch enabled the announcement is put straight into
+        the queues of the subscribed modules from the calling thread. It
+        takes the regular path through the manager thread instead while
+        lazy modules wait for the function, modules are activating or an
+        earlier announcement for the server still is on the regular path.
+        Either way announcements for a server keep their order.
+
+        @param server Server to announce to
+        @param function Name of the function to call on the handler
+        @param args List of arguments
+        """
+        with self.__route_lock(server):
+            if self.directDispatch and server != self.MAGIC_ALL and not self.pending.get(server) \
+                    and not self.activating and function not in self.lazyFunctions:
+                self.__announce_direct(server, function, args)
+            else:
+                self.pending[server] = self.pending.get(server, 0) + 1
+                self.message_queue().put((None, self._announceRouted, (KIND_SERVER, server, function, args), {}))
+
+    def dispatchMeta(self, server, function, *args):
+        """
+        Announces a meta callback through the manager thread. May be called
+        from any thread, server callbacks dispatched for the same server
+        afterwards are held back until this one was handled.
+        """
+        with self.__route_lock(server):
+            self.pending[server] = self.pending.get(server, 0) + 1
+            self.message_queue().put((None, self._announceRouted, (KIND_META, server, function, args), {}))
+
+    def _announceRouted(self, kind, server, function, args):
+        try:
+            if kind == KIND_SERVER:
+                MumoManager.announceServer.__wrapped__(self, server, function, *args)
+            else:
+                MumoManager.announceMeta.__wrapped__(self, server, function, *args)
+        finally:
+            with self.__route_lock(server):
+                self.pending[server] -= 1
+
+    def __announce_direct(self, server, function, args):
+        # Called with the route lock of the server held
+        if self.instrumentation:
+            self.__count(function, server)
+        if self.journal:
+            self.__record(KIND_SERVER, server, function, args, {})
+
+        snapshot = self.serverSnapshot
+        targets = snapshot.get(server)
+        if targets is None:
+            targets = snapshot.get(self.MAGIC_ALL, ())
+
+        for queue, handlers in targets:
+            for handler in handlers:
+                self.__call_remote(queue, handler, function, *args)
+
+    #
+    # --- Event journal
+    #
+
+    def startJournal(self, path):
+        """
+        Starts recording all announced server and meta events to the
+        given journal file. Must be called from the manager thread, use
+        call_by_name from outside.
+
+        @param path Journal file to append to
+        @return True if the journal was opened
+        """
+        self.stopJournal()
+
+        cfg = self.cfg.journal if 'journal' in self.cfg else Config(default=self.cfg_default).journal
+        try:
+            self.journal = Journal(path, cfg.max_bytes, cfg.backups, cfg.flush_interval)
+        except OSError as e:
+            self.log().error("Could not open event journal '%s': %s", path, e)
+            return False
+
+        self.log().info("Recording events to journal '%s'", path)
+        return True
+
+    def stopJournal(self):
+        """
+        Stops recording events and closes the journal. Must be called
+        from the manager thread, use call_by_name from outside.
+        """
+        if self.journal:
+            try:
+                self.journal.close()
+            except OSError as e:
+                self.log().error("Failed to close event journal: %s", e)
+            self.journal = None
+
+    #
+    # --- Instrumentation
+    #
+
+    def setInstrumentation(self, enabled):
+        """
+        Enables or disables recording of handler statistics for the
+        manager and all modules, including modules loaded later on.
+
+        @param enabled True to record statistics
+        """
+        self.instrumentation = enabled
+        Worker.setInstrumentation(self, enabled)
+        for modinst in list(self.modules.values()):
+            modinst.setInstrumentation(enabled)
+
+    def startProfiling(self, path=None):
+        """
+        Starts sampling the stacks of all threads, see profiler.SamplingProfiler.
+        Settings are taken from the profile configuration section.
+        May be called from any thread.
+
+        @param path File to write collapsed stacks to instead of the configured one
+        @return The running profiler
+        """
+        self.stopProfiling()
+
+        cfg = self.cfg.profile if 'profile' in self.cfg else Config(default=self.cfg_default).profile
+        self.profiler = SamplingProfiler(path or cfg.file, self.getWorkers,
+                                         cfg.interval, cfg.write_interval, cfg.max_overhead)
+        self.profiler.start()
+        self.log().info("Profiling into '%s'", self.profiler.path)
+        return self.profiler
+
+    def stopProfiling(self):
+        """
+        Stops a running profiler after it wrote its output a last time.
+        May be called from any thread.
+        """
+        profiler = self.profiler
+        if profiler:
+            self.profiler = None
+            profiler.stop()
+            profiler.join()
+            self.log().info("Profiling stopped after %d samples (%.2f%% overhead)",
+                            profiler.samples, profiler.overhead() * 100)
+
+    def countReconnect(self):
+        """
+        Counts an attempt of the connection watchdog to re-attach the callbacks.
+        """
+        self.reconnects += 1
+
+    def resetStatistics(self):
+        """
+        Drops all statistics recorded so far by the manager and all modules.
+        """
+        self.events = {}
+        self.iceCalls = CallStatistics()
+        self.reconnects = 0
+        Worker.resetStatistics(self)
+        for modinst in list(self.modules.values()):
+            modinst.resetStatistics()
+
+    def getStatistics(self):
+        """
+        Returns the statistics of the manager and of all loaded modules.
+        May be called from any thread.
+
+        For each worker the current and peak queue depth and per handler
+        the call count, exception count, cumulative execution and queue
+        wait time, the slowest execution and a histogram of execution times
+        (see instrumentation.HISTOGRAM_BUCKETS) are included. Times are in
+        seconds.
+
+        Additionally the number of announced events per callback and
+        server, the statistics of the Ice calls made by mumo itself and the
+        number of watchdog reconnects are included.
+
+        @return Dictionary {'manager': statistics, 'modules': {name: statistics},
+                            'events': {(function, sid): count}, 'ice': {operation: statistics},
+                            'reconnects': count}
+        """
+        return {'manager': self.statistics(),
+                'modules': dict((name, modinst.statistics()) for name, modinst in list(self.modules.items())),
+                'events': dict(list(self.events.items())),
+                'ice': self.iceCalls.snapshot(),
+                'reconnects': self.reconnects}
+
     #
     # --- Module self management functionality
     #
@@ -411,7 +850,8 @@ class MumoManager(Worker):
         @param queue Target worker queue
         @see MumoManagerRemote
         """
-        return self.__add_to_dict(self.serverCallbacks, queue, handler, servers)
+        self.__add_to_dict(self.serverCallbacks, queue, handler, servers)
+        self.__publish_subscriptions()
 
     @local_thread
     def unsubscribeServerCallbacks(self, queue, handler, servers):
@@ -419,7 +859,8 @@ class MumoManager(Worker):
         @param queue Target worker queue
         @see MumoManagerRemote
         """
-        return self.__rem_from_dict(self.serverCallbacks, queue, handler, servers)
+        self.__rem_from_dict(self.serverCallbacks, queue, handler, servers)
+        self.__publish_subscriptions()
 
     def getMurmurModule(self):
         """
@@ -427,20 +868,35 @@ class MumoManager(Worker):
         """
         return self.murmur
 
-    def createContextCallback(self, callback, *ctx):
+    def createContextMenu(self, server, handle):
         """
-        Creates a new context callback handler class instance.
+        Registers the servant for the context menu entries of a module
+        on a server.
 
-        @param callback Callback to set for handler
-        @param *ctx Additional context parameters passed to callback
-                    before the actual parameters.
-        @return Murmur ServerContextCallbackPrx object for the context
-                callback handler class.
+        @param server Server the entries are shown on
+        @param handle Called with the handler of an entry being used, see ContextMenu
+        @return ContextMenu to add actions to
         """
-        contextcbprx = self.client_adapter.addWithUUID(self.context_callback_type(callback, *ctx))
-        contextcb = self.murmur.ServerContextCallbackPrx.uncheckedCast(contextcbprx)
+        menu = ContextMenu(server, uuid.uuid4().hex, handle)
+        self.client_adapter.addDefaultServant(self.context_callback_type(menu.contextAction), menu.category)
+        return menu
 
-        return contextcb
+    def createContextProxy(self, menu):
+        """
+        Returns a new Murmur ServerContextCallbackPrx for an action of a
+        context menu. No servant is added to the adapter for it.
+        """
+        identity = self.client_adapter.getCommunicator().stringToIdentity(menu.category + "/" + uuid.uuid4().hex)
+        return self.murmur.ServerContextCallbackPrx.uncheckedCast(self.client_adapter.createProxy(identity))
+
+    def removeContextMenu(self, menu):
+        """
+        Removes the servant of a context menu from the adapter
+        """
+        try:
+            self.client_adapter.removeDefaultServant(menu.category)
+        except Exception as e:
+            self.log().warning("Could not remove context menu servant: %s", e)
 
     def getMeta(self):
         """
@@ -456,9 +912,17 @@ class MumoManager(Worker):
         """
         Loads a list of modules from the mumo directory structure by name.
 
+        Modules are imported and initialized in parallel. Modules that
+        have not finished within the configured load budget are registered
+        and started once they are done instead of delaying startup.
+        Modules declaring themselves lazy in the [mumo] section of their
+        configuration are only loaded once one of their lazy_events is
+        announced.
+
         @param names List of names of modules to load
         @return: List of modules loaded
         """
+        log = self.log()
         loadedmodules = {}
 
         if not names:
@@ -475,28 +939,169 @@ class MumoManager(Worker):
                     if not ext or ext.lower() == ".ini" or ext.lower() == ".conf":
                         names.append(base)
 
+        eager = []
         for name in names:
+            if name in self.modules or name in self.lazy:
+                log.warning("Tried to load already loaded module %s", name)
+                continue
+
+            functions = self._lazyFunctions(name)
+            if functions:
+                log.info("Module '%s' will be loaded on first '%s'", name, "', '".join(sorted(functions)))
+                self.lazy[name] = functions
+            else:
+                eager.append(name)
+        self.__publish_lazy()
+
+        if not eager:
+            return loadedmodules
+
+        # Imports manipulate sys.path, make sure that happened before going parallel
+        self._addModuleDirectory()
+
+        executor = ThreadPoolExecutor(max_workers=max(1, self.cfg.modules.load_threads),
+                                      thread_name_prefix="ModuleLoader")
+        futures = [(name, executor.submit(self._constructModule, name)) for name in eager]
+        budget = self.cfg.modules.load_budget
+        wait([future for name, future in futures], timeout=budget if budget > 0 else None)
+        executor.shutdown(wait=False)
+
+        for name, future in futures:
+            if not future.done():
+                log.warning("Module '%s' did not load within %.1f seconds, it will be started once loaded",
+                            name, budget)
+                future.add_done_callback(lambda f, name=name: self.call_by_name(self, "_lateModuleLoaded", name, f))
+                continue
+
             try:
-                modinst = self._loadModule_noblock(name)
-                loadedmodules[name] = modinst
+                modinst = future.result()
             except FailedLoadModuleException:
-                pass
+                continue
+
+            self._registerModule(name, modinst)
+            loadedmodules[name] = modinst
 
         return loadedmodules
 
+    def _lateModuleLoaded(self, name, future):
+        """
+        Registers a module that finished loading after loadModules returned
+        and brings it up to the state of its siblings.
+        """
+        try:
+            modinst = future.result()
+        except FailedLoadModuleException:
+            return
+
+        if name in self.modules:
+            self.log().warning("Dropping late instance of already loaded module %s", name)
+            return None
+
+        modqueue = self._registerModule(name, modinst)
+        self.log().info("Module '%s' loaded late", name)
+        if self.modulesStarted:
+            modinst.start()
+            if self.connected:
+                self.__call_remote(modqueue, modinst, "connected")
+        return modinst
+
+    def launchModule(self, name):
+        """
+        Loads a module by name in the background and starts and connects
+        it like its siblings once it is ready. May be called from any thread.
+
+        @param name Name of the module to launch
+        @return Future resolving to the module instance
+        """
+        future = Future()
+        Thread(target=self._launchModule, args=(name, future),
+               name="ModuleLoader", daemon=True).start()
+        return future
+
+    def _launchModule(self, name, future):
+        try:
+            if name in self.modules:
+                raise FailedLoadModuleException("Module '%s' already loaded" % name)
+            self._addModuleDirectory()
+            loaded = Future()
+            loaded.set_result(self._constructModule(name))
+        except Exception as e:
+            future.set_exception(e)
+            return
+
+        modinst = self.call_by_name_blocking(self, "_lateModuleLoaded", name, loaded)
+        if modinst is None:
+            future.set_exception(FailedLoadModuleException("Module '%s' already loaded" % name))
+        else:
+            future.set_result(modinst)
+
+    @local_thread_blocking
+    def unloadModule(self, name):
+        """
+        Unsubscribes and forgets a module and asks it to stop after the
+        events already queued for it. Does not wait for the module thread
+        to finish, join the returned instance for that.
+
+        @param name Name of the module to unload
+        @return The unloaded module instance or None if it was not loaded
+        """
+        self.lazy.pop(name, None)
+        self.__publish_lazy()
+        self.activating.pop(name, None)
+        modinst = self.modules.pop(name, None)
+        if modinst is None:
+            return None
+
+        modqueue = modinst.message_queue()
+        self.__unsubscribe_queue(modqueue)
+        self.queues.pop(modqueue, None)
+        if modinst.is_alive():
+            # Context menus are owned by the module thread, drop them after its last event
+            modqueue.put((None, modinst.manager().dropContextMenus, (), {}))
+            modinst.stop(force=False)
+        return modinst
+
+    def _lazyFunctions(self, name):
+        """
+        Returns the set of functions whose announcement activates the
+        given module or an empty set if it is to be loaded right away.
+        """
+        confpath = self.cfg.modules.cfg_dir + name + '.ini'
+        try:
+            modcfg = Config(confpath, self.module_cfg_default)
+        except Exception:
+            # Leave reporting a broken configuration to the regular load
+            return set()
+
+        if not modcfg.mumo.lazy:
+            return set()
+
+        functions = set(function for function in modcfg.mumo.lazy_events if function)
+        if not functions:
+            self.log().warning("Module '%s' is lazy but declares no lazy_events, loading it now", name)
+        return functions
+
     @local_thread_blocking
     def loadModuleCls(self, name, modcls, module_cfg=None):
         return self._loadModuleCls_noblock(name, modcls, module_cfg)
 
     @debug_log(debug_me)
     def _loadModuleCls_noblock(self, name, modcls, module_cfg=None):
-        log = self.log()
-
         if name in self.modules:
-            log.error("Module '%s' already loaded", name)
+            self.log().error("Module '%s' already loaded", name)
             return
 
-        modqueue = queue.Queue()
+        modinst = self._constructModuleCls(name, modcls, module_cfg)
+        self._registerModule(name, modinst)
+        return modinst
+
+    def _constructModuleCls(self, name, modcls, module_cfg=None):
+        """
+        Instantiates a module class. Safe to call from any thread.
+        """
+        log = self.log()
+
+        modqueue = InstrumentedQueue()
         modmanager = MumoManagerRemote(self, name, modqueue)
 
         try:
@@ -507,11 +1112,19 @@ class MumoManager(Worker):
             log.exception(e)
             raise FailedLoadModuleInitializationException(msg)
 
-        # Remember it
+        modinst.setInstrumentation(self.instrumentation)
+        return modinst
+
+    def _registerModule(self, name, modinst):
+        """
+        Remembers a constructed module. Must be called from the manager thread.
+
+        @return Message queue of the module
+        """
+        modqueue = modinst.message_queue()
         self.modules[name] = modinst
         self.queues[modqueue] = modinst
-
-        return modinst
+        return modqueue
 
     @local_thread_blocking
     def loadModule(self, name):
@@ -533,26 +1146,41 @@ class MumoManager(Worker):
             log.warning("Tried to load already loaded module %s", name)
             return
 
-        # Check whether there is a configuration file for this module
-        confpath = self.cfg.modules.cfg_dir + name + '.ini'
-        if not os.path.isfile(confpath):
-            msg = "Module configuration file '%s' not found" % confpath
-            log.error(msg)
-            raise FailedLoadModuleConfigException(msg)
+        self._addModuleDirectory()
+        modinst = self._constructModule(name)
+        self._registerModule(name, modinst)
+        return modinst
 
-        # Make sure the module directory is in our python path and exists
+    def _addModuleDirectory(self):
+        """
+        Makes sure the module directory is in our python path and exists
+        """
         if not self.cfg.modules.mod_dir in sys.path:
             if not os.path.isdir(self.cfg.modules.mod_dir):
                 msg = "Module directory '%s' not found" % self.cfg.modules.mod_dir
-                log.error(msg)
+                self.log().error(msg)
                 raise FailedLoadModuleImportException(msg)
             sys.path.insert(0, self.cfg.modules.mod_dir)
 
+    def _constructModule(self, name):
+        """
+        Imports and instantiates a module by name. Safe to call from any
+        thread once the module directory was added to the path.
+        """
+        log = self.log()
+
+        # Check whether there is a configuration file for this module
+        confpath = self.cfg.modules.cfg_dir + name + '.ini'
+        if not os.path.isfile(confpath):
+            msg = "Module configuration file '%s' not found" % confpath
+            log.error(msg)
+            raise FailedLoadModuleConfigException(msg)
+
         # Import the module and instanciate it
         try:
             mod = __import__(name)
             self.imports[name] = mod
-        except ImportError as e:
+        except Exception as e:
             msg = "Failed to import module '%s', reason: %s" % (name, str(e))
             log.error(msg)
             raise FailedLoadModuleImportException(msg)
@@ -568,7 +1196,154 @@ class MumoManager(Worker):
             log.error(msg)
             raise FailedLoadModuleInitializationException(msg)
 
-        return self._loadModuleCls_noblock(name, modcls, confpath)
+        return self._constructModuleCls(name, modcls, confpath)
+
+    def reloadModule(self, name):
+        """
+        Replaces a loaded module with a freshly imported and configured
+        instance without interrupting the other modules. May be called
+        from any thread.
+
+        The new instance is constructed in the background. Once it is ready
+        the subscriptions of the old instance are dropped and announcements
+        for the module are held back. The old instance finishes the events
+        already queued for it and hands its exportState() result to the new
+        instance's importState() after the new instance handled connected.
+        The held back announcements are then delivered to whatever the new
+        instance subscribed.
+
+        If the new instance cannot be loaded the old one keeps running.
+
+        @param name Name of the module to reload
+        @return Future resolving to the new module instance
+        """
+        future = Future()
+        Thread(target=self._reloadModule, args=(name, future),
+               name="ModuleReloader", daemon=True).start()
+        return future
+
+    def _reloadModule(self, name, future):
+        log = self.log()
+        with self.reloadLock:
+            try:
+                if name not in self.modules:
+                    raise FailedLoadModuleException("Module '%s' is not loaded" % name)
+                if name not in self.imports:
+                    raise FailedLoadModuleImportException("Module '%s' was not loaded by name" % name)
+
+                log.info("Reloading module '%s'", name)
+                oldimport = self.imports[name]
+                previous = self._forgetImport(name)
+                try:
+                    newinst = self._constructModule(name)
+                except FailedLoadModuleException:
+                    # Keep the code the running instance was created from
+                    self._forgetImport(name)
+                    sys.modules.update(previous)
+                    self.imports[name] = oldimport
+                    raise
+            except Exception as e:
+                future.set_exception(e)
+                return
+
+            old, running, subscriptions = self.call_by_name_blocking(self, "_swapModule", name, newinst)
+
+            state = []
+            if running:
+                export = lambda: state.append(old.exportState())
+                old.message_queue().put((None, export, [], {}))
+                old.stop(force=False)
+                timeout = self.cfg.modules.timeout
+                old.join(timeout)
+                if old.is_alive():
+                    if self.call_by_name_blocking(self, "_restoreModule", name, old, newinst, subscriptions, export):
+                        self._forgetImport(name)
+                        sys.modules.update(previous)
+                        self.imports[name] = oldimport
+                        log.error("Module '%s' did not finish its events within %gs, reload aborted", name, timeout)
+                        future.set_exception(FailedLoadModuleException(
+                            "Module '%s' did not finish its events within %gs" % (name, timeout)))
+                        return
+                    log.warning("Module '%s' did not stop within %gs, its state is lost", name, timeout)
+                    state = []
+            else:
+                state.append(old.exportState())
+
+            if running:
+                newqueue = newinst.message_queue()
+                newinst.start()
+                if self.connected:
+                    self.__call_remote(newqueue, newinst, "connected")
+                if state and state[0] is not None:
+                    newqueue.put((None, newinst.importState, [state[0]], {}))
+                newqueue.put((None, self.call_by_name, [self, "_moduleActivated", name], {}))
+
+            log.info("Module '%s' reloaded", name)
+            future.set_result(newinst)
+
+    def _forgetImport(self, name):
+        """
+        Removes a module and its submodules from the import cache so the
+        next import executes their current code.
+
+        @return Dict of the removed modules
+        """
+        removed = dict((modname, mod) for modname, mod in list(sys.modules.items())
+                       if modname == name or modname.startswith(name + '.'))
+        for modname in removed:
+            del sys.modules[modname]
+        return removed
+
+    def _swapModule(self, name, newinst):
+        """
+        Replaces the registration of a module with a new instance and starts
+        holding back announcements for it. Must run on the manager thread.
+
+        @return Tuple of the old instance, whether it is running and its dropped subscriptions
+        """
+        old = self.modules[name]
+        oldqueue = old.message_queue()
+        subscriptions = self.__unsubscribe_queue(oldqueue)
+        del self.queues[oldqueue]
+
+        newqueue = self._registerModule(name, newinst)
+        running = old.is_alive()
+        if running:
+            oldqueue.put((None, old.manager().dropContextMenus, (), {}))
+            self.activating[name] = (newqueue, [])
+        return old, running, subscriptions
+
+    def _restoreModule(self, name, old, newinst, subscriptions, export):
+        """
+        Undoes _swapModule for an old instance which did not get to its stop
+        request in time. The requests to export its state and stop are taken
+        back and the announcements held back meanwhile are passed to it.
+        Must run on the manager thread.
+
+        @return True if the old instance was restored, False if it already
+                started to stop
+        """
+        oldqueue = old.message_queue()
+        drop = old.manager().dropContextMenus
+        withdraw = getattr(oldqueue, "withdraw", None)
+        if withdraw is None:
+            return False
+
+        removed = withdraw(lambda item: item is None or item[1] is export or item[1] == drop)
+        if None not in removed:
+            return False
+
+        newqueue = newinst.message_queue()
+        self.queues.pop(newqueue, None)
+        self.__unsubscribe_queue(newqueue)
+        self._registerModule(name, old)
+        for mdict, server, handlers in subscriptions:
+            mdict.setdefault(server, {})[oldqueue] = handlers
+        self.__publish_subscriptions()
+
+        self.activating[name] = (oldqueue, self.activating[name][1])
+        self._moduleActivated(name)
+        return True
 
     @local_thread_blocking
     @debug_log(debug_me)
@@ -581,6 +1356,7 @@ class MumoManager(Worker):
         """
         log = self.log()
         startedmodules = {}
+        self.modulesStarted = True
 
         if not names:
             # If no names are given start all models
@@ -644,7 +1420,8 @@ class MumoManager(Worker):
                 log.debug("Module '%s' already stopped", name)
 
         for modinst in stoppedmodules.values():
-            modinst.join(timeout=self.cfg.modules.timeout)
+            if modinst.is_alive():
+                modinst.join(timeout=self.cfg.modules.timeout)
 
         return stoppedmodules
 
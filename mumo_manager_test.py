@@ -29,12 +29,19 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os
+import shutil
+import sys
+import tempfile
+import time
 import unittest
 from logging import getLogger
 from threading import Event
 
+from config import Config
 from mumo_manager import MumoManager
 from mumo_module import MumoModule
+from mumo_replay import drain
 
 
 class MumoManagerTest(unittest.TestCase):
@@ -178,6 +185,426 @@ class MumoManagerTest(unittest.TestCase):
         pass
 
 
+MODULE_SOURCE = '''
+import time
+from mumo_module import MumoModule
+
+time.sleep(%(import_delay)f)
+
+class %(name)s(MumoModule):
+    version = %(version)d
+
+    def __init__(self, name, manager, configuration=None):
+        MumoModule.__init__(self, name, manager, configuration)
+        time.sleep(%(init_delay)f)
+        if %(fail)r:
+            raise RuntimeError("broken")
+        self.events = []
+
+    def connected(self):
+        self.manager().subscribeServerCallbacks(self)
+        time.sleep(%(connect_delay)f)
+
+    def serverCallMe(self, server, arg):
+        self.events.append(arg)
+
+    def exportState(self):
+        return self.events
+
+    def importState(self, state):
+        time.sleep(%(import_state_delay)f)
+        self.events[:0] = state
+'''
+
+
+class ModuleLoadingTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("MumoManager").disabled = True
+        self.dir = tempfile.mkdtemp()
+        self.mod_dir = os.path.join(self.dir, "modules") + os.sep
+        self.cfg_dir = os.path.join(self.dir, "modules-enabled") + os.sep
+        os.mkdir(self.mod_dir)
+        os.mkdir(self.cfg_dir)
+        self.names = []
+
+        self.cfg = Config(default=MumoManager.cfg_default)
+        self.cfg.modules.mod_dir = self.mod_dir
+        self.cfg.modules.cfg_dir = self.cfg_dir
+        self.cfg.modules.slow_handler_threshold = 0
+        self.man = None
+
+    def tearDown(self):
+        if self.man:
+            self.man.stop()
+            self.man.join(timeout=2)
+        for name in self.names:
+            sys.modules.pop(name, None)
+        if self.mod_dir in sys.path:
+            sys.path.remove(self.mod_dir)
+        shutil.rmtree(self.dir)
+
+    def module(self, name, import_delay=0.0, init_delay=0.0, fail=False, mumo="", version=1, connect_delay=0.0):
+        name = "%s_%d" % (name, id(self))
+        self.names.append(name)
+        self.write(name, import_delay=import_delay, init_delay=init_delay, fail=fail, version=version,
+                   connect_delay=connect_delay)
+        with open(self.cfg_dir + name + ".ini", "w") as f:
+            f.write("[mumo]\n" + mumo)
+        return name
+
+    def write(self, name, import_delay=0.0, init_delay=0.0, fail=False, version=1, connect_delay=0.0,
+              import_state_delay=0.0):
+        with open(self.mod_dir + name + ".py", "w") as f:
+            f.write(MODULE_SOURCE % {'name': name, 'import_delay': import_delay,
+                                     'init_delay': init_delay, 'fail': fail, 'version': version,
+                                     'connect_delay': connect_delay, 'import_state_delay': import_state_delay})
+        # Rewrites within the same second must not pick up stale bytecode
+        shutil.rmtree(self.mod_dir + "__pycache__", ignore_errors=True)
+
+    def up(self):
+        self.man = MumoManager(None, None, self.cfg)
+        self.man.start()
+        return self.man
+
+    def testParallelLoad(self):
+        names = [self.module("slow%d" % i, import_delay=0.2, init_delay=0.2) for i in range(4)]
+        man = self.up()
+
+        start = time.time()
+        loaded = man.loadModules()
+        self.assertLess(time.time() - start, 1.2)
+        self.assertEqual(sorted(loaded.keys()), sorted(names))
+
+    def testFailuresAreIsolated(self):
+        good = self.module("good")
+        self.module("broken", fail=True)
+        name = self.module("unimportable")
+        with open(self.mod_dir + name + ".py", "a") as f:
+            f.write("this is not python\n")
+        man = self.up()
+
+        self.assertEqual(list(man.loadModules().keys()), [good])
+        self.assertEqual(list(man.modules.keys()), [good])
+
+    def testLoadBudget(self):
+        self.cfg.modules.load_budget = 0.1
+        fast = self.module("fast")
+        late = self.module("late", init_delay=0.5)
+        man = self.up()
+
+        start = time.time()
+        self.assertEqual(list(man.loadModules().keys()), [fast])
+        self.assertLess(time.time() - start, 0.4)
+        man.startModules()
+        man.announceConnected()
+
+        deadline = time.time() + 2
+        while late not in man.modules and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(man.modules[late].is_alive())
+
+        drain(man)
+        drain(man)
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", "event")
+        drain(man)
+        self.assertEqual(man.modules[late].events, ["event"])
+
+    def testLazyActivation(self):
+        lazy = self.module("lazy", mumo="lazy = true\nlazy_events = serverCallMe\n")
+        eager = self.module("eager")
+        man = self.up()
+
+        self.assertEqual(list(man.loadModules().keys()), [eager])
+        self.assertNotIn(lazy, sys.modules)
+        man.startModules()
+        man.announceConnected()
+        drain(man)
+        drain(man)
+
+        man.announceServer(man.MAGIC_ALL, "otherEvent", "server")
+        self.assertNotIn(lazy, sys.modules)
+
+        # Events announced while activating are buffered, not lost
+        for i in range(3):
+            man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", i)
+        for i in range(3):
+            drain(man)
+
+        self.assertEqual(man.modules[lazy].events, [0, 1, 2])
+        self.assertEqual(man.modules[eager].events, [0, 1, 2])
+        self.assertEqual(man.lazy, {})
+        self.assertEqual(man.activating, {})
+
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 3)
+        drain(man)
+        self.assertEqual(man.modules[lazy].events, [0, 1, 2, 3])
+
+    def testSlowLazyActivation(self):
+        lazy = self.module("lazy", mumo="lazy = true\nlazy_events = serverCallMe\n", connect_delay=0.3)
+        man = self.up()
+        man.loadModules()
+        man.startModules()
+        man.announceConnected()
+        drain(man)
+
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 0)
+        # The subscriptions reach the manager while connected still runs
+        deadline = time.time() + 2
+        while not man.serverSnapshot.get(man.MAGIC_ALL) and time.time() < deadline:
+            time.sleep(0.01)
+        for i in range(1, 4):
+            man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", i)
+        drain(man)
+        time.sleep(0.4)
+        for i in range(4, 6):
+            man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", i)
+        for i in range(3):
+            drain(man)
+
+        self.assertEqual(man.activating, {})
+        self.assertEqual(man.modules[lazy].events, [0, 1, 2, 3, 4, 5])
+
+    def testReload(self):
+        name = self.module("reloaded")
+        other = self.module("other")
+        man = self.up()
+        man.loadModules()
+        man.startModules()
+        man.announceConnected()
+        drain(man)
+        drain(man)
+
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 0)
+        old = man.modules[name]
+        self.write(name, init_delay=0.3, version=2, import_state_delay=0.3)
+        future = man.reloadModule(name)
+
+        # Others keep going while the new instance is constructed
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 1)
+        drain(man)
+        self.assertEqual(man.modules[other].events, [0, 1])
+        self.assertFalse(future.done())
+
+        new = future.result(timeout=2)
+        # The new instance subscribes before it imports the state
+        deadline = time.time() + 2
+        while not man.serverCallbacks[man.MAGIC_ALL].get(new.message_queue()) and time.time() < deadline:
+            time.sleep(0.01)
+        for i in range(2, 4):
+            man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", i)
+        drain(man)
+        time.sleep(0.4)
+        for i in range(4, 6):
+            man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", i)
+        for i in range(3):
+            drain(man)
+
+        self.assertIsNot(new, old)
+        self.assertEqual(new.version, 2)
+        self.assertIs(man.modules[name], new)
+        self.assertFalse(old.is_alive())
+        self.assertEqual(new.events, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(man.modules[other].events, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(man.activating, {})
+
+    def testReloadOfStuckModuleIsAborted(self):
+        name = self.module("stuck")
+        self.cfg.modules.timeout = 0.2
+        man = self.up()
+        man.loadModules()
+        man.startModules()
+        man.announceConnected()
+        drain(man)
+        drain(man)
+
+        old = man.modules[name]
+        release = Event()
+        old.message_queue().put((None, release.wait, [], {}))
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 0)
+
+        self.write(name, version=2)
+        future = man.reloadModule(name)
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 1)
+        with self.assertRaises(Exception):
+            future.result(timeout=2)
+
+        self.assertIs(man.modules[name], old)
+        self.assertEqual(man.activating, {})
+        release.set()
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 2)
+        drain(man)
+        self.assertTrue(old.is_alive())
+        self.assertEqual(old.events, [0, 1, 2])
+        self.assertEqual(sys.modules[name].__dict__[name].version, 1)
+
+    def testFailedReloadKeepsModule(self):
+        name = self.module("reloaded")
+        man = self.up()
+        man.loadModules()
+        man.startModules()
+        man.announceConnected()
+        drain(man)
+        drain(man)
+
+        old = man.modules[name]
+        self.write(name, fail=True, version=2)
+        with self.assertRaises(Exception):
+            man.reloadModule(name).result(timeout=2)
+
+        man.announceServer(man.MAGIC_ALL, "serverCallMe", "server", 0)
+        drain(man)
+        self.assertIs(man.modules[name], old)
+        self.assertEqual(old.events, [0])
+        self.assertEqual(sys.modules[name].__dict__[name].version, 1)
+
+
+class FakeCommunicator(object):
+    def stringToIdentity(self, s):
+        return tuple(s.split("/"))
+
+
+class FakeAdapter(object):
+    """
+    Object adapter keeping default servants by category
+    """
+
+    def __init__(self):
+        self.servants = {}  # {category:servant}
+        self.communicator = FakeCommunicator()
+
+    def getCommunicator(self):
+        return self.communicator
+
+    def addDefaultServant(self, servant, category):
+        assert category not in self.servants
+        self.servants[category] = servant
+
+    def removeDefaultServant(self, category):
+        return self.servants.pop(category)
+
+    def createProxy(self, identity):
+        return identity
+
+    def dispatch(self, proxy, *args):
+        category, name = proxy
+        self.servants[category].contextAction(*args)
+
+
+class FakeContextMurmur(object):
+    class ServerContextCallbackPrx(object):
+        @staticmethod
+        def uncheckedCast(proxy):
+            return proxy
+
+
+class FakeContextCallback(object):
+    def __init__(self, callback):
+        self.contextAction = callback
+
+
+class FakeContextServer(object):
+    def __init__(self, sid):
+        self.sid = sid
+        self.entries = {}  # {(session, action):callback}
+
+    def id(self):
+        return self.sid
+
+    def addContextCallback(self, session, action, text, callback, context):
+        self.entries[(session, action)] = callback
+
+    def removeContextCallback(self, callback):
+        for key, cb in list(self.entries.items()):
+            if cb == callback:
+                del self.entries[key]
+
+    def getState(self, session):
+        return "user%d" % session
+
+
+class FakeUser(object):
+    def __init__(self, session):
+        self.session = session
+
+
+class ContextMenuTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("MumoManager").disabled = True
+
+        class Module(MumoModule):
+            def __init__(self, name, manager, configuration=None):
+                MumoModule.__init__(self, name, manager, configuration)
+                self.used = []
+                self.eused = Event()
+
+            def onUse(self, server, action, user, target):
+                self.used.append((server.id(), action, user.session, target))
+                self.eused.set()
+
+        self.adapter = FakeAdapter()
+        self.man = MumoManager(FakeContextMurmur, FakeContextCallback)
+        self.man.setClientAdapter(self.adapter)
+        self.man.start()
+        self.mod = self.man.loadModuleCls("module", Module)
+        self.man.startModules()
+        self.remote = self.mod.manager()
+
+    def tearDown(self):
+        self.man.stop()
+        self.man.join(2)
+
+    def testSharedServant(self):
+        server = FakeContextServer(1)
+        for session in (1, 2):
+            for action in ("poke", "info"):
+                self.remote.addContextMenuEntry(server, FakeUser(session), action, action, self.mod.onUse, 0)
+        self.remote.addContextMenuEntry(FakeContextServer(2), FakeUser(1), "poke", "Poke", self.mod.onUse, 0)
+
+        # One servant per server, one proxy per action
+        self.assertEqual(len(self.adapter.servants), 2)
+        self.assertEqual(server.entries[(1, "poke")], server.entries[(2, "poke")])
+        self.assertNotEqual(server.entries[(1, "poke")], server.entries[(1, "info")])
+
+        self.adapter.dispatch(server.entries[(2, "info")], "info", FakeUser(2), 1, -1)
+        self.assertTrue(self.mod.eused.wait(1))
+        self.assertEqual(self.mod.used, [(1, "info", 2, "user1")])
+
+    def testRemoveCleansAdapter(self):
+        server = FakeContextServer(1)
+        self.remote.addContextMenuEntry(server, FakeUser(1), "poke", "Poke", self.mod.onUse, 0)
+        self.remote.addContextMenuEntry(server, FakeUser(1), "info", "Info", self.mod.onUse, 0)
+        poke = server.entries[(1, "poke")]
+
+        self.remote.removeContextMenuEntry(server, "poke")
+        self.assertEqual(list(server.entries.keys()), [(1, "info")])
+        self.assertEqual(len(self.adapter.servants), 1)
+
+        # Calls for removed actions still on their way are dropped
+        self.adapter.dispatch(poke, "poke", FakeUser(1), 0, -1)
+        self.remote.removeContextMenuEntry(server, "info")
+        self.remote.removeContextMenuEntry(server, "info")
+        self.assertEqual(server.entries, {})
+        self.assertEqual(self.adapter.servants, {})
+        drain(self.man)
+        self.assertEqual(self.mod.used, [])
+
+    def testChurn(self):
+        servers = [FakeContextServer(sid) for sid in range(1, 5)]
+        for i in range(1000):
+            server = servers[i % len(servers)]
+            action = self.remote.getUniqueAction()
+            self.remote.addContextMenuEntry(server, FakeUser(i), action, "Entry", self.mod.onUse, 0)
+            self.assertLessEqual(len(self.adapter.servants), len(servers))
+            self.remote.removeContextMenuEntry(server, action)
+        self.assertEqual(self.adapter.servants, {})
+
+    def testUnloadDropsServants(self):
+        self.remote.addContextMenuEntry(FakeContextServer(1), FakeUser(1), "poke", "Poke", self.mod.onUse, 0)
+        self.man.unloadModule("module")
+        self.mod.join(2)
+        self.assertEqual(self.adapter.servants, {})
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
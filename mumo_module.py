@@ -86,6 +86,25 @@ class MumoModule(Worker):
 
         pass
 
+    # --- Reload
+
+    def exportState(self):
+        # Called in the module thread of an instance being replaced
+        # by a reload after it handled all events queued for it.
+        # Returns the state to hand to the new instance or None.
+        #
+
+        return None
+
+    def importState(self, state):
+        # Called in the module thread of a reloaded instance right
+        # after connected with what the old instance exported. Only
+        # plain data should be expected here, the classes of the
+        # module itself have been reloaded meanwhile.
+        #
+
+        pass
+
 
 def logModFu(fu):
     def new_fu(self, *args, **kwargs):
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# mumo_replay.py
+# Feeds an event journal recorded by mumo back into a MumoManager
+# without an Ice connection. Used to reproduce production load against
+# modules offline and to benchmark them.
+#
+
+import logging
+import queue
+import sys
+import time
+from optparse import OptionParser
+
+from config import Config
+from journal import KIND_META, KIND_START, readJournal
+from mumo_manager import MumoManager
+
+
+class ReplayServer(object):
+    """
+    Stand-in for the server proxy handed to module callbacks during
+    a replay. Answers id() and counts all other calls, which return None.
+    """
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.calls = {}
+
+    def id(self):
+        return self.sid
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return None
+
+        return call
+
+
+class ReplayType(type):
+    """
+    Metaclass for the structures of ReplayMurmur. Unknown class attributes,
+    e.g. enumerators like UserInfo.UserLastActive, resolve to unique integers.
+    """
+
+    def __getattr__(cls, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        value = len(cls.__dict__)
+        setattr(cls, name, value)
+        return value
+
+
+class ReplayStruct(object, metaclass=ReplayType):
+    def __init__(self, *args, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class ReplayMurmur(object):
+    """
+    Stand-in for the Murmur module generated from the slice file. Names
+    ending in Exception resolve to exception classes, Permission and Context
+    flags to distinct bits and everything else to a structure class taking
+    its members as keyword arguments.
+    """
+
+    def __init__(self):
+        self._flags = 0
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        if name.endswith("Exception"):
+            value = type(name, (Exception,), {})
+        elif name.startswith("Permission") or name.startswith("Context"):
+            value = 1 << self._flags
+            self._flags += 1
+        else:
+            value = ReplayType(name, (ReplayStruct,), {})
+
+        setattr(self, name, value)
+        return value
+
+
+def replay(manager, paths, speed=1.0, server_factory=ReplayServer):
+    """
+    Announces all events recorded in the given journals to the manager.
+
+    @param manager: Running MumoManager to feed
+    @param paths: Journal files in chronological order
+    @param speed: Factor to scale the recorded pace with, 0 replays as fast as possible
+    @param server_factory: Callable returning the server stand-in for a sid
+    @return Number of events replayed
+    """
+    servers = {}
+    count = 0
+    start = None
+
+    for path in paths:
+        for timestamp, kind, sid, function, args, kwargs in readJournal(path, markers=True):
+            if kind == KIND_START:
+                # Skip the time mumo was not running
+                start = None
+                continue
+
+            if speed > 0:
+                if start is None:
+                    start = (timestamp, time.monotonic())
+                delay = (timestamp - start[0]) / speed - (time.monotonic() - start[1])
+                if delay > 0:
+                    time.sleep(delay)
+
+            server = servers.get(sid)
+            if server is None:
+                server = servers[sid] = server_factory(sid)
+
+            if kind == KIND_META:
+                manager.announceMeta(sid, function, server, *args, **kwargs)
+            else:
+                manager.announceServer(sid, function, server, *args, **kwargs)
+            count += 1
+
+    return count
+
+
+def loadConfig(path):
+    """
+    Loads the mumo configuration for a replay. Recording the replayed
+    events is disabled, the journal could be one of those replayed.
+
+    @param path: mumo ini file
+    @return Config
+    """
+    cfg = Config(path, MumoManager.cfg_default)
+    cfg.journal.file = ''
+    return cfg
+
+
+def drain(manager):
+    """
+    Blocks until the manager and all its modules processed every event
+    queued so far.
+
+    @param manager: Running MumoManager
+    """
+    queues = manager.call_by_name_blocking(manager.queues, "copy")
+    for modqueue in queues:
+        out = queue.Queue()
+        modqueue.put((out, lambda: None, [], {}))
+        out.get()
+
+
+#
+# --- Start of program
+#
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [options] JOURNAL [JOURNAL...]')
+    parser.add_option('-i', '--ini',
+                      help='load module configuration from INI', default='mumo.ini')
+    parser.add_option('-s', '--speed', type='float',
+                      help='scale the recorded pace by this factor [default: 1]', default=1.0)
+    parser.add_option('-f', '--fast', action='store_const', const=0.0, dest='speed',
+                      help='replay as fast as possible')
+    parser.add_option('-q', '--quiet', action='store_true',
+                      help='only error output', default=False)
+    (option, args) = parser.parse_args()
+
+    if not args:
+        parser.error('no journal given')
+
+    try:
+        cfg = loadConfig(option.ini)
+    except Exception as e:
+        print('Fatal error, could not load config file from "%s"' % option.ini, file=sys.stderr)
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.ERROR if option.quiet else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    manager = MumoManager(ReplayMurmur(), None, cfg)
+    manager.start()
+    manager.loadModules()
+    manager.startModules()
+    manager.announceConnected()
+
+    start = time.monotonic()
+    events = replay(manager, args, option.speed)
+    drain(manager)
+    elapsed = time.monotonic() - start
+
+    manager.stop()
+    manager.join()
+
+    print('Replayed %d events in %.2fs (%.0f events/s)' % (events, elapsed, events / elapsed if elapsed else 0))
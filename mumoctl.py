@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# mumoctl.py
+# Command line client for the control socket of a running mumo.
+#
+
+import json
+import socket
+import sys
+from optparse import OptionParser
+
+from config import Config
+
+USAGE = """%prog [options] COMMAND [ARGS...]
+
+Commands:
+  list                     list modules with status and queue depth
+  start MODULE             load and start a module
+  stop MODULE              stop and unload a module
+  reload MODULE            reload a module's code and configuration
+  metrics                  dump metrics in the OpenMetrics text format
+  resync                   re-attach callbacks and reconnect all modules
+  loglevel [[LOGGER] LVL]  show or change a log level"""
+
+
+def request(path, command, args=(), timeout=60.0):
+    """
+    Sends a single command to a control socket.
+
+    @param path: Path of the control socket
+    @param command: Command name
+    @param args: Command arguments
+    @param timeout: Seconds to wait for the response
+    @return: Decoded response dict with either 'result' or 'error'
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        with sock.makefile("rwb") as stream:
+            stream.write(json.dumps({'command': command, 'args': list(args)}).encode("utf-8") + b"\n")
+            stream.flush()
+            line = stream.readline()
+
+    if not line:
+        raise ConnectionError("Connection closed without response")
+    return json.loads(line.decode("utf-8"))
+
+
+def format_result(result):
+    if isinstance(result, list):
+        lines = ["%-20s %-10s %s" % ("MODULE", "STATUS", "QUEUE")]
+        lines.extend("%-20s %-10s %d" % (mod['name'], mod['status'], mod['queue']) for mod in result)
+        return "\n".join(lines)
+    elif isinstance(result, dict):
+        return "\n".join("%s: %s" % item for item in sorted(result.items()))
+    return str(result).rstrip("\n")
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage=USAGE)
+    parser.add_option('-i', '--ini',
+                      help='read the control socket path from INI', default='mumo.ini')
+    parser.add_option('-s', '--socket',
+                      help='path of the control socket, overrides INI')
+    parser.add_option('-t', '--timeout', type='float',
+                      help='seconds to wait for a response [default: %default]', default=60.0)
+    (option, args) = parser.parse_args()
+
+    if not args:
+        parser.error('no command given')
+
+    path = option.socket
+    if not path:
+        try:
+            path = Config(option.ini, {'control': (('socket', str, ''),)}).control.socket
+        except Exception as e:
+            parser.error('could not read "%s": %s' % (option.ini, e))
+        if not path:
+            parser.error('no control socket configured in "%s"' % option.ini)
+
+    try:
+        response = request(path, args[0], args[1:], option.timeout)
+    except (OSError, ValueError) as e:
+        print('Could not talk to mumo on "%s": %s' % (path, e), file=sys.stderr)
+        sys.exit(2)
+
+    if not response.get('ok'):
+        print(response.get('error'), file=sys.stderr)
+        sys.exit(1)
+
+    print(format_result(response['result']))
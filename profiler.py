@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# profiler.py
+# Statistical sampling profiler for all threads of mumo writing
+# collapsed stacks suitable for flame graph tools.
+#
+
+import os
+import sys
+import threading
+from logging import getLogger
+from time import monotonic
+
+
+def frameName(frame):
+    code = frame.f_code
+    return "%s (%s)" % (code.co_name, os.path.basename(code.co_filename))
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Periodically samples the stacks of all threads through
+    sys._current_frames() and counts identical stacks.
+
+    Samples of Worker threads are rooted at the worker name and the
+    handler executing at that time, other threads at their thread name.
+    Threads not started by Python (e.g. the Ice thread pools) are
+    grouped as "native".
+
+    The sampling interval is stretched whenever necessary to keep the
+    time spent sampling below max_overhead of the wall clock time.
+    """
+
+    def __init__(self, path, workers=None, interval=0.01, write_interval=60.0, max_overhead=0.01):
+        """
+        @param path: File to write the collapsed stacks to, rewritten on every write
+        @param workers: Callable returning (name, worker) tuples of Workers to attribute samples to
+        @param interval: Seconds between two samples
+        @param write_interval: Seconds between two writes of the output file
+        @param max_overhead: Highest fraction of time to spend sampling
+        """
+        threading.Thread.__init__(self, name="SamplingProfiler")
+        self.daemon = True
+        self.path = path
+        self.workers = workers or (lambda: [])
+        self.interval = interval
+        self.write_interval = write_interval
+        self.max_overhead = max_overhead
+        self.log = getLogger("SamplingProfiler")
+
+        self.stacks = {}  # {collapsed stack:count}
+        self.samples = 0
+        self.sampling_time = 0.0
+        self.started = None
+        self.__stopped = threading.Event()
+
+    def run(self):
+        self.started = monotonic()
+        next_write = self.started + self.write_interval
+        try:
+            while True:
+                start = monotonic()
+                self.sample()
+                cost = monotonic() - start
+                self.sampling_time += cost
+
+                if start >= next_write:
+                    self.write()
+                    next_write = start + self.write_interval
+
+                if self.__stopped.wait(max(self.interval, cost / self.max_overhead)):
+                    break
+        finally:
+            self.write()
+
+    def stop(self):
+        """
+        Stops sampling. The output is written a last time before the thread exits.
+        """
+        self.__stopped.set()
+
+    def sample(self):
+        """
+        Takes a single sample of all threads.
+        """
+        names = {}
+        for thread in threading.enumerate():
+            # Worker replaces the name attribute with an accessor
+            names[thread.ident] = thread.name() if callable(thread.name) else thread.name
+        handlers = {}
+        for name, worker in self.workers():
+            current = worker.currentMessage()
+            names[worker.ident] = name
+            if current is not None:
+                handlers[worker.ident] = getattr(current[0], "__name__", None) or repr(current[0])
+
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(frameName(frame))
+                frame = frame.f_back
+            stack.reverse()
+
+            root = [names.get(ident, "native")]
+            if ident in handlers:
+                root.append(handlers[ident])
+            collapsed = ";".join(root + stack)
+            self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+
+        self.samples += 1
+
+    def overhead(self):
+        """
+        Returns the fraction of wall clock time spent sampling so far.
+        """
+        if self.started is None:
+            return 0.0
+        elapsed = monotonic() - self.started
+        return self.sampling_time / elapsed if elapsed > 0 else 0.0
+
+    def collapsed(self):
+        """
+        Returns the samples in collapsed stack format, one
+        "root;caller;callee count" line per distinct stack.
+        """
+        return "".join("%s %d\n" % item for item in sorted(list(self.stacks.items())))
+
+    def write(self):
+        """
+        Atomically replaces the output file with all samples taken so far.
+        """
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(self.collapsed())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.log.error("Could not write profile to '%s': %s", self.path, e)
+            return
+        self.log.debug("Wrote %d samples to '%s' (overhead %.2f%%)", self.samples, self.path, self.overhead() * 100)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import unittest
+from logging import getLogger
+from threading import Event
+from time import sleep
+
+from mumo_manager import MumoManager
+from profiler import SamplingProfiler
+from worker import Worker, local_thread
+
+
+class BusyWorker(Worker):
+    @local_thread
+    def spin(self, until):
+        while not until.is_set():
+            busyLoop()
+
+
+def busyLoop():
+    sum(range(1000))
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("busy").disabled = True
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "mumo.profile")
+        self.done = Event()
+        self.w = BusyWorker("busy")
+        self.w.start()
+
+    def tearDown(self):
+        self.done.set()
+        self.w.stop()
+        self.w.join(2)
+        shutil.rmtree(self.tmp)
+
+    def testAttribution(self):
+        profiler = SamplingProfiler(self.path, lambda: [("busymodule", self.w)])
+        self.w.spin(self.done)
+        while self.w.currentMessage() is None:
+            sleep(0.001)
+
+        for i in range(20):
+            profiler.sample()
+        self.done.set()
+
+        self.assertEqual(profiler.samples, 20)
+        busy = [(stack, count) for stack, count in profiler.stacks.items() if stack.startswith("busymodule;spin;")]
+        self.assertTrue(busy)
+        self.assertTrue(any("busyLoop (profiler_test.py)" in stack for stack, _ in busy))
+        self.assertFalse(any(stack.startswith("SamplingProfiler") for stack in profiler.stacks))
+
+        profiler.write()
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(sum(int(line.rsplit(" ", 1)[1]) for line in lines), sum(profiler.stacks.values()))
+
+    def testThread(self):
+        profiler = SamplingProfiler(self.path, interval=0.001, write_interval=0.01, max_overhead=0.5)
+        profiler.start()
+        sleep(0.1)
+        self.assertTrue(os.path.exists(self.path))  # Written periodically
+        profiler.stop()
+        profiler.join(2)
+
+        self.assertFalse(profiler.is_alive())
+        self.assertGreater(profiler.samples, 1)
+        self.assertLess(profiler.overhead(), 0.6)
+        with open(self.path) as f:
+            self.assertIn("MainThread;", f.read())
+
+    def testManager(self):
+        getLogger("MumoManager").disabled = True
+        man = MumoManager(None, None)
+        man.start()
+        try:
+            profiler = man.startProfiling(self.path)
+            self.assertTrue(profiler.is_alive())
+            man.stopProfiling()
+            self.assertFalse(profiler.is_alive())
+            self.assertIsNone(man.profiler)
+            self.assertTrue(os.path.exists(self.path))
+        finally:
+            man.stop()
+            man.join(2)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
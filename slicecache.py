@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# slicecache.py
+# On-disk cache of the Python bindings generated from the Murmur
+# slice definition so they do not have to be compiled on every start.
+#
+
+import hashlib
+import importlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from logging import getLogger
+
+# Name the slice is compiled under, generated modules are named after it
+SLICE_NAME = "mumo_slice.ice"
+
+# Module slice2py generates for SLICE_NAME, importing it loads the bindings
+BINDINGS_MODULE = "mumo_slice_ice"
+
+# File marking a complete cache entry, contains the key of the entry
+KEY_FILE = "key"
+
+INCLUDE = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.MULTILINE)
+
+
+class SliceCacheException(Exception):
+    pass
+
+
+def includedFiles(slice_text, include_dirs):
+    """
+    Resolves the files a slice definition includes, directly or through
+    other included files, against the given include directories.
+    Includes which cannot be found are skipped.
+
+    @return List of paths in the order they were found
+    """
+    found = []
+    pending = [slice_text]
+    while pending:
+        for name in INCLUDE.findall(pending.pop()):
+            for directory in include_dirs:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    if path not in found:
+                        found.append(path)
+                        try:
+                            with open(path) as f:
+                                pending.append(f.read())
+                        except (OSError, UnicodeDecodeError):
+                            pass
+                    break
+    return found
+
+
+class SliceCache(object):
+    """
+    Directory of compiled slice bindings keyed by the hash of the slice
+    text, the files it includes, the Ice version and the compiler arguments.
+
+    Entries are compiled into a temporary directory and published with an
+    atomic rename, so a crashed or concurrent mumo never leaves a partial
+    entry behind. Entries which do not match their key are discarded. Only
+    the keep most recently used entries are retained.
+    """
+
+    def __init__(self, directory, keep=4):
+        self.directory = directory
+        self.keep = keep
+        self.log = getLogger("SliceCache")
+
+    @staticmethod
+    def key(slice_text, ice_version, args=()):
+        """
+        @return Hex digest identifying the bindings for the given inputs
+        """
+        digest = hashlib.sha256()
+        for part in [ice_version] + list(args) + [slice_text]:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+
+        include_dirs = [arg[2:] for arg in args if arg.startswith("-I")]
+        for path in includedFiles(slice_text, include_dirs):
+            digest.update(path.encode("utf-8"))
+            digest.update(b"\0")
+            try:
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+            except OSError:
+                pass
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key):
+        """
+        @return Directory of a complete entry for key or None
+        """
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            with open(os.path.join(path, KEY_FILE)) as f:
+                if f.read() == key:
+                    os.utime(path)  # Mark as recently used
+                    return path
+        except OSError:
+            pass
+
+        self.log.warning("Discarding inconsistent slice cache entry '%s'", path)
+        self.discard(key)
+        return None
+
+    def discard(self, key):
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def store(self, key, slice_text, compile):
+        """
+        Compiles the slice into a new entry.
+
+        @param key: Key of the entry
+        @param slice_text: Slice definition to compile
+        @param compile: Callable compile(slice_path, output_dir) generating the
+                        bindings, returns True on success
+        @return Directory of the new entry
+        """
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            source = os.path.join(tmp, SLICE_NAME)
+            with open(source, "w") as f:
+                f.write(slice_text)
+
+            if not compile(source, tmp):
+                raise SliceCacheException("Compiling slice failed")
+
+            os.remove(source)
+            with open(os.path.join(tmp, KEY_FILE), "w") as f:
+                f.write(key)
+
+            try:
+                os.rename(tmp, self.path(key))
+            except OSError:
+                # Published concurrently by someone else
+                if self.lookup(key) is None:
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.prune()
+        return self.path(key)
+
+    def load(self, slice_text, ice_version, args, compile):
+        """
+        Returns the directory containing the bindings for the given slice,
+        compiling them first if they are not cached yet. The directory has
+        to be added to sys.path to import the bindings.
+
+        @param slice_text: Slice definition
+        @param ice_version: Version of Ice the bindings are generated for
+        @param args: Additional compiler arguments, e.g. include directories
+        @param compile: See store
+        """
+        key = self.key(slice_text, ice_version, args)
+        path = self.lookup(key)
+        if path:
+            self.log.debug("Using cached slice bindings from '%s'", path)
+            return path
+
+        start = time.monotonic()
+        path = self.store(key, slice_text, compile)
+        self.log.info("Compiled slice bindings into '%s' in %.2fs", path, time.monotonic() - start)
+        return path
+
+    def importBindings(self, path, module=BINDINGS_MODULE):
+        """
+        Adds an entry returned by load to sys.path and imports its bindings.
+        An entry whose bindings fail to import, e.g. because it was truncated
+        or generated for a different IcePy, is discarded again.
+
+        @return True if the bindings were imported
+        """
+        if path not in sys.path:
+            sys.path.insert(0, path)
+        try:
+            importlib.import_module(module)
+        except (ImportError, SyntaxError) as e:
+            self.log.warning("Discarding slice cache entry '%s' with broken bindings: %s", path, e)
+            sys.path.remove(path)
+            for name, mod in list(sys.modules.items()):
+                if (getattr(mod, "__file__", None) or "").startswith(path + os.sep):
+                    del sys.modules[name]
+            sys.modules.pop(module, None)
+            self.discard(os.path.basename(path))
+            return False
+        return True
+
+    def prune(self):
+        """
+        Removes all but the keep most recently used entries as well as
+        leftovers of interrupted compilations.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if name.startswith(".tmp-"):
+                if time.time() - mtime > 3600:
+                    shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isdir(path):
+                entries.append((mtime, path))
+
+        for _, path in sorted(entries, reverse=True)[self.keep:]:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8
+
+# Copyright (C) 2010 Stefan Hacker <dd0t@users.sourceforge.net>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# - Neither the name of the Mumble Developers nor the names of its
+#   contributors may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# `AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE FOUNDATION OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from logging import getLogger
+
+from slicecache import includedFiles, KEY_FILE, SLICE_NAME, SliceCache, SliceCacheException
+
+SLICE = "module Bench { interface Server { int id(); }; };"
+
+
+class FakeCompiler(object):
+    """
+    Stands in for slice2py by generating a module exposing the slice text.
+    """
+
+    def __init__(self, succeed=True):
+        self.calls = 0
+        self.succeed = succeed
+
+    def __call__(self, source, output_dir):
+        self.calls += 1
+        self.assertSource(source, output_dir)
+        if not self.succeed:
+            return False
+        with open(source) as f:
+            text = f.read()
+        package = os.path.join(output_dir, "slicecachetestbindings")
+        os.mkdir(package)
+        with open(os.path.join(package, "__init__.py"), "w") as f:
+            f.write("SLICE = %r\n" % text)
+        return True
+
+    @staticmethod
+    def assertSource(source, output_dir):
+        assert os.path.basename(source) == SLICE_NAME
+        assert os.path.dirname(source) == output_dir
+
+
+class SliceCacheTest(unittest.TestCase):
+    def setUp(self):
+        getLogger("SliceCache").disabled = True
+        self.tmp = tempfile.mkdtemp()
+        self.dir = os.path.join(self.tmp, "cache")
+        self.cache = SliceCache(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        sys.modules.pop("slicecachetestbindings", None)
+
+    def testKey(self):
+        key = SliceCache.key(SLICE, "3.7.9", ["-I/usr/share/ice/slice"])
+        self.assertEqual(key, SliceCache.key(SLICE, "3.7.9", ["-I/usr/share/ice/slice"]))
+        self.assertNotEqual(key, SliceCache.key(SLICE + " ", "3.7.9", ["-I/usr/share/ice/slice"]))
+        self.assertNotEqual(key, SliceCache.key(SLICE, "3.7.10", ["-I/usr/share/ice/slice"]))
+        self.assertNotEqual(key, SliceCache.key(SLICE, "3.7.9", []))
+
+    def testKeyCoversIncludes(self):
+        include_dir = os.path.join(self.tmp, "include")
+        os.makedirs(os.path.join(include_dir, "Ice"))
+        with open(os.path.join(include_dir, "Ice", "Nested.ice"), "w") as f:
+            f.write("module Ice { };")
+        with open(os.path.join(include_dir, "Ice", "Top.ice"), "w") as f:
+            f.write("#include <Ice/Nested.ice>\n")
+
+        text = '#include <Ice/Top.ice>\n#include "Missing.ice"\n' + SLICE
+        args = ["-I" + include_dir]
+        self.assertEqual(includedFiles(text, [include_dir]),
+                         [os.path.join(include_dir, "Ice", "Top.ice"), os.path.join(include_dir, "Ice", "Nested.ice")])
+
+        key = SliceCache.key(text, "3.7.9", args)
+        with open(os.path.join(include_dir, "Ice", "Nested.ice"), "w") as f:
+            f.write("module Ice { interface Changed {}; };")
+        self.assertNotEqual(SliceCache.key(text, "3.7.9", args), key)
+
+    def testBrokenBindingsAreDiscarded(self):
+        path = self.cache.load(SLICE, "3.7.9", [], FakeCompiler())
+        self.assertTrue(self.cache.importBindings(path, "slicecachetestbindings"))
+        self.assertEqual(sys.path[0], path)
+        sys.path.remove(path)
+        sys.modules.pop("slicecachetestbindings")
+
+        with open(os.path.join(path, "slicecachetestbindings", "__init__.py"), "w") as f:
+            f.write("SLICE = (")
+        self.assertFalse(self.cache.importBindings(path, "slicecachetestbindings"))
+        self.assertNotIn(path, sys.path)
+        self.assertNotIn("slicecachetestbindings", sys.modules)
+        self.assertFalse(os.path.exists(path))
+
+    def testCompileOnce(self):
+        compiler = FakeCompiler()
+        path = self.cache.load(SLICE, "3.7.9", [], compiler)
+        self.assertEqual(self.cache.load(SLICE, "3.7.9", [], compiler), path)
+        self.assertEqual(compiler.calls, 1)
+        self.assertFalse(os.path.exists(os.path.join(path, SLICE_NAME)))
+
+        sys.path.insert(0, path)
+        try:
+            import slicecachetestbindings
+            self.assertEqual(slicecachetestbindings.SLICE, SLICE)
+        finally:
+            sys.path.remove(path)
+
+        # A new Ice version or slice compiles again
+        self.assertNotEqual(self.cache.load(SLICE, "3.7.10", [], compiler), path)
+        self.assertNotEqual(self.cache.load(SLICE + "\n", "3.7.9", [], compiler), path)
+        self.assertEqual(compiler.calls, 3)
+
+    def testFailedCompile(self):
+        self.assertRaises(SliceCacheException, self.cache.load, SLICE, "3.7.9", [], FakeCompiler(False))
+        self.assertEqual(os.listdir(self.dir), [])
+
+        def crash(source, output_dir):
+            raise RuntimeError()
+
+        self.assertRaises(RuntimeError, self.cache.load, SLICE, "3.7.9", [], crash)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def testInconsistentEntry(self):
+        compiler = FakeCompiler()
+        path = self.cache.load(SLICE, "3.7.9", [], compiler)
+
+        with open(os.path.join(path, KEY_FILE), "w") as f:
+            f.write("garbage")
+        self.assertEqual(self.cache.load(SLICE, "3.7.9", [], compiler), path)
+        self.assertEqual(compiler.calls, 2)
+
+        os.remove(os.path.join(path, KEY_FILE))
+        self.assertEqual(self.cache.load(SLICE, "3.7.9", [], compiler), path)
+        self.assertEqual(compiler.calls, 3)
+
+    def testConcurrentPublish(self):
+        compiler = FakeCompiler()
+        key = SliceCache.key(SLICE, "3.7.9", [])
+        other = SliceCache(self.dir)
+
+        def racing(source, output_dir):
+            # Someone else publishes the same entry while we compile
+            other.store(key, SLICE, FakeCompiler())
+            return compiler(source, output_dir)
+
+        self.assertEqual(self.cache.store(key, SLICE, racing), self.cache.path(key))
+        self.assertEqual(os.listdir(self.dir), [key])
+
+    def testPrune(self):
+        cache = SliceCache(self.dir, keep=2)
+        compiler = FakeCompiler()
+        paths = []
+        for version in range(4):
+            paths.append(cache.load(SLICE, "3.7.%d" % version, [], compiler))
+            os.utime(paths[-1], (version, version))
+
+        os.mkdir(os.path.join(self.dir, ".tmp-stale"))
+        os.utime(os.path.join(self.dir, ".tmp-stale"), (0, 0))
+        cache.prune()
+        self.assertEqual(sorted(os.listdir(self.dir)), sorted(os.path.basename(path) for path in paths[2:]))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
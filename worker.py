@@ -32,6 +32,9 @@
 from logging import getLogger
 from queue import Queue, Empty
 from threading import Thread
+from time import monotonic
+
+from instrumentation import InstrumentedQueue, WorkerStatistics
 
 
 def local_thread(fu):
@@ -44,6 +47,8 @@ def local_thread(fu):
         self = args[0]
         self.message_queue().put((None, fu, args, kwargs))
 
+    # Allows hot paths to enqueue the call themselves
+    new_fu.__wrapped__ = fu
     return new_fu
 
 
@@ -80,10 +85,14 @@ class Worker(Thread):
 
         Thread.__init__(self, name=name)
         self.daemon = True
-        self.__in = message_queue if message_queue != None else Queue()
+        self.__in = message_queue if message_queue != None else InstrumentedQueue()
         self.__log = getLogger(name)
         self.__name = name
 
+        self.__instrumented = True
+        self.__statistics = WorkerStatistics()
+        self.__current = None  # (fu, start) of the message being handled
+
     # --- Accessors
     def log(self):
         return self.__log
@@ -94,6 +103,47 @@ class Worker(Thread):
     def message_queue(self):
         return self.__in
 
+    # --- Instrumentation
+    def setInstrumentation(self, enabled):
+        """
+        Enables or disables recording of handler statistics
+
+        @param enabled True to record statistics
+        """
+        self.__instrumented = enabled
+
+    def isInstrumented(self):
+        return self.__instrumented
+
+    def currentMessage(self):
+        """
+        Returns the function currently executed by this worker and the
+        monotonic time its execution started as a tuple, or None if the
+        worker is idle. May be called from any thread.
+        """
+        return self.__current
+
+    def resetStatistics(self):
+        """
+        Drops all recorded handler statistics and the queue peak
+        """
+        self.__statistics = WorkerStatistics()
+        if isinstance(self.__in, InstrumentedQueue):
+            self.__in.resetPeak()
+
+    def statistics(self):
+        """
+        Returns a snapshot of the statistics of this worker. May be
+        called from any thread.
+
+        @return Dictionary with the current and peak queue depth and
+                the statistics of each handler executed so far
+        """
+        return {'enabled': self.__instrumented,
+                'depth': self.__in.qsize(),
+                'peak': getattr(self.__in, "peak", None),
+                'handlers': self.__statistics.snapshot()}
+
     # --- Overridable convience stuff
     def onStart(self):
         """
@@ -117,14 +167,21 @@ class Worker(Thread):
                 break
 
             (out, fu, args, kwargs) = msg
+            statistics = self.__statistics if self.__instrumented else None
+            start = monotonic()
+            self.__current = (fu, start)
+
+            ex = None
             try:
                 res = fu(*args, **kwargs)
-                ex = None
             except Exception as e:
                 self.log().exception(e)
                 res = None
                 ex = e
             finally:
+                self.__current = None
+                if statistics is not None:
+                    statistics.record(fu, getattr(self.__in, "enqueued", None), start, monotonic(), ex is not None)
                 if out is not None:
                     out.put((res, ex))
 